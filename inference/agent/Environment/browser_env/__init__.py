@@ -2,6 +2,10 @@ from enum import Enum
 from playwright.async_api import async_playwright
 import os
 
+from .http_cache import HttpDiskCache
+from .pool import BrowserPool
+from .storage_state import StorageStateStore, site_of
+
 class BrowserType(Enum):
     LOCAL = "local"
     BROWSERBASE = "browserbase"
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+from agent.Utils.artifact_writer import artifact_writer
+from logs import logger
+
+
+CACHED_RESOURCE_TYPES = ["stylesheet", "script", "image", "font"]
+# Playwright hands over decoded bodies, so the headers describing the transfer no longer apply
+DROPPED_HEADERS = ["content-encoding", "content-length", "transfer-encoding"]
+
+
+class HttpDiskCache:
+    """
+    Disk cache of static assets shared by every browser context of the server.
+
+    Pooled contexts are isolated and start with an empty in-memory cache, so every task
+    downloaded the stylesheets, scripts, images and fonts of sites earlier tasks had already
+    loaded. Chromium only keeps a disk cache for persistent profiles, which can't be shared by
+    isolated contexts, so the cache is kept here instead: GET requests for those resource types
+    are routed through `handle`, served from disk while fresh and otherwise fetched and stored.
+
+    Freshness follows max-age or Expires, capped at `max_age_hours`, and `default_ttl_minutes`
+    without them. Responses marked no-store, varying on more than the encoding, or larger than
+    `max_entry_mb` are not stored. Every `prune_interval_seconds`, the oldest entries are removed
+    until the cache is below `max_size_mb`.
+    """
+
+    def __init__(self, enabled: bool = False, path: str = "./output/http_cache", max_size_mb: float = 512,
+                 max_entry_mb: float = 5, max_age_hours: float = 24, default_ttl_minutes: float = 60,
+                 prune_interval_seconds: float = 300):
+        self.enabled = enabled
+        self.path = path
+        self.max_size = max_size_mb * 1024 * 1024
+        self.max_entry = max_entry_mb * 1024 * 1024
+        self.max_age = max_age_hours * 3600
+        self.default_ttl = default_ttl_minutes * 60
+        self.prune_interval = prune_interval_seconds
+        self.last_prune = 0.0
+        self.stats = {"requests": 0, "hits": 0, "misses": 0, "stored": 0, "bytes_from_cache": 0,
+                      "bytes_from_network": 0, "pruned": 0}
+
+    @classmethod
+    def from_config(cls, config: dict = None):
+        config = config or {}
+        return cls(
+            enabled=config.get("enabled", False),
+            path=config.get("path", "./output/http_cache"),
+            max_size_mb=config.get("max_size_mb", 512),
+            max_entry_mb=config.get("max_entry_mb", 5),
+            max_age_hours=config.get("max_age_hours", 24),
+            default_ttl_minutes=config.get("default_ttl_minutes", 60),
+            prune_interval_seconds=config.get("prune_interval_seconds", 300)
+        )
+
+    async def attach(self, context) -> dict:
+        """Route the static assets of `context` through the cache, returns the transfer counters of the context"""
+        if not self.enabled:
+            return None
+        stats = {"requests": 0, "hits": 0, "bytes_from_cache": 0, "bytes_from_network": 0}
+        await context.route("**/*", lambda route: self.handle(route, stats))
+        # Documents and API calls go to the network, their size is only known from the headers
+        context.on("response", lambda response: self._count_response(response, stats))
+        return stats
+
+    def _files(self, url: str) -> tuple:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        folder = os.path.join(self.path, key[:2])
+        return os.path.join(folder, f"{key}.json"), os.path.join(folder, f"{key}.body")
+
+    def _read(self, url: str):
+        meta_path, body_path = self._files(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            if meta["url"] != url or meta["expires"] < time.time():
+                return None
+            with open(body_path, "rb") as file:
+                return meta, file.read()
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def freshness(self, headers: dict) -> float:
+        """Seconds a response may be served from the cache, 0 when it must not be stored"""
+        cache_control = headers.get("cache-control", "").lower()
+        if "no-store" in cache_control:
+            return 0
+        vary = [value.strip().lower() for value in headers.get("vary", "").split(",") if value.strip()]
+        if any(value != "accept-encoding" for value in vary):
+            return 0
+        max_age = re.search(r"(?:s-maxage|max-age)=(\d+)", cache_control)
+        if max_age:
+            return min(int(max_age.group(1)), self.max_age)
+        if "no-cache" in cache_control:
+            return 0
+        if headers.get("expires"):
+            try:
+                return max(0, min(parsedate_to_datetime(headers["expires"]).timestamp() - time.time(), self.max_age))
+            except (TypeError, ValueError):
+                return 0
+        return self.default_ttl
+
+    async def handle(self, route, stats: dict) -> None:
+        request = route.request
+        if request.method != "GET" or request.resource_type not in CACHED_RESOURCE_TYPES:
+            await route.continue_()
+            return
+        stats["requests"] += 1
+        self.stats["requests"] += 1
+        cached = await asyncio.to_thread(self._read, request.url)
+        if cached is not None:
+            meta, body = cached
+            stats["hits"] += 1
+            stats["bytes_from_cache"] += len(body)
+            self.stats["hits"] += 1
+            self.stats["bytes_from_cache"] += len(body)
+            await route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
+            return
+        self.stats["misses"] += 1
+        try:
+            response = await route.fetch()
+            body = await response.body()
+        except Exception:
+            # The page may have closed, or the request failed, let the browser handle it
+            await route.continue_()
+            return
+        stats["bytes_from_network"] += len(body)
+        self.stats["bytes_from_network"] += len(body)
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in DROPPED_HEADERS}
+        ttl = self.freshness(response.headers) if response.status == 200 else 0
+        if ttl > 0 and len(body) <= self.max_entry:
+            meta = {"url": request.url, "status": response.status, "headers": headers,
+                    "expires": time.time() + ttl, "size": len(body)}
+            await artifact_writer.submit_async(_store, *self._files(request.url), meta, body)
+            self.stats["stored"] += 1
+            await self._maybe_prune()
+        await route.fulfill(status=response.status, headers=headers, body=body)
+
+    def _count_response(self, response, stats: dict) -> None:
+        if response.request.resource_type in CACHED_RESOURCE_TYPES:
+            return
+        try:
+            stats["bytes_from_network"] += int(response.headers.get("content-length", 0))
+        except ValueError:
+            pass
+
+    async def _maybe_prune(self) -> None:
+        now = time.monotonic()
+        if now - self.last_prune >= self.prune_interval:
+            self.last_prune = now
+            await artifact_writer.submit_async(self.prune)
+
+    def prune(self) -> int:
+        """Remove expired entries, then the oldest ones until the cache fits `max_size`"""
+        entries, total, now = [], 0, time.time()
+        for folder, _, names in os.walk(self.path):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(folder, name)
+                try:
+                    with open(meta_path, "r", encoding="utf-8") as file:
+                        meta = json.load(file)
+                    entries.append((os.path.getmtime(meta_path), meta_path, meta["size"], meta["expires"]))
+                    total += meta["size"]
+                except (OSError, json.JSONDecodeError, KeyError):
+                    continue
+        removed = 0
+        for modified, meta_path, size, expires in sorted(entries):
+            if expires >= now and total <= self.max_size:
+                continue
+            for path in [meta_path, meta_path[:-len(".json")] + ".body"]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        if removed:
+            self.stats["pruned"] += removed
+            logger.info(f"Pruned {removed} HTTP cache entries, {total / 1024 / 1024:.1f}MB left")
+        return removed
+
+    def metrics(self) -> dict:
+        return {"enabled": self.enabled, **self.stats}
+
+
+def _store(meta_path: str, body_path: str, meta: dict, body: bytes) -> None:
+    # The body goes first, a reader only trusts entries whose metadata exists
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+    with open(body_path, "wb") as file:
+        file.write(body)
+    temporary = f"{meta_path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+    os.replace(temporary, meta_path)
+
+
+__all__ = [
+    "HttpDiskCache"
+]
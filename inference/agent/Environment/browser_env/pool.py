@@ -0,0 +1,70 @@
+import asyncio
+
+from playwright.async_api import async_playwright
+
+from logs import logger
+
+
+class BrowserPool:
+    """
+    Keeps one local Chromium alive per server process and hands out fresh contexts.
+
+    Launching a browser costs seconds while a context costs milliseconds, so tasks share the
+    browser and only get an isolated context each. The semaphore bounds how many tasks drive
+    this process's browser at the same time.
+    """
+
+    def __init__(self, max_contexts: int = 4, headless: bool = True, slow_mo: int = 0):
+        self.max_contexts = max(1, int(max_contexts))
+        self.headless = headless
+        self.slow_mo = slow_mo
+        self.semaphore = asyncio.Semaphore(self.max_contexts)
+        self.lock = asyncio.Lock()
+        self.playwright = None
+        self.browser = None
+        self.contexts = set()
+
+    async def _ensure_browser(self):
+        async with self.lock:
+            if self.browser is None or not self.browser.is_connected():
+                if self.playwright is None:
+                    self.playwright = await async_playwright().start()
+                logger.info("Launching pooled local browser...")
+                self.browser = await self.playwright.chromium.launch(
+                    headless=self.headless,
+                    slow_mo=self.slow_mo
+                )
+            return self.browser
+
+    async def acquire(self, viewport_size: dict, locale: str, storage_state: dict = None):
+        """Wait for a free slot and return a new isolated context on the shared browser"""
+        await self.semaphore.acquire()
+        try:
+            browser = await self._ensure_browser()
+            context = await browser.new_context(viewport=viewport_size, locale=locale, storage_state=storage_state)
+        except BaseException:
+            self.semaphore.release()
+            raise
+        self.contexts.add(context)
+        return context
+
+    async def release(self, context) -> None:
+        if context not in self.contexts:
+            return
+        self.contexts.discard(context)
+        try:
+            await context.close()
+        except Exception as e:
+            logger.warning(f"Failed to close pooled browser context: {str(e)}")
+        finally:
+            self.semaphore.release()
+
+    async def close(self) -> None:
+        for context in list(self.contexts):
+            await self.release(context)
+        if self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
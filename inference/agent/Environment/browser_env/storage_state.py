@@ -0,0 +1,183 @@
+import asyncio
+import json
+import os
+import re
+import time
+from urllib.parse import urlparse
+
+from agent.Utils.artifact_writer import artifact_writer, write_json_atomic
+from logs import logger
+
+
+# Second-level labels under which sites register a third level, like example.co.uk
+SHARED_SECOND_LEVELS = {"co", "com", "net", "org", "gov", "edu", "ac", "ne", "or"}
+
+
+def site_of(host: str) -> str:
+    """Registrable part of a host or cookie domain, which the stored states are keyed by"""
+    labels = (host or "").lower().lstrip(".").split(":")[0].split(".")
+    # Site names are file names, anything that isn't a hostname label is left out
+    labels = [label for label in labels if re.fullmatch(r"[a-z0-9-]+", label)]
+    if len(labels) >= 3 and labels[-2] in SHARED_SECOND_LEVELS and len(labels[-1]) == 2:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+class StorageStateStore:
+    """
+    Cookies and localStorage of the sites earlier tasks finished on, to seed new contexts with.
+
+    Every context starts empty, so each task on a site used to click through its cookie banner,
+    region picker or login again. After a task finishes with an answer, the storage state of
+    its context is split by site and saved for the sites the task visited. A new context gets
+    the states of all stored sites, which Playwright applies when the context is created.
+
+    A state expires `max_age_hours` after it was saved. A site whose seeded tasks end without
+    an answer `max_failures` times in a row is dropped, since a stale login or a consent choice
+    can keep tasks from finishing as well as save them steps. `invalidate` drops one by hand.
+
+    This gives up the isolation between tasks: the states are shared by every task of the server,
+    whoever submitted it, logged-in sessions included. It is off unless enabled in the config.
+    """
+
+    def __init__(self, enabled: bool = False, path: str = "./output/storage_states", max_age_hours: float = 24.0,
+                 max_failures: int = 2, max_sites: int = 50):
+        self.enabled = enabled
+        self.path = path
+        self.max_age = max_age_hours * 3600
+        self.max_failures = max_failures
+        self.max_sites = max_sites
+        self.seeded_sites = []
+        self.saved_sites = []
+        self.visited_sites = []
+        self.finished = None
+
+    @classmethod
+    def from_config(cls, config: dict):
+        store_config = config.get("storage_state", {})
+        return cls(
+            enabled=store_config.get("enabled", False),
+            path=store_config.get("path", "./output/storage_states"),
+            max_age_hours=store_config.get("max_age_hours", 24.0),
+            max_failures=store_config.get("max_failures", 2),
+            max_sites=store_config.get("max_sites", 50)
+        )
+
+    def _file(self, site: str) -> str:
+        return os.path.join(self.path, f"{site}.json")
+
+    def _read(self, site: str):
+        try:
+            with open(self._file(site), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _load(self) -> dict:
+        if not os.path.isdir(self.path):
+            return None
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+            entry = self._read(name[:-len(".json")])
+            if entry is None:
+                continue
+            if now - entry.get("saved_at", 0) > self.max_age:
+                logger.info(f"Storage state of {entry.get('site')} expired")
+                _remove(self._file(entry.get("site", name[:-len(".json")])))
+                continue
+            entries.append(entry)
+        entries = sorted(entries, key=lambda entry: -entry["saved_at"])[:self.max_sites]
+        if not entries:
+            return None
+        self.seeded_sites = [entry["site"] for entry in entries]
+        cookies = [cookie for entry in entries for cookie in entry["cookies"]
+                   if cookie.get("expires", -1) == -1 or cookie["expires"] > now]
+        return {"cookies": cookies, "origins": [origin for entry in entries for origin in entry["origins"]]}
+
+    async def load(self) -> dict:
+        """The storage state to create a context with, None when there is nothing to seed"""
+        if not self.enabled:
+            return None
+        state = await asyncio.to_thread(self._load)
+        if state is not None:
+            logger.info(f"Seeding the browser context with the storage state of {self.seeded_sites}")
+        return state
+
+    def _visit(self, visited_urls: list) -> set:
+        sites = {site_of(urlparse(url).hostname) for url in visited_urls if urlparse(url).scheme in ["http", "https"]}
+        self.visited_sites = sorted(sites)
+        return sites
+
+    async def save(self, context, visited_urls: list) -> list:
+        """Store the state of `context` for the sites of `visited_urls`, after a task finished"""
+        sites = self._visit(visited_urls)
+        self.finished = True
+        if not self.enabled or context is None or not sites:
+            return []
+        state = await context.storage_state()
+        saved_at = time.time()
+        for site in sites:
+            entry = {
+                "site": site,
+                "saved_at": saved_at,
+                "failures": 0,
+                "cookies": [cookie for cookie in state.get("cookies", []) if site_of(cookie.get("domain")) == site],
+                "origins": [origin for origin in state.get("origins", [])
+                            if site_of(urlparse(origin.get("origin", "")).hostname) == site]
+            }
+            if entry["cookies"] or entry["origins"]:
+                artifact_writer.submit(write_json_atomic, self._file(site), entry)
+        self.saved_sites = sorted(sites)
+        logger.info(f"Saved the storage state of {self.saved_sites}")
+        return self.saved_sites
+
+    async def record_failure(self, visited_urls: list) -> None:
+        """A task ended without an answer, the states it was seeded with for `visited_urls` count a failure"""
+        sites = self._visit(visited_urls) & set(self.seeded_sites)
+        self.finished = False
+        if not self.enabled or not sites:
+            return
+        await asyncio.to_thread(self._record_failure, sites)
+
+    def _record_failure(self, sites: set) -> None:
+        for site in sites:
+            entry = self._read(site)
+            if entry is None:
+                continue
+            entry["failures"] = entry.get("failures", 0) + 1
+            if entry["failures"] >= self.max_failures:
+                logger.info(f"Dropping the storage state of {site} after {entry['failures']} unfinished tasks")
+                self.invalidate(site)
+            else:
+                write_json_atomic(self._file(site), entry)
+
+    def invalidate(self, site: str) -> bool:
+        return _remove(self._file(site_of(site)))
+
+    def summary(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "seeded_sites": self.seeded_sites,
+            "visited_sites": self.visited_sites,
+            # Sites the task visited with a state saved by an earlier task
+            "reused_sites": sorted(set(self.visited_sites) & set(self.seeded_sites)),
+            "saved_sites": self.saved_sites,
+            "finished": self.finished
+        }
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+__all__ = [
+    "StorageStateStore",
+    "site_of"
+]
@@ -1,5 +1,7 @@
 from .utils import *
 from .build_tree import *
+from .observation_pool import *
 from .active_elements import *
 from .actions import *
+from .frame import *
 from .async_env import *
@@ -5,9 +5,7 @@ from playwright.async_api import Error as PlaywrightError
 from playwright.sync_api import ViewportSize
 from urllib.parse import urlparse, urljoin
 from beartype import beartype
-from difflib import SequenceMatcher
 
-from PIL import Image
 from io import BytesIO
 import asyncio
 import base64
@@ -15,20 +13,51 @@ import re
 
 from .actions import Action, ActionTypes
 from .build_tree import HTMLTree
+from .frame import Frame, MODEL_IMAGE_WIDTH
+from .option_index import OptionIndex, normalize_option
+from .grounding import GroundingCache, attribute_selectors
+from .search_urls import SearchUrlEngine
+from .observation_pool import parse_observation
 from .utils import stringfy_value
 import time
 
 from agent.Prompt import *
+from agent.Utils.artifact_writer import artifact_writer
 from logs import logger
 import json
 import os
+
+
+async def timed(timings: dict, name: str, awaitable):
+    """Await `awaitable` and record how long it took under `name`"""
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[name] = round(time.perf_counter() - started, 4)
+
+
+# Selects the option at an index of a select if it still has the expected text
+SELECT_OPTION_SCRIPT = """([selector, index, text]) => {
+    var selectElement = document.querySelector(selector);
+    var option = selectElement.options[index];
+    if (!option || option.innerText.replace(/\\s+/g, " ").trim().toLowerCase() !== text) {
+        return false;
+    }
+    option.selected = true;
+    selectElement.dispatchEvent(new Event('change'));
+    return true;
+}"""
+
+
 class ActionExecutionError(Exception):
     """Custom action execution exception class"""
 
-    def __init__(self, action_type, message, selector=None):
+    def __init__(self, action_type, message, selector=None, executed=0):
         self.action_type = action_type
         self.message = message
         self.selector = selector
+        self.executed = executed  # Actions of a batch that completed before this one failed
         super().__init__(message)
 
 class SelectorExecutionError(Exception):
@@ -49,7 +78,17 @@ class AsyncHTMLEnvironment:
         sleep_after_execution: float = 0.0,
         locale: str = "en-US",
         use_vimium_effect=True,
-        browser_env="local"
+        browser_env="local",
+        browser_pool=None,
+        dom_parse_workers: int = 2,
+        inline_parse_max_chars: int = 30000,
+        screenshot_capture: str = "cdp",
+        screenshot_format: str = "jpeg",
+        screenshot_quality: int = 80,
+        screenshot_width: int = MODEL_IMAGE_WIDTH,
+        http_cache=None,
+        search_engine=None,
+        grounding=None
     ):
         self.use_vimium_effect = use_vimium_effect
         self.mode = mode
@@ -64,6 +103,28 @@ class AsyncHTMLEnvironment:
         self.locale = locale
         self.context = None
         self.browser = None
+        self.page = None
+        self.playwright = None
+        self.browser_pool = browser_pool
+        self.dom_parse_workers = dom_parse_workers
+        self.inline_parse_max_chars = inline_parse_max_chars
+        self.screenshot_capture = screenshot_capture
+        self.screenshot_format = screenshot_format
+        self.screenshot_quality = screenshot_quality
+        self.screenshot_width = screenshot_width
+        self.cdp_session = None
+        self.cdp_page = None
+        self.frame = None  # Screenshot of the current page state, dropped when an action runs
+        self.observation_timings = {}
+        self.storage_state = None  # Cookies and localStorage new contexts start with, see StorageStateStore
+        self.http_cache = http_cache
+        self.http_cache_stats = None  # Bytes this task's context fetched and got from the HTTP cache
+        self.search_engine = search_engine or SearchUrlEngine()
+        self.pending_search = None  # Typed fill_search whose results URL the next observation checks
+        self.search_stats = {"direct": 0, "typed": 0, "learned": 0}
+        self.grounding = grounding or GroundingCache()
+        # Actions done with a selector from the grounding cache, recovered with an attribute selector, or failed
+        self.grounding_stats = {"cached": 0, "recovered": 0, "failed": 0}
         self.current_events = []  # Add event queue
         self.events_directory = os.path.join(os.path.dirname(__file__), '..', 'js_event')
         os.makedirs(self.events_directory, exist_ok=True)
@@ -72,19 +133,26 @@ class AsyncHTMLEnvironment:
         self.page = page
 
     async def setup(self, start_url: str) -> None:
-        self.playwright = await async_playwright().start()
-        
         try:
             # Try to connect to BrowserBase first
             browserbase_api_key = os.environ.get('BROWSERBASE_API_KEY')
             if browserbase_api_key:
+                self.playwright = await async_playwright().start()
                 logger.info("Attempting to connect to BrowserBase Cloud Environment...")
                 browser_cdp_url = f"wss://connect.browserbase.com?apiKey={browserbase_api_key}"
                 self.browser = await self.playwright.chromium.connect_over_cdp(browser_cdp_url)
                 self.context = self.browser.contexts[0]  # Use the existing context from BrowserBase
+                if self.storage_state:
+                    # The context already exists, only the cookies can be added to it
+                    await self.context.add_cookies(self.storage_state["cookies"])
                 logger.info("Successfully connected to BrowserBase")
+            elif self.browser_pool is not None:
+                # Reuse the browser of this server process, only the context is per task
+                self.context = await self.browser_pool.acquire(self.viewport_size, self.locale, self.storage_state)
+                logger.info("Acquired browser context from the pool")
             else:
                 # Fallback to local browser if no API key found
+                self.playwright = await async_playwright().start()
                 logger.info("No BrowserBase API key found, launching local browser...")
                 self.browser = await self.playwright.chromium.launch(
                     headless=self.headless,
@@ -92,12 +160,16 @@ class AsyncHTMLEnvironment:
                 )
                 self.context = await self.browser.new_context(
                     viewport=self.viewport_size,
-                    locale=self.locale
+                    locale=self.locale,
+                    storage_state=self.storage_state
                 )
                 logger.info("Local browser launched successfully")
 
             # Set up page handler for both scenarios
             self.context.on("page", self.page_on_handler)
+            if self.http_cache is not None and not browserbase_api_key:
+                # Routing the remote BrowserBase context would send every request over the CDP link
+                self.http_cache_stats = await self.http_cache.attach(self.context)
 
             if start_url:
                 # Use existing or create new page
@@ -115,13 +187,16 @@ class AsyncHTMLEnvironment:
                 lambda source, selector, event_type, element_info: self._handle_event(selector, event_type, element_info)
             )
 
-        except Exception as e:
+        except BaseException as e:
             logger.error(f"Failed to setup browser environment: {str(e)}")
             # Cleanup in case of failure
+            if self.browser_pool is not None and self.context is not None:
+                await self.browser_pool.release(self.context)
             if hasattr(self, 'browser') and self.browser:
                 await self.browser.close()
             if hasattr(self, 'playwright') and self.playwright:
                 await self.playwright.stop()
+            self.context, self.browser, self.playwright = None, None, None
             raise
 
     async def _event_listener(self):
@@ -219,49 +294,66 @@ class AsyncHTMLEnvironment:
                 self.current_events = self.current_events[-100:]
             
             # Save to file for debugging purposes
-            self._save_event_to_file(current_event)
+            await self._save_event_to_file(current_event)
             
         except Exception as e:
             logger.error(f"Error handling event: {str(e)}")
 
-    def _save_event_to_file(self, current_event):
+    async def _save_event_to_file(self, current_event):
         file_path = os.path.join(self.events_directory, "current_event.json")
-        try:
-            events = []
-            if os.path.exists(file_path):
-                with open(file_path, "r", encoding="utf-8") as json_file:
-                    events = json.load(json_file)
-            events.append(current_event)
-            with open(file_path, "w", encoding="utf-8") as json_file:
-                json.dump(events, json_file, indent=4, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f"Error saving event to file: {str(e)}")
+        await artifact_writer.append_json_async(file_path, current_event)
 
     def get_latest_events(self, count=1):
         """Get the latest events"""
         return self.current_events[-count:] if self.current_events else []
 
     async def get_obs(self) -> Union[str, Tuple[str, str]]:
+        """
+        Observe the current page. The title and, in vision modes, the screenshot are requested
+        before the DOM is parsed, so the browser produces them while Python builds the tree and
+        all three describe the page as the last action left it. Per-component timings in seconds
+        are kept in `observation_timings`.
+        """
         observation = ""
         observation_VforD = ""
+        self.frame = None
+        vision = self.mode in ["d_v", "dom_v_desc", "vision_to_dom"]
+        timings = self.observation_timings = {}
+        started = time.perf_counter()
+        pending = []
         try:
             if not self.html_content.strip():
-                self.html_content = await self.retry_content()
-            self.tree.fetch_html_content(self.html_content)
+                # Reloads the page, so it has to happen before the title and screenshot
+                self.html_content = await timed(timings, "content", self.retry_content())
+            title_task = asyncio.ensure_future(timed(timings, "title", self.page.title()))
+            pending.append(title_task)
+            if vision:
+                frame_task = asyncio.ensure_future(timed(timings, "screenshot", self.capture_frame()))
+                pending.append(frame_task)
+            # Let the requests go out before an inline parse holds the event loop
+            await asyncio.sleep(0)
+            dom_tree = await timed(timings, "parse", parse_observation(
+                self.tree, self.html_content, self.dom_parse_workers, self.inline_parse_max_chars, self.page.url))
             logger.info("-- Successfully fetch html content")
-            tab_name = await self.page.title()
-            dom_tree = self.tree.build_dom_tree()
+            tab_name = await title_task
             observation = f"current web tab name is \'{tab_name}\'\n" + dom_tree
-            if self.mode in ["d_v", "dom_v_desc", "vision_to_dom"]:
-                observation_VforD = await self.capture()
+            if vision:
+                frame = await frame_task
+                observation_VforD = await timed(timings, "encode", frame.encoded(self.screenshot_width))
+                logger.info("Successfully fetch html content with observation_VforD")
         except Exception as e:
             logger.error(f"-- Failed to fetch html content,error occur {e}")
-        if self.mode in ["d_v", "dom_v_desc", "vision_to_dom"]:
-            is_valid, message = is_valid_base64(
-                observation_VforD)
-            logger.info(
-                "Successfully fetch html content with observation_VforD:", message)
-        return (observation, observation_VforD) if self.mode in ["d_v", "dom_v_desc", "vision_to_dom"] else observation
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+        timings["total"] = round(time.perf_counter() - started, 4)
+        logger.info(f"-- Observation timings: {timings}")
+        if self.pending_search is not None and self.page is not None:
+            if self.search_engine.observe(self.pending_search, self.page.url):
+                self.search_stats["learned"] += 1
+            self.pending_search = None
+        return (observation, observation_VforD) if vision else observation
 
     async def reset(self, start_url: str = ""):
         await self.setup(start_url)
@@ -289,7 +381,7 @@ class AsyncHTMLEnvironment:
                 await self.page.goto(url, timeout=10000)
                 await self.page.wait_for_timeout(2000)
                 self.html_content = await self.page.content()
-            except:
+            except Exception:
                 try:
                     # self.last_page = self.page
                     selector = rf"{selector}"
@@ -305,8 +397,8 @@ class AsyncHTMLEnvironment:
         else:
             try:
                 try:
-                    await self.page.locator(selector).click()
-                except:
+                    await self.with_grounding(element_id, selector, lambda target: self.page.locator(target).click())
+                except Exception:
                     selector = rf"{selector}"
                     await self.page.evaluate(f'''(selector) => {{
                         var element = document.querySelector(selector);
@@ -324,6 +416,7 @@ class AsyncHTMLEnvironment:
         self.html_content = await self.page.content()
 
     async def fill_search(self, action):
+        selector, label, element_id = None, None, None
         try:
             label, element_id = self.tree.get_tag_name(
                 self.tree.elementNodes[action["element_id"]])
@@ -334,12 +427,23 @@ class AsyncHTMLEnvironment:
         except Exception as e:
             logger.error(
                 f"selector:{selector},label_name:{label},element_id: {element_id},error ({e}) in fill_search action.")
+        if element_id is None:
+            # execute_action reports it as the failed fill_search
+            raise ValueError(f"Element {action['element_id']} is not in the observation")
+        attributes = self.tree.elementNodes[element_id]["attributes"]
+        if await self.search_directly(attributes, stringfy_value(action['fill_text'])):
+            return
+        self.pending_search = self.search_engine.expect(self.page.url, attributes, stringfy_value(action['fill_text']))
+        self.search_stats["typed"] += 1
         try:
             value = stringfy_value(action['fill_text'])
-            await self.page.locator(selector).fill(value)
-            await self.page.locator(selector).press("Enter")
+
+            async def submit(target):
+                await self.page.locator(target).fill(value)
+                await self.page.locator(target).press("Enter")
+            await self.with_grounding(element_id, selector, submit)
             self.html_content = await self.page.content()
-        except:
+        except Exception:
             try:
                 selector = rf"{selector}"
                 value = stringfy_value(action['fill_text'])
@@ -370,9 +474,9 @@ class AsyncHTMLEnvironment:
                 f"selector:{selector},label_name:{label},element_id: {element_id},error ({e}) in fill_form action.")
         try:
             value = stringfy_value(action['fill_text'])
-            await self.page.locator(selector).fill(value)
+            await self.with_grounding(element_id, selector, lambda target: self.page.locator(target).fill(value))
             self.html_content = await self.page.content()
-        except:
+        except Exception:
             try:
                 selector = rf"{selector}"
                 value = stringfy_value(action['fill_text'])
@@ -388,9 +492,107 @@ class AsyncHTMLEnvironment:
             except Exception as e:
                 raise e
 
+    async def matches_one(self, selector: str) -> bool:
+        try:
+            return await self.page.locator(selector).count() == 1
+        except Exception:
+            return False
+
+    async def with_grounding(self, element_id: int, selector: str, operation) -> str:
+        """
+        Run `operation(selector)` on an element, returns the selector it worked with.
+
+        The selector that worked for an element like it before comes first, while it selects by
+        one of the element's attributes and matches exactly one element, then the tree's selector, then one from the element's attributes that does,
+        see GroundingCache. The tree's selector is tried first when nothing else matches, like
+        before. Raises its error when nothing worked, so the JS fallbacks of the actions still run.
+        """
+        # What the previous actions learned is written by the artifact writer, off this action
+        await self.grounding.save_if_due()
+        node = self.tree.elementNodes[element_id]
+        key = self.grounding.key(self.page.url, self.tree.get_tag_name(node)[0],
+                                 self.tree.element_value.get(str(element_id)))
+        cached = self.grounding.lookup(key, node["tagName"], node["attributes"])
+        if cached is not None and cached != selector:
+            if await self.matches_one(cached):
+                try:
+                    await operation(cached)
+                    self.grounding.record(key, cached, True)
+                    self.grounding_stats["cached"] += 1
+                    return cached
+                except Exception as e:
+                    logger.info(f"Cached selector {cached} failed ({e}), trying the tree's")
+            self.grounding.record(key, cached, False)
+        candidates = [candidate for candidate in attribute_selectors(node["tagName"], node["attributes"])
+                      if candidate not in [selector, cached]]
+        error = None
+        # The tree's selector would wait for the locator timeout, a unique attribute selector won't
+        skipped = bool(candidates) and not await self.matches_one(selector)
+        if not skipped:
+            try:
+                await operation(selector)
+                self.grounding.record(key, selector, True)
+                return selector
+            except Exception as e:
+                error = e
+        for candidate in candidates:
+            if not await self.matches_one(candidate):
+                continue
+            try:
+                await operation(candidate)
+            except Exception:
+                self.grounding.record(key, candidate, False)
+                break
+            logger.info(f"Selector {selector} failed, {candidate} worked")
+            self.grounding.record(key, candidate, True)
+            self.grounding_stats["recovered"] += 1
+            return candidate
+        if skipped:
+            # No attribute selector either, leave it to the locator to wait for the element like before
+            try:
+                await operation(selector)
+                return selector
+            except Exception as e:
+                error = e
+        self.grounding_stats["failed"] += 1
+        raise error
+
+    async def search_directly(self, attributes: dict, query: str) -> bool:
+        """Go to the results URL of a fill_search when the site's search URL is known, see SearchUrlEngine"""
+        original_url = self.page.url
+        url = self.search_engine.direct_url(original_url, attributes, query)
+        if url is None:
+            return False
+        try:
+            response = await self.page.goto(url, timeout=20000, wait_until="domcontentloaded")
+            loaded = response is None or response.ok
+        except PlaywrightError as e:
+            logger.info(f"Search URL {url} failed to load ({e}), typing the query instead")
+            loaded = False
+        if not loaded:
+            self.search_engine.forget(url)
+            # A goto that failed before committing left no history entry to go back from
+            try:
+                await self.page.goto(original_url, timeout=30000, wait_until="domcontentloaded")
+            except PlaywrightError as e:
+                logger.info(f"Failed to return to {original_url} ({e}), typing the query where the page is")
+            return False
+        await self.wait_for_load(2000)
+        self.search_stats["direct"] += 1
+        self.html_content = await self.page.content()
+        return True
+
+    async def wait_for_load(self, timeout: float) -> None:
+        """Wait for the load event, at most `timeout` milliseconds, results pages are usable before it"""
+        try:
+            await self.page.wait_for_load_state("load", timeout=timeout)
+        except PlaywrightError:
+            pass
+
     async def search(self, action):
-        await self.page.goto("https://www.google.com/search?q="+action["fill_text"], timeout=30000)
-        await self.page.wait_for_timeout(2000)
+        await self.page.goto(self.search_engine.search_url(stringfy_value(action["fill_text"])), timeout=30000,
+                             wait_until="domcontentloaded")
+        await self.wait_for_load(2000)
         self.html_content = await self.page.content()
 
     async def go_back_last_page(self, action):
@@ -413,50 +615,8 @@ class AsyncHTMLEnvironment:
                 f"selector:{selector},label_name:{label},element_id: {element_id},error ({e}) in select_option action.")
         try:
             selector = rf"{selector}"
-            optgroup_values = await self.page.evaluate(f'''(selector) => {{
-                var values = [];
-                var selectElement = document.querySelector(selector);
-                var options = selectElement.querySelectorAll('option');
-                for (var option of options) {{
-                    values.push(option.innerText);
-                }}
-                var optgroups = selectElement.querySelectorAll('optgroup');
-                for (var optgroup of optgroups) {{
-                    var options = optgroup.querySelectorAll('option');
-                    for (var option of options) {{
-                        values.push(option.innerText);
-                    }}   
-                }}
-                return values;
-            }}''', selector)
-            best_option = [-1, "", -1]
-            for i, option in enumerate(optgroup_values):
-                similarity = SequenceMatcher(
-                    None, option, action['fill_text']).ratio()
-                if similarity > best_option[2]:
-                    best_option = [i, option, similarity]
-            await self.page.evaluate(f'''(selector) => {{
-                var selectElement = document.querySelector(selector);
-                var options = selectElement.querySelectorAll('option');
-                for (var option of options) {{
-                    if (option.innerText === "{best_option[1]}") {{
-                        option.selected = true;
-                        selectElement.dispatchEvent(new Event('change'));
-                        return;
-                    }}
-                }}
-                var optgroups = selectElement.querySelectorAll('optgroup');
-                for (var optgroup of optgroups) {{
-                    var options = optgroup.querySelectorAll('option');
-                    for (var option of options) {{
-                        if (option.innerText === "{best_option[1]}") {{
-                            option.selected = true;
-                            selectElement.dispatchEvent(new Event('change'));
-                            return;
-                        }}
-                    }}
-                }}
-            }}''', selector)
+            await self.with_grounding(
+                element_id, selector, lambda target: self.choose_option(target, action['fill_text'], element_id))
             await self.page.wait_for_timeout(2000)
             self.html_content = await self.page.content()
         except Exception as e:
@@ -474,9 +634,9 @@ class AsyncHTMLEnvironment:
             logger.error(
                 f"selector:{selector},label_name:{label},element_id: {element_id},error ({e}) in hover action.")
         try:
-            await self.page.hover(selector)
+            await self.with_grounding(element_id, selector, lambda target: self.page.hover(target))
             self.html_content = await self.page.content()
-        except:
+        except Exception:
             hover = '''() => {
                         var element = document.querySelector('%s');
                         if (element) {
@@ -502,7 +662,7 @@ class AsyncHTMLEnvironment:
                 scroll_amount = current_scroll + viewport_height * 0.75
                 await self.page.evaluate(f"window.scrollTo(0, {scroll_amount})")
             self.html_content = await self.page.content()
-        except:
+        except Exception:
             await self.page.mouse.wheel(0, 100)
             self.html_content = await self.page.content()
 
@@ -517,13 +677,14 @@ class AsyncHTMLEnvironment:
                     scroll_amount = current_scroll - viewport_height / 2
                 await self.page.evaluate(f"window.scrollTo(0, {scroll_amount})")
             self.html_content = await self.page.content()
-        except:
+        except Exception:
             await self.page.mouse.wheel(0, -100)
             self.html_content = await self.page.content()
 
     async def execute_action(self, action: Action) -> Union[str, Tuple[str, str]]:
         """
         """
+        self.frame = None
         await self._event_listener()
         if "element_id" in action and action["element_id"] != 0:
             # logger.info(f'action["element_id"]:{action["element_id"]}')
@@ -630,6 +791,26 @@ class AsyncHTMLEnvironment:
                 raise ValueError(
                     f"Unknown action type {action['action_type']}"
                 )
+    async def execute_actions(self, actions: list) -> int:
+        """
+        Execute a batch of actions planned on the same observation, in order.
+
+        The element ids of the batch refer to the page they were planned on, so the batch stops
+        as soon as an action navigates away. Returns the number of executed actions, a failing
+        action raises its ActionExecutionError with `executed` set to the actions before it.
+        """
+        for executed, action in enumerate(actions):
+            url = self.page.url
+            try:
+                await self.execute_action(action)
+            except ActionExecutionError as e:
+                e.executed = executed
+                raise
+            if self.page.url != url and executed + 1 < len(actions):
+                logger.info(f"Page navigated to {self.page.url}, skipping the remaining {len(actions) - executed - 1} actions")
+                return executed + 1
+        return len(actions)
+
     async def get_page(self, element_id: int) -> Tuple[Page, str]:
         try:
             selector = self.tree.get_selector(element_id)
@@ -638,9 +819,19 @@ class AsyncHTMLEnvironment:
         return self.page, selector
 
     async def close(self):
-        await self.context.close()
-        await self.browser.close()
-        await self.playwright.stop()
+        # Jobs may be cancelled while setup is still in progress, so only release what exists
+        if self.context is not None:
+            if self.browser_pool is not None and self.browser is None:
+                await self.browser_pool.release(self.context)
+            else:
+                await self.context.close()
+            self.context = None
+        if self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+        if getattr(self, "playwright", None) is not None:
+            await self.playwright.stop()
+            self.playwright = None
 
     @staticmethod
     def encode_and_resize(image):
@@ -653,23 +844,66 @@ class AsyncHTMLEnvironment:
         encoded_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
         return encoded_image
 
-    async def capture(self) -> Image:
+    async def capture_frame(self, reuse: bool = True) -> Frame:
+        """Screenshot of the current page state, taken once and shared until the next action"""
         if not self.page:
             raise ValueError("Page not initialized or loaded.")
-        screenshot_bytes = ""
+        if reuse and self.frame is not None and self.frame.url == self.page.url:
+            return self.frame
         for i in range(6):
             try:
-                screenshot_bytes = await self.page.screenshot()
-                break
-            except:
+                self.frame = await self.screenshot()
+                return self.frame
+            except Exception:
                 logger.info(
-                    "Capture screenshot_bytes failed for", i+1, "times")
+                    f"Capture screenshot_bytes failed for {i+1} times")
                 await asyncio.sleep(1)
-        screenshot = Image.open(BytesIO(screenshot_bytes)).convert("RGB")
-        encoded_screenshot = self.encode_and_resize(screenshot)
-        is_valid, message = is_valid_base64(
-            encoded_screenshot)
-        return encoded_screenshot
+        self.frame = Frame(b"", self.page.url)
+        return self.frame
+
+    async def screenshot(self) -> Frame:
+        if self.screenshot_capture == "cdp":
+            try:
+                return await self.cdp_screenshot()
+            except PlaywrightError as e:
+                # Only Chromium speaks CDP, other browsers take the Playwright screenshot
+                logger.warning(f"CDP screenshot unavailable ({e}), using Playwright screenshots")
+                self.screenshot_capture = "playwright"
+        options = {"type": self.screenshot_format, "scale": "css"}
+        if self.screenshot_format == "jpeg":
+            options["quality"] = self.screenshot_quality
+        return Frame(await self.page.screenshot(**options), self.page.url,
+                     self.screenshot_format, self.screenshot_quality)
+
+    async def cdp_screenshot(self) -> Frame:
+        """
+        Let the browser scale the viewport to `screenshot_width` and compress it, the base64
+        it returns is sent to the models as is.
+        """
+        if self.cdp_page is not self.page:
+            self.cdp_session = await self.page.context.new_cdp_session(self.page)
+            self.cdp_page = self.page
+        metrics = await self.cdp_session.send("Page.getLayoutMetrics")
+        viewport = metrics["cssVisualViewport"]
+        params = {
+            "format": self.screenshot_format,
+            "clip": {
+                "x": viewport["pageX"],
+                "y": viewport["pageY"],
+                "width": viewport["clientWidth"],
+                "height": viewport["clientHeight"],
+                "scale": self.screenshot_width / viewport["clientWidth"]
+            }
+        }
+        if self.screenshot_format == "jpeg":
+            params["quality"] = self.screenshot_quality
+        result = await self.cdp_session.send("Page.captureScreenshot", params)
+        return Frame.from_base64(result["data"], self.screenshot_width, self.page.url,
+                                 self.screenshot_format, self.screenshot_quality)
+
+    async def capture(self) -> str:
+        frame = await self.capture_frame(reuse=False)
+        return await frame.encoded(self.screenshot_width)
 
     @staticmethod
     async def is_valid_element(page: Page, selector: str):
@@ -733,55 +967,32 @@ class AsyncHTMLEnvironment:
         await self.page.wait_for_timeout(20000)
 
     async def test_select_option_action(self, selector, value):
-        # Get all option values from select element including optgroups
-        optgroup_values = await self.page.evaluate(f'''(selector) => {{
-                var values = [];
-                var selectElement = document.querySelector(selector);
-                var options = selectElement.querySelectorAll('option');
-                for (var option of options) {{
-                    values.push(option.innerText);
-                }}
-                var optgroups = selectElement.querySelectorAll('optgroup');
-                for (var optgroup of optgroups) {{
-                    var options = optgroup.querySelectorAll('option');
-                    for (var option of options) {{
-                        values.push(option.innerText);
-                    }}   
-                }}
-                return values;
-            }}''', selector)
+        await self.choose_option(selector, value)
+        await self.page.wait_for_timeout(2000)
 
-        # Find best matching option using string similarity
-        best_option = [-1, "", -1]
-        for i, option in enumerate(optgroup_values):
-            similarity = SequenceMatcher(None, option, value).ratio()
-            if similarity > best_option[2]:
-                best_option = [i, option, similarity]
+    async def choose_option(self, selector: str, value: str, element_id: int = None) -> str:
+        """
+        Select the option of the select at `selector` that best matches `value`, returns its text.
 
-        # Select the best matching option and trigger change event
-        await self.page.evaluate(f'''(selector) => {{
-            var selectElement = document.querySelector(selector);
-            var options = selectElement.querySelectorAll('option');
-            for (var option of options) {{
-                if (option.innerText === "{best_option[1]}") {{
-                    option.selected = true;
-                    selectElement.dispatchEvent(new Event('change'));
-                    return;
-                }}
-            }}
-            var optgroups = selectElement.querySelectorAll('optgroup');
-            for (var optgroup of optgroups) {{
-                var options = optgroup.querySelectorAll('option');
-                for (var option of options) {{
-                    if (option.innerText === "{best_option[1]}") {{
-                        option.selected = true;
-                        selectElement.dispatchEvent(new Event('change'));
-                        return;
-                    }}
-                }}
-            }}
-        }}''', selector)
-        await self.page.wait_for_timeout(2000)
+        The options captured with the observation are matched with their OptionIndex and the
+        option is selected by index in one page call, which checks that the option at that index
+        still has the matched text. When the options are unknown or changed since the
+        observation, they are read from the page and matched once more.
+        """
+        option_index = self.tree.get_option_index(element_id) if element_id is not None else None
+        for _ in range(2):
+            if option_index is None:
+                option_index = OptionIndex(await self.page.evaluate(
+                    "(selector) => Array.from(document.querySelector(selector).options, option => option.innerText)",
+                    selector))
+            index, text, similarity = option_index.match(value)
+            if index < 0:
+                raise ValueError(f"No option to select in {selector}")
+            selected = await self.page.evaluate(SELECT_OPTION_SCRIPT, [selector, index, normalize_option(text)])
+            if selected:
+                return text
+            option_index = None
+        raise ValueError(f"Options of {selector} changed while selecting {value}")
 
     async def test_fill_form_action(self, selector, value):
         # Set input value and trigger input event
@@ -1,9 +1,11 @@
 from collections import deque
 from lxml.html import etree
 from io import StringIO
+from urllib.parse import urljoin
 
-from .utils import ElementNode, TagNameList, MapTagNameList, stringfy_selector
+from .utils import ElementNode, TagNameList, MapTagNameList, NonFieldInputTypes, stringfy_selector
 from .active_elements import ActiveElements
+from .option_index import OptionIndex
 
 
 import copy
@@ -19,6 +21,10 @@ class HTMLTree:
         self.nodeCounts: int
         self.nodeDict = {}
         self.element_value = {}
+        self.link_index = {}
+        self.select_options = {}
+        self.option_indexes = {}
+        self.snapshot_elements = {}
 
     def fetch_html_content(self, html_content) -> str:
         self.__init__()
@@ -108,6 +114,8 @@ class HTMLTree:
         return "/" + current_tag_name + locator_str
 
     def get_selector(self, idx: int) -> str:
+        if idx in self.snapshot_elements:
+            return self.snapshot_elements[idx]["selector"]
         selector_str = ""
         current_node = self.elementNodes[idx]
         while current_node["parentId"] != -1:
@@ -191,6 +199,8 @@ class HTMLTree:
         return html_content
 
     def get_tag_name(self, element: ElementNode) -> (str, int):  # type: ignore
+        if element["nodeId"] in self.snapshot_elements:
+            return tuple(self.snapshot_elements[element["nodeId"]]["tag"])
         tag_name = ActiveElements.get_element_tagName(element)
         tag_idx = element["nodeId"]
         if tag_name == "unknown":
@@ -204,7 +214,7 @@ class HTMLTree:
                 return ("statictext", tag_idx)
         return (tag_name, tag_idx)
 
-    def build_dom_tree(self) -> str:
+    def build_dom_tree(self, base_url: str = "") -> str:
         root = self.pruningTreeNode[0]
         stack = [root]
         contents = ""
@@ -222,13 +232,45 @@ class HTMLTree:
                         contents += "  " * (node["depth"]-1) + "[" + str(num) + "] " + tag_name + \
                             " " + f"\'{content_text}\'" + "\n"
                         self.element_value[str(tag_idx)] = content_text
+                        if tag_name == "link":
+                            self.index_link(num, tag_idx, content_text, base_url)
+                        elif self.elementNodes[tag_idx]["tagName"] == "select":
+                            self.index_select_options(tag_idx)
             children = []
             for child_id in node["childIds"]:
                 children.append(self.pruningTreeNode[child_id])
             stack.extend(reversed(children))
         return contents
 
+    def index_link(self, num: int, tag_idx: int, text: str, base_url: str) -> None:
+        """Record the absolute href of a link by its observation id, so answers can cite links by id"""
+        href = str(self.elementNodes[tag_idx]["attributes"].get("href", "")).strip()
+        if not href or href.startswith(("javascript:", "#", "mailto:", "tel:")):
+            return
+        self.link_index[num] = {"href": urljoin(base_url, href) if base_url else href, "text": text}
+
+    def index_select_options(self, tag_idx: int) -> None:
+        """Record the option texts of a select in document order, the order of its `options` in the page"""
+        options = []
+        stack = list(reversed(self.elementNodes[tag_idx]["childIds"]))
+        while stack:
+            node = self.elementNodes[stack.pop()]
+            if node["tagName"] == "option":
+                options.append((node["text"] or node["attributes"].get("label") or "").strip())
+            elif node["tagName"] == "optgroup":
+                stack.extend(reversed(node["childIds"]))
+        self.select_options[tag_idx] = options
+
+    def get_option_index(self, tag_idx: int):
+        """OptionIndex of a select captured with the observation, None when its options are unknown"""
+        if tag_idx not in self.option_indexes:
+            options = self.select_options.get(tag_idx)
+            self.option_indexes[tag_idx] = OptionIndex(options) if options else None
+        return self.option_indexes[tag_idx]
+
     def get_selector_and_xpath(self, idx: int) -> (str, str):  # type: ignore
+        if idx in self.snapshot_elements:
+            return self.snapshot_elements[idx]["selector"], self.snapshot_elements[idx]["xpath"]
         try:
             selector = self.get_selector(idx)
             xpath = self.get_xpath(idx)
@@ -247,7 +289,86 @@ class HTMLTree:
     def get_element_value(self, element_id: int) -> str:
         return self.element_value[str(element_id)]
 
+    def get_form_context(self, idx: int) -> dict:
+        """Attributes of an input and a summary of its enclosing form, used to tell search boxes from form fields"""
+        if idx in self.snapshot_elements:
+            return self.snapshot_elements[idx].get("form_context")
+        node = self.elementNodes[idx]
+        context = {"tagName": node["tagName"], "attributes": dict(node["attributes"]), "form": None}
+        parent_id = node["parentId"]
+        while parent_id != -1 and parent_id != "":
+            parent = self.elementNodes[parent_id]
+            if parent["tagName"] == "form":
+                fields, has_submit = 0, False
+                stack = list(parent["childIds"])
+                while stack:
+                    child = self.elementNodes[stack.pop()]
+                    stack.extend(child["childIds"])
+                    input_type = str(child["attributes"].get("type", "")).lower()
+                    if child["tagName"] in ["textarea", "select"] or (
+                            child["tagName"] == "input" and input_type not in NonFieldInputTypes):
+                        fields += 1
+                    # Buttons inside a form submit it unless they say otherwise
+                    if (child["tagName"] == "button" and input_type in ["", "submit"]) or (
+                            child["tagName"] == "input" and input_type in ["submit", "image"]):
+                        has_submit = True
+                context["form"] = {"attributes": dict(parent["attributes"]), "fields": fields, "has_submit": has_submit}
+                break
+            parent_id = parent["parentId"]
+        return context
+
+    def snapshot(self, dom_tree: str) -> dict:
+        """Export the built observation and everything actions look up, as picklable plain data"""
+        elements = {}
+        for tag_idx in self.nodeDict.values():
+            element = self.elementNodes[tag_idx]
+            try:
+                selector, xpath = self.get_selector(tag_idx), self.get_xpath(tag_idx)
+            except Exception:
+                selector, xpath = None, None
+            elements[tag_idx] = {
+                "tag": self.get_tag_name(element),
+                "form_context": self.get_form_context(tag_idx) if element["tagName"] in ["input", "textarea"] else None,
+                "selector": selector,
+                "xpath": xpath,
+                "node": {
+                    "nodeId": tag_idx,
+                    "tagName": element["tagName"],
+                    "text": element["text"],
+                    "attributes": dict(element["attributes"]),
+                    "parentId": element["parentId"],
+                    "depth": element["depth"]
+                }
+            }
+        return {
+            "dom_tree": dom_tree,
+            "nodeDict": self.nodeDict,
+            "element_value": self.element_value,
+            "link_index": self.link_index,
+            "select_options": self.select_options,
+            "elements": elements
+        }
+
+    def load_snapshot(self, snapshot: dict) -> str:
+        """Restore a tree built by `build_observation` in another process, returns the DOM observation"""
+        self.__init__()
+        self.nodeDict = snapshot["nodeDict"]
+        self.element_value = snapshot["element_value"]
+        self.link_index = snapshot["link_index"]
+        self.select_options = snapshot["select_options"]
+        self.snapshot_elements = snapshot["elements"]
+        self.elementNodes = {idx: element["node"] for idx, element in self.snapshot_elements.items()}
+        return snapshot["dom_tree"]
+
+
+def build_observation(html_content: str, base_url: str = "") -> dict:
+    """Parse a page and build its DOM observation, meant to run in a worker process"""
+    tree = HTMLTree()
+    tree.fetch_html_content(html_content)
+    return tree.snapshot(tree.build_dom_tree(base_url))
+
 
 __all__ = [
-    "HTMLTree"
+    "HTMLTree",
+    "build_observation"
 ]
@@ -0,0 +1,104 @@
+import asyncio
+import base64
+import os
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from agent.Utils.artifact_writer import artifact_writer
+
+
+# Width the screenshots sent to the models are resized to
+MODEL_IMAGE_WIDTH = 1080
+IMAGE_FORMATS = ["jpeg", "png"]
+
+
+class Frame:
+    """
+    One screenshot of the page, taken once per step and shared by planning, the vision reward
+    and the saved screenshots.
+
+    Only the image bytes returned by the browser are kept, the decoded image and its base64
+    encodings are derived on first use and cached, so a step that needs the same image three
+    times decodes and encodes it once. Encoding takes tens of milliseconds, so the async
+    accessors run it in a thread instead of the event loop. A frame the browser already scaled
+    to the model width (see `from_base64`) is never decoded at all.
+    """
+
+    def __init__(self, data: bytes, url: str = "", image_format: str = "png", quality: int = 80):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown screenshot format {image_format}, expected one of {IMAGE_FORMATS}")
+        self._data = data
+        self.url = url
+        self.image_format = image_format
+        self.quality = quality
+        self.captured_at = time.time()
+        self._image = None
+        self._encodings = {}
+        self.path = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_base64(cls, encoded: str, width: int, url: str = "", image_format: str = "jpeg", quality: int = 80):
+        """A frame the browser captured at `width` and returned base64 encoded"""
+        frame = cls(None, url, image_format, quality)
+        frame._encodings[width] = encoded
+        return frame
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = base64.b64decode(next(iter(self._encodings.values())))
+        return self._data
+
+    @property
+    def extension(self) -> str:
+        return "jpg" if self.image_format == "jpeg" else self.image_format
+
+    @property
+    def image(self) -> Image.Image:
+        with self._lock:
+            if self._image is None:
+                self._image = Image.open(BytesIO(self.data)).convert("RGB")
+            return self._image
+
+    def base64(self, width: int = MODEL_IMAGE_WIDTH) -> str:
+        """The frame resized to `width` and encoded as base64, like the models expect it, "" for a failed capture"""
+        encoded = self._encodings.get(width)
+        if encoded is None and not self.data:
+            return ""
+        if encoded is None:
+            image = self.image
+            height = int(width * image.height / image.width)
+            buffer = BytesIO()
+            if self.image_format == "jpeg":
+                image.resize((width, height)).save(buffer, format="JPEG", quality=self.quality)
+            else:
+                image.resize((width, height)).save(buffer, format="PNG")
+            encoded = self._encodings[width] = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        return encoded
+
+    async def encoded(self, width: int = MODEL_IMAGE_WIDTH) -> str:
+        if width in self._encodings:
+            return self._encodings[width]
+        return await asyncio.to_thread(self.base64, width)
+
+    async def save_in_background(self, path: str) -> str:
+        """
+        Hand the image bytes as captured to the artifact writer, there is nothing to decode or
+        re-encode. A frame is written once, later calls return the path of the first save. The
+        extension of `path` is replaced by the one of the captured format.
+        """
+        if self.path is not None:
+            return self.path
+        path = self.path = f"{os.path.splitext(path)[0]}.{self.extension}"
+        await artifact_writer.write_bytes_async(path, self.data)
+        return path
+
+
+__all__ = [
+    "Frame",
+    "MODEL_IMAGE_WIDTH"
+]
@@ -0,0 +1,153 @@
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+from agent.Environment.browser_env.storage_state import site_of
+from agent.Utils.artifact_writer import artifact_writer, write_json_atomic
+
+
+# Attributes that name an element the same way on every visit, most specific first. Links are
+# left out of it by their href, which points at one item of a list rather than the element's place.
+STABLE_ATTRIBUTES = ["data-testid", "data-test", "id", "name", "aria-label", "placeholder", "title"]
+
+
+def is_positional(selector: str) -> bool:
+    """Selectors that follow the tree or count siblings point at another element once the layout shifts"""
+    return not selector or ":nth-" in selector or ">" in selector
+
+
+def attribute_selectors(tag: str, attributes: dict) -> list:
+    """CSS selectors of an element from its stable attributes, to be checked for uniqueness on the page"""
+    selectors = []
+    for name in STABLE_ATTRIBUTES:
+        value = str((attributes or {}).get(name) or "").strip()
+        # Generated ids and long links are as brittle as the positional selector
+        if not value or len(value) > 120 or (name == "id" and re.search(r"\d{4,}|[:]", value)):
+            continue
+        escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+        selectors.append(f'{tag}[{name}="{escaped}"]')
+    return selectors
+
+
+class GroundingCache:
+    """
+    Selectors that worked for an element, by site, URL pattern, role and text.
+
+    The selector built from the tree is a chain of `:nth-child` steps, which breaks when the page
+    renders differently from the HTML the tree was parsed from, and every failure costs the
+    locator timeout and a JS fallback that may not find the element either. When it fails, a
+    selector from the element's stable attributes that matches exactly one element on the page is
+    tried instead, and kept here once it worked. Later actions on an element with the same role
+    and text on the same kind of page use it first when it selects by one of that element's own
+    attributes, several elements like "Read more" links share a text, and it still matches
+    exactly one element. A selector that fails `max_failures` times in a row is dropped.
+
+    One cache is shared by the tasks of a server process and saved to `path` by the artifact
+    writer at most every `save_interval_seconds`, for the processes started later.
+    """
+
+    def __init__(self, enabled: bool = True, path: str = None, max_entries: int = 5000, max_failures: int = 2,
+                 save_interval_seconds: float = 30):
+        self.enabled = enabled
+        self.path = path
+        self.max_entries = max_entries
+        self.max_failures = max_failures
+        self.save_interval = save_interval_seconds
+        self.entries = {}
+        self.dirty = False
+        self.last_save = 0.0
+        self.lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def from_config(cls, config: dict = None):
+        config = config or {}
+        return cls(
+            enabled=config.get("enabled", True),
+            path=config.get("path", "./output/grounding.json"),
+            max_entries=config.get("max_entries", 5000),
+            max_failures=config.get("max_failures", 2),
+            save_interval_seconds=config.get("save_interval_seconds", 30)
+        )
+
+    def _load(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                self.entries = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    @staticmethod
+    def key(page_url: str, role: str, text: str) -> str:
+        """Where an element is and what it says, None for elements that can't be told apart that way"""
+        parsed = urlparse(page_url or "")
+        text = re.sub(r"\s+", " ", str(text or "")).strip().lower()[:200]
+        if parsed.scheme not in ["http", "https"] or not text:
+            return None
+        path = re.sub(r"/[0-9]+(?=/|$)", "/{n}", parsed.path.rstrip("/"))
+        return f"{site_of(parsed.hostname)}|{parsed.hostname}{path}|{role}|{text}"
+
+    def lookup(self, key: str, tag: str, attributes: dict) -> str:
+        """
+        The selector that worked most often for `key` that selects by one of the `attributes` of
+        the element acted on, None when there is none
+        """
+        if not self.enabled or key is None:
+            return None
+        own = attribute_selectors(tag, attributes)
+        selectors = {selector: stats for selector, stats in self.entries.get(key, {}).get("selectors", {}).items()
+                     if selector in own}
+        if not selectors:
+            return None
+        return max(selectors, key=lambda selector: selectors[selector]["worked"])
+
+    def record(self, key: str, selector: str, worked: bool) -> None:
+        if not self.enabled or key is None or is_positional(selector):
+            return
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if not worked:
+                    return
+                entry = self.entries[key] = {"selectors": {}}
+            stats = entry["selectors"].setdefault(selector, {"worked": 0, "failures": 0})
+            if worked:
+                stats["worked"] += 1
+                stats["failures"] = 0
+            else:
+                stats["failures"] += 1
+                if stats["failures"] >= self.max_failures:
+                    del entry["selectors"][selector]
+            entry["last_used"] = time.time()
+            if not entry["selectors"]:
+                del self.entries[key]
+            self.dirty = True
+
+    async def save_if_due(self) -> None:
+        if time.monotonic() - self.last_save >= self.save_interval:
+            await self.save()
+
+    async def save(self) -> None:
+        if not self.path or not self.dirty:
+            return
+        self.last_save = time.monotonic()
+        # Copying thousands of entries takes a while, it is done by the writer instead of the action
+        await artifact_writer.submit_async(self._write)
+
+    def _write(self) -> None:
+        with self.lock:
+            entries = sorted(self.entries.items(), key=lambda item: -item[1].get("last_used", 0))[:self.max_entries]
+            self.entries = dict(entries)
+            snapshot = json.loads(json.dumps(self.entries))
+            self.dirty = False
+        write_json_atomic(self.path, snapshot)
+
+
+__all__ = [
+    "GroundingCache",
+    "attribute_selectors"
+]
@@ -0,0 +1,61 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .build_tree import HTMLTree, build_observation
+from logs import logger
+
+
+_executor = None
+
+
+def get_observation_executor(max_workers: int) -> ProcessPoolExecutor:
+    """Process pool shared by every environment of this process, created on first use"""
+    global _executor
+    if _executor is None:
+        # forkserver children don't inherit the browser pipes and threads of the server process,
+        # and only preloading build_tree keeps them from re-running the server module
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["agent.Environment.html_env.build_tree"])
+        _executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        logger.info(f"Started DOM parsing process pool with {max_workers} workers")
+    return _executor
+
+
+def shutdown_observation_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def parse_observation(tree: HTMLTree, html_content: str, workers: int = 2,
+                            inline_max_chars: int = 30000, base_url: str = "") -> str:
+    """
+    Build the DOM observation of a page into `tree` and return it.
+
+    Parsing and pruning a large page holds the event loop for hundreds of milliseconds, which
+    stalls every other task of the server, so those pages are handled by the process pool.
+    Small pages stay in the loop since pickling the result would cost more than it saves.
+    """
+    if workers <= 0 or len(html_content) <= inline_max_chars:
+        tree.fetch_html_content(html_content)
+        return tree.build_dom_tree(base_url)
+    global _executor
+    loop = asyncio.get_running_loop()
+    try:
+        snapshot = await loop.run_in_executor(
+            get_observation_executor(workers), build_observation, html_content, base_url)
+    except BrokenProcessPool:
+        logger.warning("DOM parsing process pool broke, parsing in the event loop")
+        _executor = None
+        tree.fetch_html_content(html_content)
+        return tree.build_dom_tree(base_url)
+    return tree.load_snapshot(snapshot)
+
+
+__all__ = [
+    "parse_observation",
+    "shutdown_observation_pool"
+]
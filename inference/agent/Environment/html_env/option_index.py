@@ -0,0 +1,73 @@
+import re
+from difflib import SequenceMatcher
+
+
+def normalize_option(text: str) -> str:
+    # Lowercased like the page script that checks the option text does
+    return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class OptionIndex:
+    """
+    Approximate lookup of the option of a <select> that best matches a planned value.
+
+    Scoring every option with SequenceMatcher costs milliseconds per option, which adds up to
+    seconds on country or date dropdowns with thousands of them. An exact or prefix match of the
+    normalized text answers most lookups directly. Otherwise the options sharing the most
+    character trigrams with the value are shortlisted from an inverted index, and only those
+    are scored with SequenceMatcher, so the best option is picked like before.
+    """
+
+    def __init__(self, options: list, shortlist: int = 50):
+        self.options = list(options)
+        self.shortlist = shortlist
+        self.normalized = [normalize_option(option) for option in self.options]
+        self.exact = {}
+        self.postings = {}
+        self.gram_counts = []
+        for i, text in enumerate(self.normalized):
+            self.exact.setdefault(text, i)
+            grams = trigrams(text)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.options)
+
+    def match(self, value: str) -> tuple:
+        """Return (index, option text, score) of the best option, index -1 when there are none"""
+        if not self.options:
+            return -1, "", -1
+        query = normalize_option(value)
+        if query in self.exact:
+            i = self.exact[query]
+            return i, self.options[i], 1.0
+        prefixed = [i for i, text in enumerate(self.normalized) if query and text.startswith(query)][:self.shortlist]
+        if len(prefixed) == 1:
+            i = prefixed[0]
+            return i, self.options[i], SequenceMatcher(None, self.options[i], value).ratio()
+        counts = {}
+        query_grams = trigrams(query)
+        for gram in query_grams:
+            for i in self.postings.get(gram, []):
+                counts[i] = counts.get(i, 0) + 1
+        # Dice coefficient of the trigram sets, so long options sharing many grams don't crowd the shortlist
+        dice = {i: 2 * count / (len(query_grams) + self.gram_counts[i]) for i, count in counts.items()}
+        candidates = sorted(dice, key=lambda i: -dice[i])[:self.shortlist] or range(len(self.options))
+        best = (-1, "", -1)
+        for i in sorted(set(candidates) | set(prefixed)):
+            similarity = SequenceMatcher(None, self.options[i], value).ratio()
+            if similarity > best[2]:
+                best = (i, self.options[i], similarity)
+        return best
+
+
+__all__ = [
+    "OptionIndex"
+]
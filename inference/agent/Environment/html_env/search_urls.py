@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+from urllib.parse import parse_qsl, quote, unquote_plus, urlencode, urlparse
+
+from agent.Environment.browser_env.storage_state import site_of
+from agent.Utils.artifact_writer import artifact_writer, write_json_atomic
+from logs import logger
+
+
+# Results URLs of engines and sites whose search box submits the query as a URL parameter.
+# `input` is the name of that box, a fill_search on it navigates straight to the results. The
+# results are on the host of the page searched from, de.wikipedia.org searches German Wikipedia.
+KNOWN_PATTERNS = {
+    "google.com": {"url": "https://www.google.com/search", "param": "q", "input": "q"},
+    "bing.com": {"url": "https://www.bing.com/search", "param": "q", "input": "q"},
+    "duckduckgo.com": {"url": "https://duckduckgo.com/", "param": "q", "input": "q"},
+    "youtube.com": {"url": "https://www.youtube.com/results", "param": "search_query", "input": "search_query"},
+    "wikipedia.org": {"url": "https://en.wikipedia.org/w/index.php", "param": "search", "input": "search"},
+    "github.com": {"url": "https://github.com/search", "param": "q", "input": "q"},
+    "amazon.com": {"url": "https://www.amazon.com/s", "param": "k", "input": "field-keywords"},
+    "ebay.com": {"url": "https://www.ebay.com/sch/i.html", "param": "_nkw", "input": "_nkw"}
+}
+
+
+def input_key(attributes: dict) -> str:
+    """What identifies a search box across visits of a site, its name or else its id"""
+    attributes = attributes or {}
+    return str(attributes.get("name") or attributes.get("id") or "").strip()
+
+
+class SearchUrlEngine:
+    """
+    Builds the results URL of a search instead of typing it into the page.
+
+    The google_search action used to wait a fixed two seconds after loading the results, and
+    fill_search fills the box, presses Enter and leaves the planner to wait for the results on
+    the next observation. Engines and sites in KNOWN_PATTERNS, and sites whose search box was
+    seen submitting the query as a URL parameter or path segment, get the results URL directly.
+
+    After a typed fill_search, `observe` compares the URL the page ended up on with the query.
+    A site's pattern is only used once it was seen `min_successes` times, and it is dropped when
+    the URL it builds doesn't load. A known pattern that doesn't load is not used again for that
+    host until the process restarts. One engine is shared by the tasks of a server process, the
+    learned patterns are saved to `path` for the processes started later.
+    """
+
+    def __init__(self, enabled: bool = True, path: str = None, min_successes: int = 1, max_sites: int = 500):
+        self.enabled = enabled
+        self.path = path
+        self.min_successes = min_successes
+        self.max_sites = max_sites
+        self.patterns = {}
+        # Hosts where the known pattern didn't load, in this process
+        self.failed_known = set()
+        self.lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def from_config(cls, config: dict = None):
+        config = config or {}
+        return cls(
+            enabled=config.get("enabled", True),
+            path=config.get("path", "./output/search_patterns.json"),
+            min_successes=config.get("min_successes", 1),
+            max_sites=config.get("max_sites", 500)
+        )
+
+    def _load(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                self.patterns = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.patterns = {}
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        patterns = sorted(self.patterns.items(), key=lambda item: -item[1].get("last_seen", 0))[:self.max_sites]
+        self.patterns = dict(patterns)
+        artifact_writer.submit(write_json_atomic, self.path, dict(self.patterns))
+
+    def pattern_for(self, site: str, input_name: str = None, host: str = None) -> dict:
+        """The pattern of `site`, for a fill_search into `input_name` on `host` when given"""
+        if not self.enabled:
+            return None
+        pattern = self.patterns.get(site)
+        if pattern is None or pattern.get("successes", 0) < self.min_successes:
+            pattern = KNOWN_PATTERNS.get(site) if host not in self.failed_known else None
+            pattern = {**pattern, "same_host": True} if pattern else None
+        if pattern is None or (input_name is not None and pattern.get("input") != input_name):
+            return None
+        return pattern
+
+    def results_url(self, pattern: dict, query: str) -> str:
+        if pattern.get("param"):
+            return f"{pattern['url']}?{urlencode({pattern['param']: query})}"
+        return pattern["url"].replace("{query}", quote(query, safe=""))
+
+    def search_url(self, query: str, engine: str = "google.com") -> str:
+        """The results URL of the google_search action, encoded unlike the URL it built before"""
+        pattern = self.patterns.get(engine) if self.enabled else None
+        return self.results_url(pattern or KNOWN_PATTERNS[engine], query)
+
+    def direct_url(self, page_url: str, attributes: dict, query: str) -> str:
+        """The results URL a fill_search of `query` into the box with `attributes` leads to, if known"""
+        if not query:
+            return None
+        parsed = urlparse(page_url)
+        pattern = self.pattern_for(site_of(parsed.hostname), input_key(attributes), parsed.netloc)
+        if pattern is None:
+            return None
+        if pattern.get("same_host"):
+            # Other hosts of the site may be other languages or regions of it
+            pattern = {**pattern, "url": urlparse(pattern["url"])._replace(netloc=parsed.netloc).geturl()}
+        return self.results_url(pattern, query)
+
+    def expect(self, page_url: str, attributes: dict, query: str) -> dict:
+        """A typed fill_search is submitted, returns what `observe` checks the next page URL against"""
+        key = input_key(attributes)
+        if not self.enabled or not key or not query:
+            return None
+        return {"site": site_of(urlparse(page_url).hostname), "input": key, "query": query, "from_url": page_url}
+
+    def observe(self, pending: dict, page_url: str) -> dict:
+        """Learn the site's pattern if the `pending` fill_search put its query in the URL"""
+        if pending is None or page_url == pending["from_url"]:
+            return None
+        parsed = urlparse(page_url)
+        if site_of(parsed.hostname) != pending["site"]:
+            return None
+        pattern = self._match(parsed, pending["query"])
+        if pattern is None:
+            return None
+        pattern["input"] = pending["input"]
+        pattern["same_host"] = parsed.netloc == urlparse(pending["from_url"]).netloc
+        with self.lock:
+            known = self.patterns.get(pending["site"], {})
+            same = all(known.get(key) == pattern.get(key) for key in ["url", "param", "input", "same_host"])
+            pattern["successes"] = known.get("successes", 0) + 1 if same else 1
+            pattern["last_seen"] = time.time()
+            self.patterns[pending["site"]] = pattern
+            self._save()
+        if pattern["successes"] == 1:
+            logger.info(f"Learned the search URL of {pending['site']}: {self.results_url(pattern, '...')}")
+        return pattern
+
+    def _match(self, parsed, query: str) -> dict:
+        expected = " ".join(query.split()).lower()
+        base = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+        for param, value in parse_qsl(parsed.query):
+            if " ".join(value.split()).lower() == expected:
+                return {"url": base, "param": param}
+        segments = parsed.path.split("/")
+        for i, segment in enumerate(segments):
+            if " ".join(unquote_plus(segment).split()).lower() == expected:
+                segments[i] = "{query}"
+                return {"url": f"{parsed.scheme}://{parsed.netloc}{'/'.join(segments)}", "param": None}
+        return None
+
+    def forget(self, page_url: str) -> None:
+        """The URL built from the site's pattern didn't load, search it by typing again"""
+        parsed = urlparse(page_url)
+        site = site_of(parsed.hostname)
+        with self.lock:
+            if self.patterns.pop(site, None) is not None:
+                logger.info(f"Dropped the search URL of {site}")
+                self._save()
+            elif site in KNOWN_PATTERNS:
+                self.failed_known.add(parsed.netloc)
+
+
+__all__ = [
+    "KNOWN_PATTERNS",
+    "SearchUrlEngine"
+]
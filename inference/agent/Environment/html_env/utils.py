@@ -83,6 +83,19 @@ TypeList = [
 ]
 
 
+# Input types that don't take typed text, so they don't count as form fields
+NonFieldInputTypes = [
+    "hidden",
+    "submit",
+    "button",
+    "reset",
+    "image",
+    "checkbox",
+    "radio",
+    "file"
+]
+
+
 def stringfy_selector(string: str):
     special_chars = '#.>+~[]():*^$|=%@!\''
     string = string.replace("\t", " ").replace("\n", " ").lstrip().rstrip()
@@ -106,6 +119,7 @@ __all__ = [
     "DelTagNameList",
     "ConditionTagNameList",
     "TypeList",
+    "NonFieldInputTypes",
     "stringfy_selector",
     "stringfy_value"
 ]
@@ -2,4 +2,6 @@ from .openai import *
 from .llm_instance import *
 from .token_cal import *
 from .claude import *
-from .token_calculation import *
\ No newline at end of file
+from .token_calculation import *
+from .governor import *
+from .prompt_cache import *
\ No newline at end of file
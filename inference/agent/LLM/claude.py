@@ -1,4 +1,5 @@
 import os
+import json
 import asyncio
 from anthropic import AsyncAnthropic
 from functools import partial
@@ -7,6 +8,11 @@ from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import concurrent
 from logs import logger
+from .governor import llm_governor, estimate_request_tokens
+from .prompt_cache import anthropic_content, cache_block, record_usage
+
+
+STRUCTURED_RESPONSE_TOOL = "respond"
 
 
 class ClaudeGenerator:
@@ -15,30 +21,53 @@ class ClaudeGenerator:
         self.model = model
         
         self.client = AsyncAnthropic(
-            api_key=os.environ.get('ANTHROPIC_API_KEY')
+            api_key=os.environ.get('ANTHROPIC_API_KEY'),
+            max_retries=0
         )
         self.pool = concurrent.futures.ThreadPoolExecutor(
             max_workers=multiprocessing.cpu_count() * 2)
 
-    async def request(self, messages: list = None, max_tokens: int = 500, temperature: float = 0.7) -> tuple[str, str]:
+    async def request(self, messages: list = None, max_tokens: int = 500, temperature: float = 0.7,
+                      response_schema: dict = None) -> tuple[str, str]:
+        """`response_schema` forces a tool call with that input schema, whose input is returned as JSON"""
         loop = asyncio.get_event_loop()
         try:
-            response = await loop.run_in_executor(self.pool, partial(self.chat, messages, max_tokens, temperature))
-            return await response, ""
+            response = await llm_governor.call(
+                "anthropic", self.model,
+                lambda: self.chat(messages, max_tokens, temperature, response_schema),
+                estimate_request_tokens(messages, max_tokens))
+            return response, ""
         except Exception as e:
             logger.error(f"Error in ClaudeGenerator.request: {e}")
             return "", str(e)
 
-    async def chat(self, message, max_tokens=1024, temperature=0.7):
+    async def chat(self, message, max_tokens=1024, temperature=0.7, response_schema=None):
 
-        messages = [{"role": "user", "content": "Please follow the instructions"}, {"role": "assistant", "content": message[0].get("content")}, {
-            "role": "user", "content": message[1].get("content")}]
+        # The instructions are the same on every request, so they end the first cached prefix,
+        # blocks of the user message marked by the prompt constructors extend it
+        system_content = message[0].get("content")
+        messages = [{"role": "user", "content": "Please follow the instructions"}, {
+            "role": "assistant", "content": [cache_block(system_content)] if isinstance(system_content, str) else system_content}, {
+            "role": "user", "content": anthropic_content(message[1].get("content"))}]
         data = {
             'model': self.model,
             'max_tokens': max_tokens,
             'temperature': temperature,
             'messages': messages,
         }
+        if response_schema is not None:
+            # Tool input schemas can't combine subschemas at the top level, the response is validated when parsed
+            input_schema = {key: value for key, value in response_schema.items() if key not in ["anyOf", "oneOf", "allOf"]}
+            data['tools'] = [{"name": STRUCTURED_RESPONSE_TOOL, "description": "Respond with this tool.",
+                              "input_schema": input_schema}]
+            data['tool_choice'] = {"type": "tool", "name": STRUCTURED_RESPONSE_TOOL}
         response = await self.client.messages.create(**data)
+        usage = response.usage
+        cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+        cache_creation = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        record_usage(self.model, usage.input_tokens + cache_read + cache_creation, cache_read, cache_creation)
+        for block in response.content:
+            if getattr(block, "type", None) == "tool_use":
+                return json.dumps(block.input, ensure_ascii=False)
         return response.content[0].text
 
@@ -6,6 +6,8 @@ import multiprocessing
 from concurrent.futures import ThreadPoolExecutor
 from sanic.log import logger
 import google.generativeai as genai
+from .governor import llm_governor, estimate_request_tokens
+from .prompt_cache import flatten_cache_hints
 
 
 class GeminiGenerator:
@@ -13,17 +15,22 @@ class GeminiGenerator:
         self.model = model
         self.pool = ThreadPoolExecutor(max_workers=os.cpu_count() * 2)
 
-    async def request(self, messages: list = None, max_tokens: int = 500, temperature: float = 0.7) -> (str, str):
+    async def request(self, messages: list = None, max_tokens: int = 500, temperature: float = 0.7,
+                      response_schema: dict = None) -> (str, str):
         genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        messages = flatten_cache_hints(messages)
         loop = asyncio.get_event_loop()
         try:
-            response = await loop.run_in_executor(self.pool, partial(self.chat, messages, max_tokens, temperature))
+            response = await llm_governor.call(
+                "google", self.model,
+                lambda: loop.run_in_executor(self.pool, partial(self.chat, messages, max_tokens, temperature, response_schema is not None)),
+                estimate_request_tokens(messages, max_tokens))
             return response, ""
         except Exception as e:
             logger.error(f"Error in GeminiGenerator.request: {e}")
             return "", str(e)
 
-    def chat(self, messages, max_tokens=500, temperature=0.7):
+    def chat(self, messages, max_tokens=500, temperature=0.7, json_response=False):
         chat_history = []
         for message in messages:
             chat_history.append({"role": "user", "parts": [{"text": message.get("content")}]})
@@ -33,5 +40,6 @@ class GeminiGenerator:
         latest_user_message = messages[-1].get("content")
         response = chat.send_message(latest_user_message, generation_config=genai.types.GenerationConfig(
             max_output_tokens=max_tokens,
-            temperature=temperature))
+            temperature=temperature,
+            response_mime_type="application/json" if json_response else None))
         return response.text
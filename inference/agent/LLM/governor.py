@@ -0,0 +1,254 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import time
+
+from logs import logger
+from .token_cal import estimate_tokens
+
+
+# Set by run_task so requests can be queued fairly per agent task instead of per call
+current_task_id = contextvars.ContextVar("llm_task_id", default=None)
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Full-jitter exponential backoff, so retries of concurrent tasks don't fire in lockstep"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def estimate_request_tokens(messages: list, max_tokens: int = 0) -> int:
+    """Providers count prompt plus max_tokens against the TPM budget when a request is admitted"""
+    prompt_tokens = 0
+    for message in messages or []:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            prompt_tokens += sum(estimate_tokens(item.get("text", "")) for item in content if isinstance(item, dict))
+        else:
+            prompt_tokens += estimate_tokens(str(content))
+    return int(prompt_tokens) + max_tokens
+
+
+def is_rate_limited(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status == 429 or type(error).__name__ in ("RateLimitError", "ResourceExhausted"):
+        return True
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message
+
+
+def is_transient(error: Exception) -> bool:
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "InternalServerError",
+                                    "ServiceUnavailable", "DeadlineExceeded")
+
+
+def retry_after(error: Exception):
+    """Seconds the provider asked us to wait, from the Retry-After headers of the 429 response"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers.get("retry-after-ms")) / 1000
+        if headers.get("retry-after"):
+            return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        self._refill()
+        # A single request larger than the whole budget is admitted once the bucket is full
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Lane:
+    """Budget and waiting requests of one provider/model pair"""
+
+    def __init__(self, limits: dict):
+        self.limits = limits
+        self.rpm = TokenBucket(limits["rpm"]) if limits.get("rpm") else None
+        self.tpm = TokenBucket(limits["tpm"]) if limits.get("tpm") else None
+        self.paused_until = 0.0
+        self.waiters = []
+        self.served = {}
+        self.dispatcher = None
+        self.wakeup = None
+        self.metrics = {"requests": 0, "queue_wait_total": 0.0, "queue_wait_max": 0.0,
+                        "throttle_events": 0, "retries": 0, "failures": 0}
+
+    def delay_for(self, tokens: int) -> float:
+        delays = [self.paused_until - time.monotonic()]
+        if self.rpm is not None:
+            delays.append(self.rpm.time_until(1))
+        if self.tpm is not None:
+            delays.append(self.tpm.time_until(tokens))
+        return max(delays)
+
+
+class LLMGovernor:
+    """
+    Shared admission control for every LLM request of this process.
+
+    Each provider/model pair gets requests-per-minute and tokens-per-minute buckets. Waiting
+    requests are admitted in order of how few requests their agent task has had served, so one
+    busy task can't starve the others. A 429 pauses the whole lane for Retry-After (or a jittered
+    backoff), since every other request to that model would be rejected as well.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.max_retries = 4
+        self.backoff_base = 1.0
+        self.backoff_max = 30.0
+        self.limits = {}
+        self.lanes = {}
+        self.sequence = itertools.count()
+
+    def configure(self, config: dict = None) -> None:
+        config = config or {}
+        self.enabled = config.get("enabled", True)
+        self.max_retries = config.get("max_retries", 4)
+        self.backoff_base = config.get("backoff_base", 1.0)
+        self.backoff_max = config.get("backoff_max", 30.0)
+        limits = config.get("limits", {})
+        if limits != self.limits:
+            self.limits = limits
+            # Running lanes keep their queue, only budgets whose limits changed start over
+            for (provider, model), lane in self.lanes.items():
+                new_limits = self._limits_for(provider, model)
+                if new_limits != lane.limits:
+                    lane.limits = new_limits
+                    lane.rpm = TokenBucket(new_limits["rpm"]) if new_limits.get("rpm") else None
+                    lane.tpm = TokenBucket(new_limits["tpm"]) if new_limits.get("tpm") else None
+
+    def _limits_for(self, provider: str, model: str) -> dict:
+        return {**self.limits.get(provider, {}), **self.limits.get(model, {})}
+
+    def _lane(self, provider: str, model: str) -> _Lane:
+        key = (provider, model)
+        if key not in self.lanes:
+            self.lanes[key] = _Lane(self._limits_for(provider, model))
+        return self.lanes[key]
+
+    async def acquire(self, provider: str, model: str, tokens: int = 0) -> float:
+        """Wait until the lane has budget and it is this task's turn, returns the time spent queued"""
+        lane = self._lane(provider, model)
+        task_id = current_task_id.get() or id(asyncio.current_task())
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queued_at = time.monotonic()
+        heapq.heappush(lane.waiters, (lane.served.get(task_id, 0), next(self.sequence), tokens, task_id, future))
+        if lane.dispatcher is None or lane.dispatcher.done() or lane.dispatcher.get_loop() is not loop:
+            lane.wakeup = asyncio.Event()
+            lane.dispatcher = loop.create_task(self._dispatch(lane))
+        else:
+            lane.wakeup.set()
+        await future
+        waited = time.monotonic() - queued_at
+        lane.metrics["requests"] += 1
+        lane.metrics["queue_wait_total"] += waited
+        lane.metrics["queue_wait_max"] = max(lane.metrics["queue_wait_max"], waited)
+        return waited
+
+    async def _dispatch(self, lane: _Lane) -> None:
+        while lane.waiters:
+            served, sequence, tokens, task_id, future = lane.waiters[0]
+            if future.done():
+                heapq.heappop(lane.waiters)
+                continue
+            delay = lane.delay_for(tokens)
+            if delay > 0:
+                lane.wakeup.clear()
+                try:
+                    # A new waiter may have a better place in the queue, so re-check when one arrives
+                    await asyncio.wait_for(lane.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(lane.waiters)
+            if lane.rpm is not None:
+                lane.rpm.consume(1)
+            if lane.tpm is not None:
+                lane.tpm.consume(tokens)
+            lane.served[task_id] = lane.served.get(task_id, 0) + 1
+            future.set_result(None)
+        lane.served.clear()
+
+    def throttle(self, provider: str, model: str, delay: float) -> None:
+        lane = self._lane(provider, model)
+        lane.metrics["throttle_events"] += 1
+        lane.paused_until = max(lane.paused_until, time.monotonic() + delay)
+        logger.warning(f"Rate limited by {provider}/{model}, pausing requests for {delay:.1f}s")
+
+    async def call(self, provider: str, model: str, make_request, tokens: int = 0):
+        """
+        Await `make_request()` within the lane's budget, retrying rate limits and transient errors.
+
+        `make_request` is a zero-argument callable returning a new awaitable for every attempt.
+        """
+        if not self.enabled:
+            return await make_request()
+        lane = self._lane(provider, model)
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(provider, model, tokens)
+            try:
+                return await make_request()
+            except Exception as e:
+                if attempt >= self.max_retries or not (is_rate_limited(e) or is_transient(e)):
+                    lane.metrics["failures"] += 1
+                    raise
+                lane.metrics["retries"] += 1
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                if is_rate_limited(e):
+                    self.throttle(provider, model, retry_after(e) or delay)
+                else:
+                    logger.warning(f"Transient error from {provider}/{model}, retrying in {delay:.1f}s: {e}")
+                    await asyncio.sleep(delay)
+
+    def metrics(self) -> dict:
+        result = {}
+        for (provider, model), lane in self.lanes.items():
+            requests = lane.metrics["requests"]
+            result[f"{provider}/{model}"] = {
+                **lane.metrics,
+                "queue_wait_avg": lane.metrics["queue_wait_total"] / requests if requests else 0.0,
+                "queued": len(lane.waiters),
+                "limits": lane.limits
+            }
+        return result
+
+
+llm_governor = LLMGovernor()
+
+
+__all__ = [
+    "LLMGovernor",
+    "llm_governor",
+    "current_task_id",
+    "backoff_delay",
+    "estimate_request_tokens"
+]
@@ -2,6 +2,12 @@ from .openai import GPTGenerator, GPTGeneratorWithJSON
 from .claude import ClaudeGenerator
 from .gemini import GeminiGenerator
 from .togetherai import TogetherAIGenerator
+import asyncio
+import weakref
+
+
+# SDK clients hold connection pools bound to the event loop that first used them
+_instances = weakref.WeakKeyDictionary()
 
 
 def create_llm_instance(model, json_mode=False, all_json_models=None):
@@ -29,6 +35,19 @@ def create_llm_instance(model, json_mode=False, all_json_models=None):
         else:
             return TogetherAIGenerator(model)
 
+def get_llm_instance(model, json_mode=False, all_json_models=None):
+    """Like create_llm_instance, but reuses the generator (and its HTTP client) within the running event loop"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return create_llm_instance(model, json_mode, all_json_models)
+    instances = _instances.setdefault(loop, {})
+    key = (model, json_mode)
+    if key not in instances:
+        instances[key] = create_llm_instance(model, json_mode, all_json_models)
+    return instances[key]
+
+
 async def semantic_match_llm_request(messages: list = None):
     GPT35 = GPTGenerator(model="gpt-3.5-turbo")
     return await GPT35.request(messages)
\ No newline at end of file
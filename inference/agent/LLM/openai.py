@@ -1,23 +1,34 @@
 import os
 import sys
 import openai
-import asyncio
-from functools import partial
-import multiprocessing
-from concurrent.futures import ThreadPoolExecutor
 from sanic.log import logger
 from agent.Utils import *
 from .token_cal import truncate_messages_based_on_estimated_tokens
 from .token_calculation import calculation_of_token, save_token_count_to_file
+from .governor import llm_governor, estimate_request_tokens
+from .prompt_cache import flatten_cache_hints, record_usage
+
+
+# Models that reject response_format, they are asked for JSON by the prompt only
+NO_JSON_MODE_MODELS = ("o1-mini", "o1-preview", "gpt-4", "gpt-4-32k", "gpt-4-0613")
 
 
 class GPTGenerator:
     def __init__(self, model=None):
         self.model = model
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # The async client lets a cancelled task abort the in-flight HTTP request,
+        # retries are left to the governor so 429s are paced across all tasks
+        self.client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
 
-    async def request(self, messages: list = None, max_tokens: int = 500, temperature: float = 0.7) -> (str, str):
+    async def request(self, messages: list = None, max_tokens: int = 500, temperature: float = 0.7,
+                      response_schema: dict = None) -> (str, str):
+        """`response_schema` asks for a JSON object response, through JSON mode on the models that have it"""
         try:
+            messages = flatten_cache_hints(messages)
+            response_format = None
+            if response_schema is not None and self.model not in NO_JSON_MODE_MODELS:
+                response_format = {"type": "json_object"}
+                messages = JSONModeMixin.prepare_messages_for_json_mode(messages)
             if "gpt-3.5" in self.model:
                 messages = truncate_messages_based_on_estimated_tokens(messages, max_tokens=16385)
             if "o1" in self.model:
@@ -25,26 +36,34 @@ class GPTGenerator:
                     {**msg, "role": "user"} if msg["role"] == "system" else msg
                     for msg in messages
                 ]
-            cpu_count = multiprocessing.cpu_count()
-            with ThreadPoolExecutor(max_workers=cpu_count * 2) as pool:
-                if "o1" in self.model:
-                    future_answer = pool.submit(self.chat, messages)
-                else:
-                    future_answer = pool.submit(self.chat, messages, max_tokens, temperature)
-                future_answer_result = await future_answer.result()
-                choice = future_answer_result.choices[0]
-                if choice.finish_reason == 'length':
-                    logger.warning("Response may be truncated due to length. Be cautious when parsing JSON.")
-                openai_response = choice.message.content
-                # output_token_count = future_answer_result.usage.completion_tokens
-                # input_token_count = future_answer_result.usage.prompt_tokens
-                return openai_response, ""
+            tokens = estimate_request_tokens(messages, max_tokens)
+            if "o1" in self.model:
+                response = await llm_governor.call(
+                    "openai", self.model, lambda: self.chat(messages, response_format=response_format), tokens)
+            else:
+                response = await llm_governor.call(
+                    "openai", self.model, lambda: self.chat(messages, max_tokens, temperature, response_format), tokens)
+            self.record_usage(response)
+            choice = response.choices[0]
+            if choice.finish_reason == 'length':
+                logger.warning("Response may be truncated due to length. Be cautious when parsing JSON.")
+            openai_response = choice.message.content
+            # output_token_count = response.usage.completion_tokens
+            # input_token_count = response.usage.prompt_tokens
+            return openai_response, ""
         except Exception as e:
             logger.error(f"Error in GPTGenerator.request: {e}")
             return "", str(e)
 
-    async def chat(self, messages, max_tokens=500, temperature=0.7):
-        loop = asyncio.get_event_loop()
+    def record_usage(self, response) -> None:
+        # Prompts longer than 1024 tokens are cached by prefix automatically, the hits show up here
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        record_usage(self.model, usage.prompt_tokens, getattr(details, "cached_tokens", 0) or 0)
+
+    async def chat(self, messages, max_tokens=500, temperature=0.7, response_format=None):
         if "o1" in self.model:
             data = {
                 'model': self.model,
@@ -57,11 +76,12 @@ class GPTGenerator:
             'temperature': temperature,
             'messages': messages,
         }
-        if hasattr(self, 'response_format'):
+        if response_format is not None:
+            data['response_format'] = response_format
+        elif hasattr(self, 'response_format'):
             data['response_format'] = self.response_format
 
-        func = partial(self.client.chat.completions.create, **data)
-        return await loop.run_in_executor(None, func)
+        return await self.client.chat.completions.create(**data)
 
 
 class JSONModeMixin(GPTGenerator):
@@ -80,9 +100,10 @@ class JSONModeMixin(GPTGenerator):
             messages.insert(0, {"role": "system", "content": "You are a helpful assistant designed to output json."})
         return messages
 
-    async def request(self, messages: list = None, max_tokens: int = 500, temperature: float = 0.7) -> (str, str):
-        messages = self.prepare_messages_for_json_mode(messages)  # Prepare messages for JSON mode
-        return await super().request(messages, max_tokens, temperature)
+    async def request(self, messages: list = None, max_tokens: int = 500, temperature: float = 0.7,
+                      response_schema: dict = None) -> (str, str):
+        messages = self.prepare_messages_for_json_mode(flatten_cache_hints(messages))  # Prepare messages for JSON mode
+        return await super().request(messages, max_tokens, temperature, response_schema)
 
 
 class GPTGeneratorWithJSON(JSONModeMixin):
@@ -0,0 +1,68 @@
+import contextvars
+
+
+# Set by run_task to the dict that collects the usage of its requests, keyed by model
+current_usage = contextvars.ContextVar("llm_usage", default=None)
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def cache_block(text: str) -> dict:
+    """A text block ending a prompt prefix that stays the same on the next request of the task"""
+    return {"type": "text", "text": text, "cache_control": CACHE_CONTROL}
+
+
+def text_block(text: str) -> dict:
+    return {"type": "text", "text": text}
+
+
+def flatten_cache_hints(messages: list) -> list:
+    """
+    Drop cache hints for providers that cache prompt prefixes on their own (OpenAI) or not at all.
+
+    A text-only content carrying a cache hint is a prompt string the constructor split at its
+    stable prefix, so it is joined back byte for byte and the automatic prefix match still hits.
+    """
+    flattened = []
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, list) and any(isinstance(item, dict) and "cache_control" in item for item in content):
+            if all(isinstance(item, dict) and item.get("type") == "text" for item in content):
+                content = "".join(item["text"] for item in content)
+            else:
+                content = [{key: value for key, value in item.items() if key != "cache_control"}
+                           if isinstance(item, dict) else item for item in content]
+            message = {**message, "content": content}
+        flattened.append(message)
+    return flattened
+
+
+def anthropic_content(content) -> list:
+    """Content blocks for the Anthropic API, keeping the cache_control of cacheable blocks"""
+    if isinstance(content, str):
+        return [text_block(content)]
+    return list(content)
+
+
+def record_usage(model: str, input_tokens: int, cached_input_tokens: int = 0,
+                 cache_creation_input_tokens: int = 0) -> None:
+    """Add the prompt usage reported by the provider to the usage of the current task"""
+    usage = current_usage.get()
+    if usage is None:
+        return
+    model_usage = usage.setdefault(model, {
+        "requests": 0, "input_tokens": 0, "cached_input_tokens": 0, "cache_creation_input_tokens": 0})
+    model_usage["requests"] += 1
+    model_usage["input_tokens"] += input_tokens or 0
+    model_usage["cached_input_tokens"] += cached_input_tokens or 0
+    model_usage["cache_creation_input_tokens"] += cache_creation_input_tokens or 0
+
+
+__all__ = [
+    "current_usage",
+    "cache_block",
+    "text_block",
+    "flatten_cache_hints",
+    "anthropic_content",
+    "record_usage"
+]
@@ -5,6 +5,8 @@ from openai import AsyncOpenAI
 from sanic.log import logger
 from agent.Utils import *
 import requests
+from .governor import llm_governor, estimate_request_tokens
+from .prompt_cache import flatten_cache_hints
 from sanic.log import logger
 
 
@@ -13,13 +15,19 @@ class TogetherAIGenerator:
         self.model = model
         self.client = AsyncOpenAI(
             api_key=os.environ.get("TOGETHER_API_KEY"),
-            base_url="https://api.together.xyz/v1"
+            base_url="https://api.together.xyz/v1",
+            max_retries=0
         )
 
-    async def request(self, messages: list = None, max_tokens: int = 500, temperature: float = 0.7
-                      ) -> (str, str):
+    async def request(self, messages: list = None, max_tokens: int = 500, temperature: float = 0.7,
+                      response_schema: dict = None) -> (str, str):
+        # Structured output support differs per hosted model, the prompt asks for JSON already
+        messages = flatten_cache_hints(messages)
         try:
-            openai_response = await self.chat(messages, max_tokens, temperature)
+            openai_response = await llm_governor.call(
+                "togetherai", self.model,
+                lambda: self.chat(messages, max_tokens, temperature),
+                estimate_request_tokens(messages, max_tokens))
             return openai_response, ""
         except Exception as e:
             logger.error(f"Error in TogetherAIGenerator.request: {e}")
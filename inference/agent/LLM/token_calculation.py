@@ -1,7 +1,10 @@
+import copy
 import json
 
 import tiktoken
 
+from agent.Utils.artifact_writer import artifact_writer
+
 
 def calculation_of_token(messages, model='gpt-3.5-turbo', max_tokens=4096):
     """
@@ -69,9 +72,9 @@ def calculation_of_token(messages, model='gpt-3.5-turbo', max_tokens=4096):
     return current_tokens
 
 
-def save_token_count_to_file(filename, step_tokens, task_name, global_reward_text_model, planning_text_model, token_pricing):
+async def save_token_count_to_file(filename, step_tokens, task_name, global_reward_text_model, planning_text_model, token_pricing):
     """
-    Save token count to a file in JSON format.
+    Save token count to a file in JSON format, on the artifact writer thread.
     :param filename: Name of the file to save the token count
     :param step_tokens: Number of tokens used in steps
     :param task_name: Name of the task associated with the token count
@@ -79,6 +82,12 @@ def save_token_count_to_file(filename, step_tokens, task_name, global_reward_tex
     :param planning_text_model: Model used for planning
     :param token_pricing: Pricing information for models
     """
+    # The task keeps updating step_tokens while the write waits in the queue
+    await artifact_writer.submit_async(write_token_count_to_file, filename, copy.deepcopy(step_tokens), task_name,
+                                       global_reward_text_model, planning_text_model, token_pricing)
+
+
+def write_token_count_to_file(filename, step_tokens, task_name, global_reward_text_model, planning_text_model, token_pricing):
 
     try:
         with open(filename, 'r') as file:
@@ -104,6 +113,8 @@ def save_token_count_to_file(filename, step_tokens, task_name, global_reward_tex
     data["total_planning_output_tokens"] += step_tokens["steps_planning_output_token_counts"]
     data["total_reward_input_tokens"] += step_tokens["steps_reward_input_token_counts"]
     data["total_reward_output_tokens"] += step_tokens["steps_reward_output_token_counts"]
+    data["total_small_model_input_tokens"] = data.get("total_small_model_input_tokens", 0) + step_tokens.get("steps_small_model_input_token_counts", 0)
+    data["total_small_model_output_tokens"] = data.get("total_small_model_output_tokens", 0) + step_tokens.get("steps_small_model_output_token_counts", 0)
     data["total_input_tokens"] += step_tokens["steps_input_token_counts"]
     data["total_output_tokens"] += step_tokens["steps_output_token_counts"]
     data["total_tokens"] += step_tokens["steps_token_counts"]
@@ -119,6 +130,11 @@ def save_token_count_to_file(filename, step_tokens, task_name, global_reward_tex
             data["total_planning_output_token_cost"] = 0
         data["total_planning_input_token_cost"] += step_tokens["steps_planning_input_token_counts"] * token_pricing[f"{planning_text_model}_input_price"]
         data["total_planning_output_token_cost"] += step_tokens["steps_planning_output_token_counts"] * token_pricing[f"{planning_text_model}_output_price"]
+        # Steps planned by the cascade's small model, at its own rate
+        small_model = step_tokens.get("cascade", {}).get("small_model")
+        if small_model in token_pricing["pricing_models"]:
+            data["total_planning_input_token_cost"] += step_tokens["steps_small_model_input_token_counts"] * token_pricing[f"{small_model}_input_price"]
+            data["total_planning_output_token_cost"] += step_tokens["steps_small_model_output_token_counts"] * token_pricing[f"{small_model}_output_price"]
 
     if global_reward_text_model in token_pricing["pricing_models"]:
         if "total_reward_input_token_cost" not in data:
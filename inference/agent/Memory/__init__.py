@@ -1 +1,2 @@
 from .short_memory import *
+from .long_memory import *
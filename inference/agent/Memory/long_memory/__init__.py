@@ -0,0 +1 @@
+from .workflow_cache import *
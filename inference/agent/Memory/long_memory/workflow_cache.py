@@ -0,0 +1,291 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from urllib.parse import quote_plus, urlparse
+
+from agent.Utils.artifact_writer import artifact_writer, write_json_atomic
+from logs import logger
+
+
+ELEMENT_ACTIONS = ["click", "fill_form", "fill_search", "select_option", "hover"]
+REPLAYED_ACTIONS = ELEMENT_ACTIONS + ["goto", "google_search", "go_back", "scroll_down", "scroll_up"]
+
+
+def parameter_values(input_parameters) -> dict:
+    """The input parameters of a task as {name: text}, the values a workflow is replayed with"""
+    if isinstance(input_parameters, dict):
+        items = input_parameters.items()
+    elif isinstance(input_parameters, list):
+        items = enumerate(input_parameters)
+    elif isinstance(input_parameters, str) and input_parameters.strip():
+        items = [("input", input_parameters)]
+    else:
+        items = []
+    values = {}
+    for name, value in items:
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool) and str(value).strip():
+            values[str(name)] = str(value).strip()
+    return values
+
+
+def parameterize(text: str, values: dict) -> str:
+    """Replace the parameter values in `text` by {name}, and by {name:url} where they appear URL encoded"""
+    text = str(text or "")
+    # Longer values first, so a value containing another one is replaced as a whole
+    for name, value in sorted(values.items(), key=lambda item: -len(item[1])):
+        if len(value) < 3:
+            # Short values like counts would match inside unrelated numbers and words
+            if normalize_text(text) == normalize_text(value):
+                return "{" + name + "}"
+            continue
+        text = re.sub(re.escape(value), "{" + name + "}", text, flags=re.IGNORECASE)
+        encoded = quote_plus(value)
+        if encoded != value:
+            text = text.replace(encoded, "{" + name + ":url}")
+    return text
+
+
+def substitute(template: str, values: dict) -> str:
+    for name, value in values.items():
+        template = template.replace("{" + name + ":url}", quote_plus(value)).replace("{" + name + "}", value)
+    return template
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+
+def url_pattern(url: str, values: dict) -> str:
+    """Host and path of `url` with parameters and numeric ids left out, what replayed pages have to match"""
+    parsed = urlparse(url or "")
+    if parsed.scheme not in ["http", "https"]:
+        return url or ""
+    path = parameterize(parsed.path.rstrip("/"), values)
+    return f"{(parsed.hostname or '').removeprefix('www.')}{re.sub(r'/[0-9]+(?=/|$)', '/{n}', path)}"
+
+
+def element_signature(tree, element_id) -> dict:
+    """What finds the element with observation id `element_id` again on a later visit of the page"""
+    try:
+        tag_idx = tree.nodeDict[int(element_id)]
+    except (KeyError, TypeError, ValueError):
+        return None
+    role = tree.get_tag_name(tree.elementNodes[tag_idx])[0]
+    text = normalize_text(tree.element_value.get(str(tag_idx), ""))
+    try:
+        selector = tree.get_selector_and_xpath(tag_idx)[0]
+    except Exception:
+        selector = None
+    same = [num for num, idx in sorted(tree.nodeDict.items()) if
+            tree.get_tag_name(tree.elementNodes[idx])[0] == role and
+            normalize_text(tree.element_value.get(str(idx), "")) == text]
+    return {"role": role, "text": text, "selector": selector, "ordinal": same.index(int(element_id)) if int(element_id) in same else 0}
+
+
+def find_element(tree, signature: dict, text: str) -> int:
+    """Observation id of the element matching `signature` with its text `text`, None when it is gone"""
+    text = normalize_text(text)
+    by_text, by_selector = [], []
+    for num, idx in sorted(tree.nodeDict.items()):
+        if tree.get_tag_name(tree.elementNodes[idx])[0] != signature["role"]:
+            continue
+        if normalize_text(tree.element_value.get(str(idx), "")) == text:
+            by_text.append(num)
+        elif signature.get("selector"):
+            try:
+                if tree.get_selector_and_xpath(idx)[0] == signature["selector"]:
+                    by_selector.append(num)
+            except Exception:
+                continue
+    if by_text:
+        return by_text[min(signature.get("ordinal", 0), len(by_text) - 1)]
+    return by_selector[0] if len(by_selector) == 1 else None
+
+
+class WorkflowCache:
+    """
+    Action sequences of finished tasks, replayed on new tasks of the same template.
+
+    Tasks often repeat with other `input_parameters`, and each of them was planned step by step
+    by the LLM. When a task finishes with an answer, its executed actions are saved with the
+    parameter values in their fill values, URLs and element texts replaced by the parameter
+    names, keyed by the task name parameterized the same way. A later task with the same template
+    gets the saved actions with its own values instead of a planning response, as long as each
+    step's page matches the recorded URL pattern and the recorded element is found by role and
+    text (or by selector) in the observation. The first mismatch or failed action ends the replay
+    and planning takes over from there. The final answer is always planned, on the page the
+    replay led to.
+
+    A workflow whose replays end `max_failures` times in a row without an answer is dropped.
+    """
+
+    def __init__(self, enabled: bool = False, path: str = "./output/workflows", max_age_hours: float = 168.0,
+                 max_failures: int = 2, max_steps: int = 30):
+        self.enabled = enabled
+        self.path = path
+        self.max_age = max_age_hours * 3600
+        self.max_failures = max_failures
+        self.max_steps = max_steps
+        self.values = {}
+        self.template = ""
+        self.workflow = None
+        self.cursor = 0
+        self.replaying = False
+        self.planned = []
+        self.recorded = []
+        self.divergence = None
+        self.saved = False
+
+    @classmethod
+    def from_config(cls, config: dict):
+        cache_config = config.get("workflow_cache", {})
+        return cls(
+            enabled=cache_config.get("enabled", False),
+            path=cache_config.get("path", "./output/workflows"),
+            max_age_hours=cache_config.get("max_age_hours", 168.0),
+            max_failures=cache_config.get("max_failures", 2),
+            max_steps=cache_config.get("max_steps", 30)
+        )
+
+    def _file(self) -> str:
+        key = hashlib.sha256(self.template.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.path, f"{key}.json")
+
+    def _read(self):
+        try:
+            with open(self._file(), "r", encoding="utf-8") as file:
+                workflow = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if workflow.get("template") != self.template or time.time() - workflow.get("saved_at", 0) > self.max_age:
+            return None
+        return workflow
+
+    async def load(self, task_name: str, input_parameters) -> bool:
+        """Look up the workflow of the task's template, True when there is one to replay"""
+        self.values = parameter_values(input_parameters)
+        self.template = normalize_text(parameterize(task_name, self.values))
+        if self.values:
+            # Tasks given other parameters do other things even with the same name
+            self.template += f" ({', '.join(sorted(self.values))})"
+        if not self.enabled:
+            return False
+        self.workflow = await asyncio.to_thread(self._read)
+        self.replaying = self.workflow is not None and len(self.workflow["steps"]) > 0
+        if self.replaying:
+            logger.info(f"Replaying the {len(self.workflow['steps'])} cached actions of '{self.template}'")
+        return self.replaying
+
+    def next_step(self, tree, page_url: str) -> dict:
+        """The next cached action as a planning response, None once planning has to take over"""
+        if not self.replaying:
+            return None
+        if self.cursor >= len(self.workflow["steps"]):
+            self.replaying = False
+            logger.info("Cached workflow replayed, planning the final answer")
+            return None
+        step = self.workflow["steps"][self.cursor]
+        if url_pattern(page_url, self.values) != step["url"]:
+            return self.diverge(f"page {page_url} doesn't match {step['url']}")
+        element_id = 0
+        if step["action_type"] in ELEMENT_ACTIONS:
+            element_id = find_element(tree, step["element"], substitute(step["element"]["text"], self.values))
+            if element_id is None:
+                return self.diverge(f"{step['element']['role']} '{step['element']['text']}' is not on the page")
+        value = substitute(step["value"], self.values)
+        self.cursor += 1
+        return {
+            "id": element_id,
+            "action_type": step["action_type"],
+            "value": value,
+            "description": {
+                "thought": f"Step {self.cursor} of the cached workflow for this kind of task.",
+                "action": f"{step['action_type']}: {value}"
+            },
+            "error_message": "",
+            "planning_token_count": [0, 0],
+            "batch": [],
+            "workflow_replay": True
+        }
+
+    def diverge(self, reason: str):
+        logger.info(f"Leaving the cached workflow at step {self.cursor + 1}: {reason}")
+        self.replaying = False
+        self.divergence = {"step": self.cursor, "reason": reason}
+        return None
+
+    def prepare(self, planned: list, tree, page_url: str) -> None:
+        """Describe the actions about to run on the current observation, before it is replaced"""
+        self.planned = []
+        if not self.enabled:
+            return
+        for action in planned:
+            step = {"url": url_pattern(page_url, self.values), "action_type": action.get("action_type"),
+                    "value": parameterize(action.get("value") if isinstance(action.get("value"), str) else "", self.values)}
+            if step["action_type"] in ELEMENT_ACTIONS:
+                step["element"] = element_signature(tree, action.get("id"))
+                if step["element"] is not None:
+                    step["element"]["text"] = parameterize(step["element"]["text"], self.values)
+            # Kept in place so the executed count of a batch still lines up
+            replayable = step["action_type"] in REPLAYED_ACTIONS and step.get("element", {}) is not None
+            self.planned.append(step if replayable else None)
+
+    def record(self, executed: int, error_message: str, replayed: bool) -> None:
+        """Keep the actions of the last step that ran, a failed replayed action ends the replay"""
+        self.recorded.extend(step for step in self.planned[:executed] if step is not None)
+        self.planned = []
+        if replayed and error_message:
+            self.diverge(f"the action failed: {error_message}")
+
+    def save(self) -> bool:
+        """The task finished with an answer, store what it did for the next task of its template"""
+        if not self.enabled or not self.recorded or len(self.recorded) > self.max_steps:
+            return False
+        # Replaces the workflow the task replayed, if any, which also clears its failures
+        workflow = {"template": self.template, "saved_at": time.time(), "failures": 0,
+                    "parameters": sorted(self.values), "steps": self.recorded}
+        artifact_writer.submit(write_json_atomic, self._file(), workflow)
+        self.saved = True
+        return True
+
+    async def record_failure(self) -> None:
+        """The task ended without an answer, a workflow it replayed counts a failure"""
+        if not self.enabled or self.workflow is None:
+            return
+        await asyncio.to_thread(self._record_failure)
+
+    def _record_failure(self) -> None:
+        workflow = self._read()
+        if workflow is None:
+            return
+        workflow["failures"] = workflow.get("failures", 0) + 1
+        if workflow["failures"] >= self.max_failures:
+            logger.info(f"Dropping the cached workflow of '{self.template}' after {workflow['failures']} unfinished tasks")
+            try:
+                os.remove(self._file())
+            except FileNotFoundError:
+                pass
+        else:
+            write_json_atomic(self._file(), workflow)
+
+    def summary(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "template": self.template,
+            "cached_steps": len(self.workflow["steps"]) if self.workflow else 0,
+            # Actions executed without a planning call
+            "replayed_steps": self.cursor,
+            "divergence": self.divergence,
+            "saved": self.saved
+        }
+
+
+__all__ = [
+    "WorkflowCache",
+    "element_signature",
+    "find_element",
+    "parameter_values"
+]
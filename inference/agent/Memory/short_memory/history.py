@@ -1,5 +1,36 @@
 import json5
 
+from agent.LLM.token_cal import estimate_tokens
+
+
+TRACE_PROMPT_HEADER = "The previous thoughts, actions and reflections are as follows: \
+            "
+
+
+def load_trace(previous_trace) -> list:
+    if isinstance(previous_trace, str):
+        try:
+            return json5.loads(previous_trace)
+        except ValueError:
+            return []
+    return previous_trace
+
+
+def format_step(idx: int, step: dict, next_reflection: str) -> str:
+    return f'Step{idx+1}:\"Thought: {step["thought"]}, Action: {step["action"]}, Reflection: {next_reflection}\";\n'
+
+
+def format_step_summary(idx: int, step: dict, next_reflection: str, max_chars: int = 120) -> str:
+    """Compacted form of a step: its action and the first sentence of the reflection that followed"""
+    reflection = str(next_reflection).split(". ")[0]
+    if len(reflection) > max_chars:
+        reflection = reflection[:max_chars] + "..."
+    return f'Step{idx+1}:\"Action: {step["action"]}, Reflection: {reflection}\";\n'
+
+
+def format_last_step(step: dict, reflection: str) -> str:
+    return f'Specifically in the last step, you gave the following Thought: {step["thought"]}\n You performed the following Action: {step["action"]}\n You had the following Reflection: {reflection}\";\n'
+
 
 class HistoryMemory:
     def __init__(self, previous_trace: list = [], reflection: str = "") -> None:
@@ -7,30 +38,105 @@ class HistoryMemory:
         self.reflection = reflection
 
     def stringfy_thought_and_action(self) -> str:
-        input_list = None
+        steps, last_step = self.stringfy_thought_and_action_parts()
+        return steps + last_step
+
+    def stringfy_thought_and_action_parts(self) -> tuple:
+        """The earlier steps, which only grow by appending from one step to the next, and the last step"""
+        input_list = load_trace(self.previous_trace)
         str_output = ""
-        try:
-            input_list = json5.loads(self.previous_trace, encoding="utf-8")
-        except:
-            input_list = self.previous_trace
-        if len(input_list) > 2:
+        last_step = ""
+        if len(input_list) > 1:
             str_output = "["
             for idx in range(len(input_list)-1):
-                str_output += f'Step{idx+1}:\"Thought: {input_list[idx]["thought"]}, Action: {input_list[idx]["action"]}, Reflection: {input_list[idx+1]["reflection"]}\";\n'
-            str_output += "]"
-            current_trace = input_list[-1]
-            str_output += f'Specifically in the last step, you gave the following Thought: {current_trace["thought"]}\n You performed the following Action: {current_trace["action"]}\n You had the following Reflection: {self.reflection}\";\n'
-        else:
-            current_trace = input_list[-1]
-            str_output += f'Specifically in the last step, you gave the following Thought: {current_trace["thought"]}\n You performed the following Action: {current_trace["action"]}\n You had the following Reflection: {self.reflection}\";\n'
-        return str_output
+                str_output += format_step(idx, input_list[idx], input_list[idx+1]["reflection"])
+            last_step = "]"
+        last_step += format_last_step(input_list[-1], self.reflection)
+        return str_output, last_step
 
     def construct_previous_trace_prompt(self) -> str:
-        stringfy_thought_and_action_output = self.stringfy_thought_and_action()
-        previous_trace_prompt = f"The previous thoughts, actions and reflections are as follows: \
-            {stringfy_thought_and_action_output}.\n\nYou have done the things above.\n\n"
-        return previous_trace_prompt
+        steps, last_step = self.construct_previous_trace_prompt_parts()
+        return steps + last_step
+
+    def construct_previous_trace_prompt_parts(self) -> tuple:
+        """The trace prompt split after its append-only part, so that part can extend a cached prompt prefix"""
+        steps, last_step = self.stringfy_thought_and_action_parts()
+        return TRACE_PROMPT_HEADER + steps, f"{last_step}.\n\nYou have done the things above.\n\n"
 
     @staticmethod
     def construct_cache(cache_info: list):
         pass
+
+
+class TraceMemory:
+    """
+    Trace of one task for the planning prompt, rendered one step at a time.
+
+    A step is rendered once, when the reflection that followed it is known, and appended to the
+    rendered trace. Once the rendered steps pass `max_tokens`, the oldest are compacted
+    `compact_steps` at a time into one-line summaries, keeping the last `recent_steps` in full.
+    Compacting in chunks leaves the prompt prefix unchanged between two slides of the window, so
+    provider prompt caching keeps hitting, and the summary is only re-rendered on a slide.
+    """
+
+    def __init__(self, max_tokens: int = 3000, recent_steps: int = 6, compact_steps: int = 5):
+        self.max_tokens = max_tokens
+        self.recent_steps = recent_steps
+        self.compact_steps = max(1, compact_steps)
+        self.reset()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        steps_config = config.get("steps", {})
+        return cls(
+            max_tokens=steps_config.get("trace_max_tokens", 3000),
+            recent_steps=steps_config.get("trace_recent_steps", 6),
+            compact_steps=steps_config.get("trace_compact_steps", 5)
+        )
+
+    def reset(self) -> None:
+        self.steps = []
+        self.summaries = []
+        self.compacted = 0
+        self.rendered_steps = ""
+        self.rendered_summary = ""
+
+    def update(self, trace: list) -> None:
+        """Render the steps added to `trace` since the last call"""
+        if len(trace) - 1 < len(self.steps):
+            self.reset()
+        for idx in range(len(self.steps), len(trace) - 1):
+            next_reflection = trace[idx + 1]["reflection"]
+            self.steps.append(format_step(idx, trace[idx], next_reflection))
+            self.summaries.append(format_step_summary(idx, trace[idx], next_reflection))
+            self.rendered_steps += self.steps[-1]
+        if self.max_tokens > 0:
+            self.compact()
+
+    def compact(self) -> None:
+        compacted = self.compacted
+        while (compacted + self.recent_steps < len(self.steps) and
+               estimate_tokens(self.rendered_summary) + estimate_tokens(self.rendered_steps) > self.max_tokens):
+            compacted = min(compacted + self.compact_steps, len(self.steps) - self.recent_steps)
+            self.rendered_steps = "".join(self.steps[compacted:])
+            self.rendered_summary = self.render_summary(compacted)
+        self.compacted = compacted
+
+    def render_summary(self, compacted: int) -> str:
+        # Summaries get half of the budget, past it the oldest are dropped a chunk at a time
+        start = 0
+        while (compacted - start > self.compact_steps and
+               estimate_tokens("".join(self.summaries[start:compacted])) > self.max_tokens / 2):
+            start += self.compact_steps
+        omitted = f"({start} earlier steps omitted);\n" if start else ""
+        return omitted + "".join(self.summaries[start:compacted])
+
+    def construct_previous_trace_prompt_parts(self, previous_trace, reflection: str = "") -> tuple:
+        """Same layout as HistoryMemory.construct_previous_trace_prompt_parts, with older steps compacted"""
+        trace = load_trace(previous_trace)
+        self.update(trace)
+        last_step = format_last_step(trace[-1], reflection)
+        if len(trace) > 1:
+            return TRACE_PROMPT_HEADER + "[" + self.rendered_summary + self.rendered_steps, \
+                f"]{last_step}.\n\nYou have done the things above.\n\n"
+        return TRACE_PROMPT_HEADER, f"{last_step}.\n\nYou have done the things above.\n\n"
@@ -12,57 +12,119 @@ from ..Utils import *
 class ResponseError(Exception):
     """Custom response error type"""
 
-    def __init__(self, message):
+    def __init__(self, message, planning_token_count=None):
         self.message = message
+        # Tokens spent on the response that couldn't be parsed
+        self.planning_token_count = planning_token_count
         super().__init__(self.message)
 
 
+# JSON schema of a planning response, used to ask the providers for structured output
+PLANNING_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "thought": {"type": "string"},
+        "action": {"type": "string"},
+        "action_input": {"type": ["string", "object", "array", "number", "boolean", "null"]},
+        "element_id": {"type": ["integer", "string", "null"]},
+        "description": {"type": "string"},
+        "actions": {"type": "array", "items": {"type": "object"}}
+    },
+    "required": ["thought"],
+    # A single action, or an action sequence when batching is on
+    "anyOf": [{"required": ["action"]}, {"required": ["actions"]}]
+}
+
+# How planning responses were parsed, llm_fallback counts the extra gpt-4o conversions
+parse_metrics = {"strict_json": 0, "json5": 0, "regex": 0, "llm_fallback": 0, "failed": 0}
+
+
 class ActionParser():
     def __init__(self):
         pass
 
     # Extract Thought and Action from the results returned by LLM,
     # return thought (str) and action (dict), where action has four fields: action, element_id, action_input, description
-    async def extract_thought_and_action(self, response: str) -> Tuple[dict, dict]:
-        result_action = None
-        
-        # First attempt: Try parsing with regex
-        # Try to extract content between markdown code blocks first
-        code_block = re.findall("```(.*?)```", response, re.S)
-        if code_block:
-            result_action = self.parse_action(code_block[0])
-        
-        # If no code block found or parsing failed, try parsing the whole response
-        if not result_action:
-            result_action = self.parse_action(response)
-            
-        # If that fails, try regex-based parsing
-        if not result_action:
-            result_action = self.parse_action_with_re(response)
-                
-        # Second attempt: Try using converter + regex if all regex methods failed
-        if not result_action:
+    async def extract_thought_and_action(self, response: str, llm_fallback: bool = False) -> Tuple[dict, dict]:
+        result_action, method = self.parse_planning_response(response)
+
+        # Last resort: ask gpt-4o to convert the response, which costs a whole extra round-trip
+        if not result_action and llm_fallback:
             try:
-                # Convert the response to proper format
-                converted_response = await planning_response_converter(response)
-                if converted_response:
-                    result_action = converted_response
-                else:
-                    # Try regex one more time on converted response
-                    result_action = self.parse_action_with_re(str(converted_response))
+                result_action = await planning_response_converter(response)
+                method = "llm_fallback" if result_action else None
             except Exception as e:
                 logger.error(f"Converter parsing failed: {str(e)}")
-                raise ResponseError("Failed to parse response using all available methods")
-        
+
         # Validate the parsed result
         if not result_action:
+            parse_metrics["failed"] += 1
             raise ResponseError("Response is an invalid JSON blob or Empty!")
-        elif result_action.get("action") == '':
+        parse_metrics[method] += 1
+        if result_action.get("action") == '':
             raise ResponseError("Response action is Empty, Please try again.")
-            
+
         result_thought = result_action.get("thought")
         return result_thought, result_action
 
+    def parse_planning_response(self, response: str) -> Tuple[dict, str]:
+        """Parse without any LLM call, returns the action dict (or None) and the method that parsed it"""
+        if not isinstance(response, str) or not response.strip():
+            return None, None
+        # Structured output is plain JSON, so the strict parser settles most responses
+        candidates = [response.strip()]
+        code_block = re.findall("```(?:json)?(.*?)```", response, re.S)
+        if code_block:
+            candidates.append(code_block[0])
+        longest = extract_longest_substring(response)
+        if longest:
+            candidates.append(longest)
+        for candidate in candidates:
+            try:
+                result_action = json.loads(candidate)
+            except ValueError:
+                continue
+            if isinstance(result_action, dict):
+                return result_action, "strict_json"
+        for candidate in candidates[1:]:
+            try:
+                result_action = json5.loads(extract_longest_substring(candidate) or candidate)
+            except (ValueError, TypeError):
+                continue
+            if isinstance(result_action, dict):
+                return result_action, "json5"
+        result_action = self.parse_action_with_re(response)
+        if result_action:
+            return result_action, "regex"
+        return None, None
+
+    @staticmethod
+    def split_actions(result_action: dict, max_actions: int = 5) -> List[dict]:
+        """
+        Split an action-sequence response into single actions, first one first.
+
+        A response may carry an `actions` list instead of one action, the shared thought is kept
+        on the first action. A get_final_answer only stays when it comes first, after other actions
+        it would answer from the page before them, so the sequence ends before it and the answer
+        is planned again on the page they lead to.
+        """
+        actions = result_action.get("actions")
+        if not isinstance(actions, list) or not actions:
+            return [result_action]
+        sequence = []
+        for action in actions[:max(1, max_actions)]:
+            if not isinstance(action, dict) or not action.get("action"):
+                break
+            if action.get("action") == "get_final_answer" and sequence:
+                break
+            sequence.append(action)
+            if action.get("action") == "get_final_answer":
+                break
+        if not sequence:
+            raise ResponseError("Response action sequence is Empty, Please try again.")
+        sequence[0] = {**sequence[0], "thought": result_action.get("thought", sequence[0].get("thought"))}
+        return sequence
+
     def parse_action_with_re(self, message):
         pattern = r'"thought"\s*:\s*"([^"]*)"\s*,\s*"action"\s*:\s*"([^"]*)"\s*,\s*"action_input"\s*:\s*"([^"]*)"\s*,\s*"element_id"\s*:\s*(null|\d*)\s*,\s*"description"\s*:\s*"([^"]*)"'
         match = re.search(pattern, message)
@@ -88,9 +150,10 @@ class ActionParser():
 
     def parse_action(self, message):
         message_substring = extract_longest_substring(message)
-        decoded_result = {}
-        decoded_result = json5.loads(message_substring)
-        return decoded_result
+        try:
+            return json.loads(message_substring)
+        except (ValueError, TypeError):
+            return json5.loads(message_substring)
 
     def extract_status_and_description(self, message) -> dict:
         try:
@@ -0,0 +1,170 @@
+import re
+import time
+
+from logs import logger
+
+
+# Actions that point at an element of the observation and fail when the id doesn't exist
+ELEMENT_ACTIONS = ["click", "fill_form", "fill_search", "select_option"]
+NO_PROGRESS_STATUSES = ["loop"]
+
+
+class CascadePolicy:
+    """
+    Per-task state of the planning model cascade.
+
+    Every step is first planned by the small model. The step is escalated to the large model
+    when the small model's answer can't be parsed, names an element id that isn't in the
+    observation, repeats an action that already failed in this task, or when the reward of the
+    previous step shows no progress. After an escalation the large model keeps planning for
+    `escalation_steps` steps, since the page that confused the small model is usually still there.
+    """
+
+    def __init__(self, small_model: str, large_model: str, min_reward_score: int = 3, escalation_steps: int = 1):
+        self.small_model = small_model
+        self.large_model = large_model
+        self.min_reward_score = min_reward_score
+        self.escalation_steps = escalation_steps
+        self.large_steps_left = 0
+        self.failed_actions = set()
+        self.stats = {
+            "steps": 0,
+            "small_model_calls": 0,
+            "large_model_calls": 0,
+            "escalations": {},
+            "tokens": {small_model: [0, 0], large_model: [0, 0]},
+            "rejected_small_model_tokens": [0, 0],
+            "latency": {small_model: 0.0, large_model: 0.0}
+        }
+
+    @classmethod
+    def from_config(cls, config: dict, large_model: str):
+        """Return a policy if the cascade is enabled for this planning model, else None"""
+        cascade_config = config["model"].get("cascade", {})
+        small_model = cascade_config.get("small_model", "gpt-4o-mini")
+        if not cascade_config.get("enabled", False) or small_model == large_model:
+            return None
+        return cls(
+            small_model=small_model,
+            large_model=large_model,
+            min_reward_score=cascade_config.get("min_reward_score", 3),
+            escalation_steps=cascade_config.get("escalation_steps", 1)
+        )
+
+    @staticmethod
+    def action_signature(planning_output: dict) -> tuple:
+        return (planning_output.get("action_type"), str(planning_output.get("id")), str(planning_output.get("value")))
+
+    def no_progress(self, step_reward: dict) -> bool:
+        if not step_reward:
+            return False
+        if str(step_reward.get("status", "")).lower() in NO_PROGRESS_STATUSES:
+            return True
+        try:
+            return int(step_reward.get("score")) <= self.min_reward_score
+        except (TypeError, ValueError):
+            return False
+
+    def choose_model(self, step_reward: dict = None) -> str:
+        """Pick the model that plans this step before any output has been seen"""
+        self.stats["steps"] += 1
+        if self.no_progress(step_reward):
+            self.escalate("no_progress")
+            return self.large_model
+        if self.large_steps_left > 0:
+            self.large_steps_left -= 1
+            return self.large_model
+        return self.small_model
+
+    def check(self, planning_output: dict, observation: str):
+        """Return why the small model's plan can't be trusted, or None to accept it"""
+        if not planning_output or not planning_output.get("action_type"):
+            return "parse_failure"
+        if planning_output.get("action_type") in ELEMENT_ACTIONS:
+            element_ids = set(re.findall(r"\[(\d+)\]", observation if isinstance(observation, str) else ""))
+            if str(planning_output.get("id")) not in element_ids:
+                return "unknown_element"
+        if self.action_signature(planning_output) in self.failed_actions:
+            return "repeated_failure"
+        return None
+
+    def escalate(self, reason: str) -> None:
+        logger.info(f"Escalating planning from {self.small_model} to {self.large_model}: {reason}")
+        self.stats["escalations"][reason] = self.stats["escalations"].get(reason, 0) + 1
+        # The escalated step itself is planned right away, the rest are taken in choose_model
+        self.large_steps_left = max(self.large_steps_left, self.escalation_steps - 1)
+
+    def record_call(self, model: str, planning_token_count: list, latency: float) -> None:
+        tokens = self.stats["tokens"].setdefault(model, [0, 0])
+        tokens[0] += planning_token_count[0]
+        tokens[1] += planning_token_count[1]
+        self.stats["latency"][model] = self.stats["latency"].get(model, 0.0) + latency
+        key = "small_model_calls" if model == self.small_model else "large_model_calls"
+        self.stats[key] += 1
+
+    def record_outcome(self, planning_output: dict, error_message: str) -> None:
+        """Remember actions that failed to execute so the small model can't retry them unchecked"""
+        if planning_output and error_message:
+            self.failed_actions.add(self.action_signature(planning_output))
+
+    def summary(self, token_pricing: dict = None) -> dict:
+        """Stats of this task, with the cost and latency saved compared to planning every step with the large model"""
+        summary = {**self.stats, "small_model": self.small_model, "large_model": self.large_model}
+        small_tokens = self.stats["tokens"][self.small_model]
+        large_tokens = self.stats["tokens"][self.large_model]
+        rejected = self.stats["rejected_small_model_tokens"]
+        large_calls = self.stats["large_model_calls"]
+        if token_pricing and all(model in token_pricing.get("pricing_models", []) for model in (self.small_model, self.large_model)):
+            def cost(model, tokens):
+                return tokens[0] * token_pricing[f"{model}_input_price"] + tokens[1] * token_pricing[f"{model}_output_price"]
+            actual = cost(self.small_model, small_tokens) + cost(self.large_model, large_tokens)
+            # Accepted small model steps would have used about as many tokens on the large model
+            accepted = [small_tokens[0] - rejected[0], small_tokens[1] - rejected[1]]
+            baseline = cost(self.large_model, large_tokens) + cost(self.large_model, accepted)
+            summary["cost"] = actual
+            summary["cost_saved"] = baseline - actual
+        if large_calls:
+            large_latency = self.stats["latency"][self.large_model] / large_calls
+            baseline_latency = large_latency * self.stats["steps"]
+            actual_latency = self.stats["latency"][self.large_model] + self.stats["latency"].get(self.small_model, 0.0)
+            summary["latency_saved"] = baseline_latency - actual_latency
+        return summary
+
+
+async def plan_with_cascade(cascade: CascadePolicy, plan_step, observation: str, step_reward: dict = None) -> dict:
+    """
+    Run `plan_step(model_name)` through the cascade and return the accepted planning output.
+
+    `plan_step` plans one step with the given model and raises when the response can't be parsed.
+    The small model's tokens, accepted or not, are returned in `small_model_token_count` and
+    `planning_token_count` only counts the large model's.
+    """
+    model = cascade.choose_model(step_reward)
+    small_model_tokens = [0, 0]
+    if model == cascade.small_model:
+        started = time.monotonic()
+        try:
+            planning_output = await plan_step(model)
+            small_model_tokens = planning_output.get("planning_token_count", [0, 0])
+            cascade.record_call(model, small_model_tokens, time.monotonic() - started)
+            reason = cascade.check(planning_output, observation)
+        except Exception as e:
+            # A response that couldn't be parsed was still paid for
+            small_model_tokens = getattr(e, "planning_token_count", None) or [0, 0]
+            cascade.record_call(model, small_model_tokens, time.monotonic() - started)
+            logger.info(f"Small planning model failed: {e}")
+            reason = "parse_failure"
+        if reason is None:
+            planning_output["planning_token_count"] = [0, 0]
+            planning_output["small_model_token_count"] = small_model_tokens
+            return planning_output
+        cascade.escalate(reason)
+        cascade.stats["rejected_small_model_tokens"][0] += small_model_tokens[0]
+        cascade.stats["rejected_small_model_tokens"][1] += small_model_tokens[1]
+        model = cascade.large_model
+    started = time.monotonic()
+    planning_output = await plan_step(model)
+    cascade.record_call(model, planning_output.get("planning_token_count", [0, 0]), time.monotonic() - started)
+    # Kept apart from planning_token_count, which is priced at the large model's rate
+    planning_output["small_model_token_count"] = small_model_tokens
+    return planning_output
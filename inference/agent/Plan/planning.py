@@ -5,6 +5,8 @@ from .action import *
 import time
 import json5
 from .action import ResponseError
+from .cascade import plan_with_cascade
+from .searchbar import searchbar_judge
 from logs import logger
 from typing import Tuple
 
@@ -19,16 +21,23 @@ class InteractionMode:
 
 
 class DomMode(InteractionMode):
-    def __init__(self, text_model=None, visual_model=None):
+    def __init__(self, text_model=None, visual_model=None, max_batch_actions=1, trace_memory=None,
+                 structured_output=True):
         super().__init__(text_model, visual_model)
+        self.max_batch_actions = max_batch_actions
+        self.trace_memory = trace_memory
+        self.structured_output = structured_output
 
     async def execute(self, status_description, user_request, previous_trace, observation, feedback, observation_VforD, input_parameters, output_parameters, response_type):
         planning_request = PlanningPromptConstructor().construct(
-            user_request, previous_trace, observation, feedback, status_description, input_parameters, output_parameters, response_type)
+            user_request, previous_trace, observation, feedback, status_description, input_parameters, output_parameters, response_type,
+            self.max_batch_actions, self.trace_memory)
         logger.info(
             f"\033[32mDOM_based_planning_request:\n{planning_request}\033[0m\n")
         logger.info(f"planning_text_model: {self.text_model.model}")
-        planning_response, error_message = await self.text_model.request(planning_request, max_tokens = 5000)
+        planning_response, error_message = await self.text_model.request(
+            planning_request, max_tokens = 5000,
+            response_schema=PLANNING_RESPONSE_SCHEMA if self.structured_output else None)
         input_token_count = calculation_of_token(planning_request, model=self.text_model.model)
         output_token_count = calculation_of_token(planning_response, model=self.text_model.model)
         planning_token_count = [input_token_count, output_token_count]
@@ -176,27 +185,62 @@ class Planning:
         feedback,
         mode,
         observation_VforD,
-        status_description
+        status_description,
+        cascade=None,
+        step_reward=None,
+        html_tree=None,
+        page_url="",
+        trace_memory=None
     ):
+        async def plan_step(model_name):
+            return await Planning.plan_with_model(
+                config, user_request, model_name, previous_trace, observation, feedback,
+                mode, observation_VforD, status_description, html_tree, page_url, trace_memory)
+
+        if cascade is None:
+            return await plan_step(text_model_name)
+        return await plan_with_cascade(cascade, plan_step, observation, step_reward)
 
-        gpt35 = GPTGenerator(model="gpt-3.5-turbo")
-        gpt4v = GPTGenerator(model="gpt-4-turbo")
+    @staticmethod
+    async def plan_with_model(
+        config,
+        user_request,
+        text_model_name,
+        previous_trace,
+        observation,
+        feedback,
+        mode,
+        observation_VforD,
+        status_description,
+        html_tree=None,
+        page_url="",
+        trace_memory=None
+    ):
 
         all_json_models = config["model"]["json_models"]
         is_json_response = config["model"]["json_model_response"]
+        max_batch_actions = config["steps"].get("max_batch_actions", 1)
+        structured_output = config["model"].get("structured_output", True)
+        llm_parse_fallback = config["model"].get("llm_parse_fallback", False)
+
+        # Generators are shared per event loop and only the mode of this task is built
+        def gpt4v():
+            return get_llm_instance("gpt-4-turbo")
+
+        def llm_planning_text():
+            return get_llm_instance(text_model_name, is_json_response, all_json_models)
 
-        llm_planning_text = create_llm_instance(
-            text_model_name, is_json_response, all_json_models)
         modes = {
-            "dom": DomMode(text_model=llm_planning_text),
-            "dom_v_desc": DomVDescMode(visual_model=gpt4v, text_model=llm_planning_text),
-            "vision_to_dom": VisionToDomMode(visual_model=gpt4v, text_model=llm_planning_text),
-            "d_v": DVMode(visual_model=gpt4v),
-            "vision": VisionMode(visual_model=gpt4v)
+            "dom": lambda: DomMode(text_model=llm_planning_text(), max_batch_actions=max_batch_actions,
+                                  trace_memory=trace_memory, structured_output=structured_output),
+            "dom_v_desc": lambda: DomVDescMode(visual_model=gpt4v(), text_model=llm_planning_text()),
+            "vision_to_dom": lambda: VisionToDomMode(visual_model=gpt4v(), text_model=llm_planning_text()),
+            "d_v": lambda: DVMode(visual_model=gpt4v()),
+            "vision": lambda: VisionMode(visual_model=gpt4v())
         }
 
         # planning_response_thought, planning_response_action
-        planning_response, error_message, planning_response_thought, planning_response_action, planning_token_count = await modes[mode].execute(
+        planning_response, error_message, planning_response_thought, planning_response_action, planning_token_count = await modes[mode]().execute(
             status_description=status_description,
             user_request=user_request,
             previous_trace=previous_trace,
@@ -208,23 +252,22 @@ class Planning:
             response_type=config["response_type"]
         )
         logger.info(f"\033[34mPlanning_Response:\n{planning_response}\033[0m")
+        follow_up_actions = []
         if mode != "vision_to_dom":
             try:
                 planning_response_thought, planning_response_action = await ActionParser().extract_thought_and_action(
-                    planning_response)
+                    planning_response, llm_fallback=llm_parse_fallback)
+                if mode == "dom":
+                    planning_response_action, *follow_up_actions = ActionParser.split_actions(
+                        planning_response_action, max_batch_actions)
             except ResponseError as e:
                 logger.error(f"Response Error:{e.message}")
+                e.planning_token_count = planning_token_count
                 raise
 
         if planning_response_action.get('action') == "fill_form":
-            JudgeSearchbarRequest = JudgeSearchbarPromptConstructor().construct(
-                input_element=observation, planning_response_action=planning_response_action)
-            try:
-                Judge_response, error_message = await gpt35.request(JudgeSearchbarRequest)
-                if Judge_response.lower() == "yes":
-                    planning_response_action['action'] = "fill_search"  ### action里有link
-            except:
-                planning_response_action['action'] = "fill_form"
+            if await searchbar_judge.is_searchbar(html_tree, page_url, observation, planning_response_action):
+                planning_response_action['action'] = "fill_search"  ### action里有link
 
         # The description should include both the thought (returned by LLM) and the action (parsed from the planning response)
         planning_response_action["description"] = {
@@ -254,5 +297,15 @@ class Planning:
         dict_to_write['description'] = planning_response_action['description']
         dict_to_write['error_message'] = error_message
         dict_to_write['planning_token_count'] = planning_token_count
+        # Further actions of a batch, executed after this one while the page stays the same
+        dict_to_write['batch'] = [{
+            'id': action.get('element_id', ''),
+            'action_type': action.get('action', ''),
+            'value': action.get('action_input', ''),
+            'description': {
+                "thought": planning_response_thought,
+                "action": action.get("description") or f'{action.get("action")}: {action.get("action_input", "")}'
+            }
+        } for action in follow_up_actions]
 
         return dict_to_write
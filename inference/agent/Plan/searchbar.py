@@ -0,0 +1,122 @@
+import re
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from agent.Prompt import *
+from agent.LLM import *
+from logs import logger
+
+
+SEARCH_WORDS = re.compile(r"search|find|query|lookup|搜索|查找|检索|recherch|buscar|suche", re.I)
+SEARCH_FIELD_NAMES = ["q", "query", "search", "s", "k", "keyword", "keywords", "term", "wd", "field-keywords", "search_query"]
+NON_SEARCH_INPUT_TYPES = ["email", "password", "tel", "number", "date", "datetime-local", "month", "week",
+                          "time", "url", "color", "range"]
+
+
+def searchbar_score(context: dict) -> int:
+    """Evidence that pressing Enter after filling this input runs a search, positive means search box"""
+    attributes = {key: str(value) for key, value in context["attributes"].items()}
+    input_type = attributes.get("type", "text").lower()
+    if context["tagName"] == "textarea" or input_type in NON_SEARCH_INPUT_TYPES:
+        return -3
+    score = 0
+    if input_type == "search":
+        score += 3
+    if attributes.get("role", "").lower() in ["searchbox", "combobox"]:
+        score += 2
+    if attributes.get("name", "").lower() in SEARCH_FIELD_NAMES:
+        score += 2
+    described = " ".join(attributes.get(key, "") for key in ["placeholder", "aria-label", "title", "id", "class", "name"])
+    if SEARCH_WORDS.search(described):
+        score += 2
+    if attributes.get("autocomplete", "").lower() in ["email", "name", "tel", "username", "street-address",
+                                                      "postal-code", "current-password", "new-password"]:
+        score -= 3
+    form = context.get("form")
+    if form is not None:
+        form_attributes = {key: str(value) for key, value in form["attributes"].items()}
+        if form_attributes.get("role", "").lower() == "search" or SEARCH_WORDS.search(
+                " ".join(form_attributes.get(key, "") for key in ["action", "id", "class", "name", "aria-label"])):
+            score += 2
+        # Enter in a multi-field form submits it before the other fields are filled
+        if form["fields"] >= 3:
+            score -= 3
+        elif form["fields"] == 2:
+            score -= 1
+    return score
+
+
+class SearchbarJudge:
+    """
+    Decides whether a fill_form should become a fill_search (fill then press Enter).
+
+    The input's own attributes and its enclosing form usually settle it locally. Verdicts are
+    memoized per site and input, so the LLM is only asked about ambiguous inputs, once per site.
+    """
+
+    def __init__(self, threshold: int = 2, max_cache_size: int = 5000):
+        self.threshold = threshold
+        self.max_cache_size = max_cache_size
+        self.cache = OrderedDict()
+        self.stats = {"local": 0, "cached": 0, "llm": 0}
+
+    @staticmethod
+    def cache_key(page_url: str, context: dict) -> tuple:
+        attributes = context["attributes"]
+        return (urlparse(page_url or "").netloc, context["tagName"],
+                *(str(attributes.get(key, "")) for key in ["id", "name", "type", "placeholder", "aria-label"]))
+
+    def remember(self, key: tuple, verdict: bool) -> None:
+        self.cache[key] = verdict
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_cache_size:
+            self.cache.popitem(last=False)
+
+    def local_verdict(self, context: dict):
+        score = searchbar_score(context)
+        if score >= self.threshold:
+            return True
+        if score <= -self.threshold:
+            return False
+        return None
+
+    async def is_searchbar(self, html_tree, page_url: str, observation: str, planning_response_action: dict) -> bool:
+        context = None
+        try:
+            if html_tree is not None:
+                context = html_tree.get_form_context(html_tree.nodeDict[int(planning_response_action["element_id"])])
+        except (KeyError, ValueError, TypeError):
+            context = None
+        if context is not None:
+            key = self.cache_key(page_url, context)
+            if key in self.cache:
+                self.stats["cached"] += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            verdict = self.local_verdict(context)
+            if verdict is not None:
+                self.stats["local"] += 1
+                self.remember(key, verdict)
+                return verdict
+        verdict = await self.llm_verdict(observation, planning_response_action)
+        if verdict is None:
+            return False
+        if context is not None:
+            self.remember(self.cache_key(page_url, context), verdict)
+        return verdict
+
+    async def llm_verdict(self, observation: str, planning_response_action: dict):
+        self.stats["llm"] += 1
+        judge_searchbar_request = JudgeSearchbarPromptConstructor().construct(
+            input_element=observation, planning_response_action=planning_response_action)
+        try:
+            judge_response, error_message = await get_llm_instance("gpt-3.5-turbo").request(judge_searchbar_request)
+        except Exception as e:
+            error_message = str(e)
+        if error_message:
+            logger.warning(f"Searchbar judge request failed, keeping fill_form: {error_message}")
+            return None
+        return judge_response.strip().lower().startswith("yes")
+
+
+searchbar_judge = SearchbarJudge()
@@ -1,3 +1,4 @@
 from .prompt_constructor import *
 from .base_prompts import *
-from .vision_prompts import *
\ No newline at end of file
+from .vision_prompts import *
+from .registry import *
\ No newline at end of file
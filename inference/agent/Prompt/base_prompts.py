@@ -100,6 +100,25 @@ class BasePrompts:
         take a greedy approach and include its link for further verification.
     '''
 
+    planning_prompt_batch_actions = '''
+    **Multiple Actions**:
+        When several actions can be decided from the current accessibility tree alone, such as filling the fields of a form,
+        you may output up to {{max_batch_actions}} of them at once in an "actions" array. They are executed in order, and the rest
+        of the array is skipped if an action fails or the page navigates, so put any action that submits or navigates last.
+        Only batch actions whose element_id you can see now. get_final_answer is never batched, give it on its own once the page shows the answer.
+        ```
+        {
+            "thought": "The sign up form has name, email and country fields, I can fill all of them and submit",
+            "actions": [
+                {"action": "fill_form", "action_input": "Jane Doe", "element_id": 12, "description": "Fill the name field"},
+                {"action": "fill_form", "action_input": "jane@example.com", "element_id": 13, "description": "Fill the email field"},
+                {"action": "select_option", "action_input": "Canada", "element_id": 14, "description": "Select the country"},
+                {"action": "click", "action_input": "Sign up", "element_id": 15, "description": "Submit the form"}
+            ]
+        }
+        ```
+    '''
+
     planning_prompt_user = '''The current task is described as "{{user_request}}".
     Input parameters: {{input_parameters}}
     Required output parameters: {{output_parameters}}
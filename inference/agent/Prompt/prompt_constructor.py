@@ -2,10 +2,11 @@ from ..Utils.utils import is_valid_base64
 import json5
 from .base_prompts import BasePrompts
 from .vision_prompts import VisionPrompts
-from jinja2 import Template
+from .registry import prompt_registry
+from agent.LLM.prompt_cache import cache_block, text_block
 
 
-from agent.Memory.short_memory.history import HistoryMemory
+from agent.Memory.short_memory.history import HistoryMemory, load_trace
 
 
 class BasePromptConstructor:
@@ -28,30 +29,47 @@ class PlanningPromptConstructor(BasePromptConstructor):
             status_description: str = "",
             input_parameters: dict = {},
             output_parameters: dict = {},
-            response_type: str = ""
+            response_type: str = "",
+            max_batch_actions: int = 1,
+            trace_memory=None
     ) -> list:
-        self.prompt_user = Template(self.prompt_user).render(
+        # The task part is rendered once per task, only the trace and observation change per step
+        prompt_user = prompt_registry.prefix(
+            self.prompt_user,
             user_request=user_request,
             input_parameters=input_parameters,
             output_parameters=output_parameters,
             response_type=response_type
         )
+        prompt_system = self.prompt_system
+        if max_batch_actions > 1:
+            prompt_system += prompt_registry.prefix(
+                BasePrompts.planning_prompt_batch_actions, max_batch_actions=max_batch_actions)
+        # The task and the append-only part of the trace form a prefix that is identical on the
+        # next step, it is marked so providers with prompt caching don't process it again
+        prompt_suffix = ""
         if len(previous_trace) > 0:
-            self.prompt_user += HistoryMemory(
-                previous_trace=previous_trace, reflection=status_description).construct_previous_trace_prompt()
+            if trace_memory is not None:
+                trace_steps, trace_last_step = trace_memory.construct_previous_trace_prompt_parts(
+                    previous_trace, status_description)
+            else:
+                trace_steps, trace_last_step = HistoryMemory(
+                    previous_trace=previous_trace, reflection=status_description).construct_previous_trace_prompt_parts()
+            prompt_user += trace_steps
+            prompt_suffix += trace_last_step
             if status_description != "":
-                self.prompt_user += \
+                prompt_suffix += \
                     f"Task status is judged as:\n{status_description}\n"
             if feedback != "":
-                self.prompt_user += f"Below is the error message from the last action execution:\n {feedback}\n"
-            self.prompt_user += f"\nHere is the accessibility tree on current page:\n{observation}"
-        messages = [{"role": "system", "content": self.prompt_system}, {
-            "role": "user", "content": self.prompt_user}]
+                prompt_suffix += f"Below is the error message from the last action execution:\n {feedback}\n"
+            prompt_suffix += f"\nHere is the accessibility tree on current page:\n{observation}"
+        messages = [{"role": "system", "content": prompt_system}, {
+            "role": "user", "content": [cache_block(prompt_user), text_block(prompt_suffix)]}]
         return messages
 
     # Previous thought, action and reflection are converted to formatted strings
     def stringfy_thought_and_action(self, input_list: list) -> str:
-        input_list = json5.loads(input_list, encoding="utf-8")
+        input_list = load_trace(input_list)
         str_output = "["
         for idx, i in enumerate(input_list):
             str_output += f'Step{idx + 1}:\"Thought: {i["thought"]}, Action: {i["action"]}, Reflection:{i["reflection"]}\";\n'
@@ -70,7 +88,7 @@ class VisionDisc2PromptConstructor(BasePromptConstructor):
             user_request: str,
             base64_image: str
     ) -> list:
-        rendered_prompt = Template(self.prompt_user).render(
+        rendered_prompt = prompt_registry.render(self.prompt_user,
             user_request=user_request)
         prompt_elements = [{"type": "text", "text": rendered_prompt},
                            {"type": "text", "text": "current web page screenshot is:"},
@@ -115,27 +133,27 @@ class ObservationVisionDiscPromptConstructor(BasePromptConstructor):
             status_description: str = "",
             vision_disc_response: str = ""
     ) -> list:
-        self.prompt_user = Template(self.prompt_user).render(
+        prompt_user = prompt_registry.render(self.prompt_user,
             user_request=user_request)
         if len(previous_trace) > 0:
-            self.prompt_user += HistoryMemory(
+            prompt_user += HistoryMemory(
                 previous_trace=previous_trace, reflection=status_description).construct_previous_trace_prompt()
             # if status_description != "":
             #     self.prompt_user += \
             #         f"Task completion description is {status_description}"
             if feedback != "":
-                self.prompt_user += f"An invalid action description is below:\n {feedback}\n"
-            self.prompt_user += f"\nHere is the accessibility tree that you should refer to for this task:\n{observation}"
+                prompt_user += f"An invalid action description is below:\n {feedback}\n"
+            prompt_user += f"\nHere is the accessibility tree that you should refer to for this task:\n{observation}"
             if vision_disc_response:
-                self.prompt_user += "\n\nHere is a visual analysis of the webpage's screenshot:\n" + \
+                prompt_user += "\n\nHere is a visual analysis of the webpage's screenshot:\n" + \
                     vision_disc_response
         messages = [{"role": "system", "content": self.prompt_system},
-                    {"role": "user", "content": self.prompt_user}]
+                    {"role": "user", "content": prompt_user}]
         return messages
 
     # Convert previous thought and action into formatted string
     def stringfy_thought_and_action(self, input_list: list) -> str:
-        input_list = json5.loads(input_list, encoding="utf-8")
+        input_list = load_trace(input_list)
         str_output = "["
         for idx, i in enumerate(input_list):
             str_output += f'Step{idx + 1}:\"Thought: {i["thought"]}, Action: {i["action"]}\";\n'
@@ -157,7 +175,7 @@ class ObservationVisionActPromptConstructor(BasePromptConstructor):
             feedback: str = "",
             status_description: str = ""
     ) -> list:
-        rendered_prompt = Template(self.prompt_user).render(
+        rendered_prompt = prompt_registry.render(self.prompt_user,
             user_request=user_request)
         prompt_elements = [{"type": "text", "text": rendered_prompt}]
         if len(previous_trace) > 0:
@@ -198,12 +216,12 @@ class VisionToDomPromptConstructor(BasePromptConstructor):
             observation: str
     ) -> list:
         # self.prompt_user = Template(self.prompt_user).render(user_request=user_request)
-        self.prompt_user += f"Target Element Description: {target_element}\n"
+        prompt_user = self.prompt_user + f"Target Element Description: {target_element}\n"
         if action_description:
-            self.prompt_user += f"Action Description: {action_description}\n"
-        self.prompt_user += "\nHere is the accessibility tree that you should refer to for this task:\n" + observation
+            prompt_user += f"Action Description: {action_description}\n"
+        prompt_user += "\nHere is the accessibility tree that you should refer to for this task:\n" + observation
         messages = [{"role": "system", "content": self.prompt_system},
-                    {"role": "user", "content": self.prompt_user}]
+                    {"role": "user", "content": prompt_user}]
         return messages
 
 
@@ -225,7 +243,7 @@ class D_VObservationPromptConstructor(BasePromptConstructor):
         is_valid, message = is_valid_base64(
             observation_VforD)
         print("prompt_constructor.py D_VObservationPromptConstructor:", message, "\n")
-        rendered_prompt = Template(self.prompt_user).render(
+        rendered_prompt = prompt_registry.render(self.prompt_user,
             user_request=user_request)
         prompt_elements = [{"type": "text", "text": rendered_prompt}]
         if len(previous_trace) > 0:
@@ -261,7 +279,7 @@ class D_VObservationPromptConstructor(BasePromptConstructor):
 
     # Convert previous thought and action into formatted string
     def stringfy_thought_and_action(self, input_list: list) -> str:
-        input_list = json5.loads(input_list, encoding="utf-8")
+        input_list = load_trace(input_list)
         str_output = "["
         for idx, i in enumerate(input_list):
             str_output += f'Step{idx + 1}:\"Thought: {i["thought"]}, Action: {i["action"]}\";\n'
@@ -275,7 +293,7 @@ class VisionObservationPromptConstructor(BasePromptConstructor):
         self.prompt_user = VisionPrompts.vision_prompt_user
 
     def construct(self, user_request: str, previous_trace: str, base64_image: str) -> list:
-        rendered_prompt = Template(self.prompt_user).render(
+        rendered_prompt = prompt_registry.render(self.prompt_user,
             user_request=user_request)
         prompt_elements = [{"type": "text", "text": rendered_prompt}]
 
@@ -294,7 +312,7 @@ class VisionObservationPromptConstructor(BasePromptConstructor):
         return messages
 
     def stringfy_thought_and_action(self, input_list: list) -> str:
-        input_list = json5.loads(input_list, encoding="utf-8")
+        input_list = load_trace(input_list)
         str_output = "["
         for idx, i in enumerate(input_list):
             str_output += f'Step{idx + 1}:\"Thought: {i["thought"]}, Action: {i["action"]}\";\n'
@@ -318,9 +336,10 @@ class RewardPromptConstructor(BasePromptConstructor):
             current_info=None,
             instruction: str = ""
     ) -> list:
+        prompt_system = self.prompt_system
         if ground_truth_mode:
-            self.prompt_system = BasePrompts.global_reward_with_GroundTruth_prompt_system
-        rendered_prompt = Template(self.prompt_user).render(
+            prompt_system = BasePrompts.global_reward_with_GroundTruth_prompt_system
+        rendered_prompt = prompt_registry.render(self.prompt_user,
             user_request=user_request, stringfy_thought_and_action_output=stringfy_thought_and_action_output)
         prompt_elements = [{"type": "text", "text": rendered_prompt}]
         if 'current_url' in current_info:
@@ -342,7 +361,7 @@ class RewardPromptConstructor(BasePromptConstructor):
         if ground_truth_mode:
             prompt_elements.append(
                 {"type": "text", "text": f"Here is the Reference Guide for the target task:\n\n{instruction}"})
-        messages = [{"role": "system", "content": self.prompt_system},
+        messages = [{"role": "system", "content": prompt_system},
                     {"role": "user", "content": prompt_elements}]
         return messages
 
@@ -360,12 +379,12 @@ class CurrentRewardPromptConstructor(BasePromptConstructor):
             stringfy_current_trace_output: str,
             observation: str
     ) -> list:
-        self.prompt_user = Template(self.prompt_user).render(
+        prompt_user = prompt_registry.render(self.prompt_user,
             user_request=user_request, stringfy_previous_trace_output=stringfy_previous_trace_output,
             stringfy_current_trace_output=stringfy_current_trace_output)
-        self.prompt_user += f"\nHere is the accessibility tree that you should refer to:\n{observation}"
+        prompt_user += f"\nHere is the accessibility tree that you should refer to:\n{observation}"
         messages = [{"role": "system", "content": self.prompt_system}, {
-            "role": "user", "content": self.prompt_user}]
+            "role": "user", "content": prompt_user}]
         return messages
 
 
@@ -386,11 +405,11 @@ class VisionRewardPromptConstructor(BasePromptConstructor):
         if not is_valid_base64(observation_VforD):
             print("The observation_VforD provided is not a valid Base64 encoding")
 
-        self.prompt_user = Template(self.prompt_user).render(
+        prompt_user = prompt_registry.render(self.prompt_user,
             user_request=user_request, stringfy_previous_trace_output=stringfy_previous_trace_output,
             stringfy_current_trace_output=stringfy_current_trace_output)
-        self.prompt_user += f"the key information of current web page is: {observation}"
-        prompt_elements = [{"type": "text", "text": self.prompt_user}]
+        prompt_user += f"the key information of current web page is: {observation}"
+        prompt_elements = [{"type": "text", "text": prompt_user}]
 
         prompt_elements.append(
             {"type": "text", "text": "the screenshot of current web page is :"})
@@ -411,11 +430,11 @@ class JudgeSearchbarPromptConstructor(BasePromptConstructor):
     # Build a prompt to determine whether it is a search box, and output a format that can be parsed by openai
     # TODO decoded_result
     def construct(self, input_element, planning_response_action) -> list:
-        self.prompt_user = Template(self.prompt_user).render(input_element=str(
+        prompt_user = prompt_registry.render(self.prompt_user, input_element=str(
             input_element), element_id=planning_response_action['element_id'],
             action_input=planning_response_action['action_input'])
         messages = [{"role": "system", "content": self.prompt_system}, {
-            "role": "user", "content": self.prompt_user}]
+            "role": "user", "content": prompt_user}]
         return messages
 
 
@@ -425,8 +444,8 @@ class SemanticMatchPromptConstructor(BasePromptConstructor):
         self.prompt_user = BasePrompts.semantic_match_prompt_user
 
     def construct(self, input_answer, semantic_method) -> list:
-        self.prompt_user = Template(self.prompt_user).render(
+        prompt_user = prompt_registry.render(self.prompt_user,
             semantic_method=semantic_method, input_answer=input_answer)
         messages = [{"role": "system", "content": self.prompt_system}, {
-            "role": "user", "content": self.prompt_user}]
+            "role": "user", "content": prompt_user}]
         return messages
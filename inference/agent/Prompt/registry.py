@@ -0,0 +1,61 @@
+import json
+from collections import OrderedDict
+
+from jinja2 import Template
+
+from .base_prompts import BasePrompts
+from .vision_prompts import VisionPrompts
+
+
+class PromptRegistry:
+    """
+    Compiled Jinja templates of the prompts, keyed by their source string.
+
+    Compiling a template costs far more than rendering it, so every template is compiled once
+    and shared by all tasks. Rendered static prefixes (the parts of a prompt that only depend on
+    the task) are kept in a small LRU so each step only builds its dynamic suffix.
+    """
+
+    def __init__(self, max_prefixes: int = 256):
+        self.templates = {}
+        self.prefixes = OrderedDict()
+        self.max_prefixes = max_prefixes
+
+    def register(self, *prompt_classes) -> None:
+        """Compile every templated prompt string of the given prompt classes"""
+        for prompt_class in prompt_classes:
+            for name, value in vars(prompt_class).items():
+                if not name.startswith("_") and isinstance(value, str) and "{{" in value:
+                    self.template(value)
+
+    def template(self, source: str) -> Template:
+        template = self.templates.get(source)
+        if template is None:
+            template = self.templates[source] = Template(source)
+        return template
+
+    def render(self, source: str, **kwargs) -> str:
+        return self.template(source).render(**kwargs)
+
+    def prefix(self, source: str, **kwargs) -> str:
+        """Render `source`, reusing the result for the same arguments"""
+        key = (source, json.dumps(kwargs, sort_keys=True, default=str, ensure_ascii=False))
+        rendered = self.prefixes.get(key)
+        if rendered is None:
+            rendered = self.render(source, **kwargs)
+            self.prefixes[key] = rendered
+            while len(self.prefixes) > self.max_prefixes:
+                self.prefixes.popitem(last=False)
+        else:
+            self.prefixes.move_to_end(key)
+        return rendered
+
+
+prompt_registry = PromptRegistry()
+prompt_registry.register(BasePrompts, VisionPrompts)
+
+
+__all__ = [
+    "PromptRegistry",
+    "prompt_registry"
+]
@@ -1 +1,2 @@
-from .global_reward import *
\ No newline at end of file
+from .global_reward import *
+from .scheduler import *
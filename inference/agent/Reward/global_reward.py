@@ -3,6 +3,7 @@ from agent.Prompt import *
 from agent.LLM import *
 from agent.Plan.action import *
 import time
+import asyncio
 import json5
 from logs import logger
 
@@ -76,6 +77,8 @@ class InteractionMode:
                     # traceback.print_exc()
                     logger.info(
                         f"planning response_str or reward_response error for {i+1} times")
+                    if i < 2:
+                        await asyncio.sleep(backoff_delay(i))
                     continue
 
             logger.info(
@@ -101,12 +104,12 @@ class GlobalReward:
         ground_truth_data,
     ):
 
-        gpt4v = GPTGenerator(model="gpt-4-turbo")
+        gpt4v = get_llm_instance("gpt-4-turbo")
 
         all_json_models = config["model"]["json_models"]
         is_json_response = config["model"]["json_model_response"]
 
-        llm_global_reward_text = create_llm_instance(
+        llm_global_reward_text = get_llm_instance(
             model_name, is_json_response, all_json_models)
         
         _, reward_response, reward_token_count = await InteractionMode(text_model=llm_global_reward_text, visual_model=gpt4v).get_global_reward(
@@ -0,0 +1,125 @@
+from urllib.parse import urlparse
+
+from logs import logger
+
+
+SCHEDULE_MODES = ["every_step", "every_k", "triggers", "adaptive"]
+TRIGGERS = ["url_change", "repeated_action", "action_error", "final_answer"]
+
+
+class RewardScheduler:
+    """
+    Decides before each planning step whether the global reward is evaluated.
+
+    `every_step` is the original behaviour. `every_k` evaluates every `every_k_steps` steps,
+    `triggers` only when something happened that the planner needs judged: the page URL changed,
+    an action was repeated, an action failed, or the planner proposed a final answer. `adaptive`
+    evaluates on triggers and at least every `every_k_steps` steps.
+    """
+
+    def __init__(self, mode: str = "every_step", every_k_steps: int = 3, triggers: list = None):
+        if mode not in SCHEDULE_MODES:
+            raise ValueError(f"Unknown reward schedule mode {mode}, expected one of {SCHEDULE_MODES}")
+        self.mode = mode
+        self.every_k_steps = max(1, every_k_steps)
+        self.triggers = list(TRIGGERS if triggers is None else triggers)
+        self.evaluated_url = None
+        self.steps_since_evaluation = 0
+        self.seen_actions = set()
+        self.pending = []
+        self.steps = []
+        self.outcomes = []
+
+    @classmethod
+    def from_config(cls, config: dict):
+        schedule_config = config.get("reward_schedule", {})
+        return cls(
+            mode=schedule_config.get("mode", "every_step"),
+            every_k_steps=schedule_config.get("every_k_steps", 3),
+            triggers=schedule_config.get("triggers")
+        )
+
+    @staticmethod
+    def normalize_url(url: str) -> str:
+        parsed = urlparse(url or "")
+        return f"{parsed.netloc}{parsed.path.rstrip('/')}?{parsed.query}"
+
+    def observe(self, url: str, actions: list, error_message: str = "") -> None:
+        """Record the outcome of the actions executed in a step, `actions` being planning outputs"""
+        self.steps_since_evaluation += 1
+        if "url_change" in self.triggers and self.evaluated_url is not None \
+                and self.normalize_url(url) != self.normalize_url(self.evaluated_url):
+            self.pending.append("url_change")
+        if "action_error" in self.triggers and error_message:
+            self.pending.append("action_error")
+        signatures = [[action.get("action_type"), str(action.get("id")), str(action.get("value"))] for action in actions]
+        for signature in signatures:
+            if "repeated_action" in self.triggers and tuple(signature) in self.seen_actions:
+                self.pending.append("repeated_action")
+            self.seen_actions.add(tuple(signature))
+        # Kept so recorded runs can be replayed with another schedule
+        self.outcomes.append({"url": url, "actions": signatures, "error": bool(error_message)})
+
+    def should_evaluate(self) -> tuple:
+        """Return whether to evaluate before this planning step, and why"""
+        if self.mode == "every_step":
+            return True, "every_step"
+        if self.evaluated_url is None:
+            # The first judged step sets the baseline the triggers compare against
+            return True, "first_step"
+        if self.mode in ["triggers", "adaptive"] and self.pending:
+            return True, self.pending[0]
+        if self.mode in ["every_k", "adaptive"] and self.steps_since_evaluation >= self.every_k_steps:
+            return True, "every_k"
+        return False, None
+
+    def should_verify_final_answer(self, evaluated: bool) -> bool:
+        """A final answer planned without a fresh reward is judged and replanned once before it is accepted"""
+        return self.mode != "every_step" and not evaluated and "final_answer" in self.triggers
+
+    def record(self, step: int, url: str, evaluated: bool, reason: str = None, step_reward: dict = None,
+               reward_token_count: list = None, latency: float = 0.0) -> None:
+        if self.steps and self.steps[-1]["step"] == step:
+            # A skipped step that is evaluated after all, to verify a final answer
+            self.steps.pop()
+        if evaluated:
+            self.evaluated_url = url
+            self.steps_since_evaluation = 0
+            self.pending = []
+            logger.info(f"Global reward evaluated ({reason})")
+        else:
+            logger.info("Global reward skipped by the reward schedule")
+        self.steps.append({
+            "step": step,
+            "url": url,
+            "evaluated": evaluated,
+            "reason": reason,
+            "status": (step_reward or {}).get("status"),
+            "score": (step_reward or {}).get("score"),
+            "reward_tokens": list(reward_token_count or [0, 0]),
+            "latency": latency
+        })
+
+    def summary(self) -> dict:
+        evaluated = [step for step in self.steps if step["evaluated"]]
+        reasons = {}
+        for step in evaluated:
+            reasons[step["reason"]] = reasons.get(step["reason"], 0) + 1
+        tokens = [sum(step["reward_tokens"][0] for step in evaluated), sum(step["reward_tokens"][1] for step in evaluated)]
+        latency = sum(step["latency"] for step in evaluated)
+        skipped = len(self.steps) - len(evaluated)
+        summary = {
+            "mode": self.mode,
+            "evaluations": len(evaluated),
+            "skipped": skipped,
+            "reasons": reasons,
+            "reward_tokens": tokens,
+            "reward_latency": latency,
+            "steps": self.steps,
+            "outcomes": self.outcomes
+        }
+        if evaluated:
+            # Skipped evaluations would have cost about as much as the ones that ran
+            summary["reward_tokens_saved"] = [tokens[0] / len(evaluated) * skipped, tokens[1] / len(evaluated) * skipped]
+            summary["reward_latency_saved"] = latency / len(evaluated) * skipped
+        return summary
@@ -1,2 +1,3 @@
+from .artifact_writer import *
 from .utils import *
 from .format_converter import *
\ No newline at end of file
@@ -0,0 +1,233 @@
+import asyncio
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+from logs import logger
+
+
+class ArtifactWriter:
+    """
+    Writes screenshots, event logs, token counts and results from one background thread.
+
+    Tasks hand their writes to a bounded queue and go on with the step, so disk latency stays
+    off the event loop. A single worker keeps the writes in submission order, which also keeps
+    the read-modify-write of the shared token count files of concurrent tasks from racing.
+    Appends to the same JSON list that are queued together are merged into one rewrite of the
+    file. When the queue is full, `submit` blocks the caller until the worker catches up, so a
+    slow disk slows the tasks down instead of growing memory without bound. Coroutines use the
+    `*_async` variants, which wait for room in the queue off the event loop so only the task
+    that submitted waits. `flush` waits for every write submitted before it, run_task calls it
+    before it returns.
+    """
+
+    def __init__(self, enabled: bool = True, max_queue: int = 1024, batch_size: int = 64):
+        self.enabled = enabled
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.queue = queue.Queue(max_queue)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {"submitted": 0, "written": 0, "failed": 0, "merged_appends": 0, "blocked": 0,
+                      "blocked_seconds": 0.0, "write_seconds": 0.0}
+
+    def configure(self, config: dict = None) -> None:
+        config = config or {}
+        self.enabled = config.get("enabled", True)
+        self.batch_size = config.get("batch_size", 64)
+        # The worker waits on the queue it started with, it can only be resized before the first write
+        if config.get("max_queue", 1024) != self.max_queue and self.thread is None:
+            self.max_queue = config.get("max_queue", 1024)
+            self.queue = queue.Queue(self.max_queue)
+
+    def _start(self) -> None:
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+                self.thread.start()
+
+    def _put(self, job: tuple) -> None:
+        self._start()
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            started = time.monotonic()
+            self.queue.put(job)
+            self.stats["blocked"] += 1
+            self.stats["blocked_seconds"] += time.monotonic() - started
+
+    async def _put_async(self, job: tuple) -> None:
+        self._start()
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            started = time.monotonic()
+            await asyncio.to_thread(self.queue.put, job)
+            self.stats["blocked"] += 1
+            self.stats["blocked_seconds"] += time.monotonic() - started
+
+    def submit(self, function, *args) -> None:
+        """Run `function(*args)` on the writer thread, the arguments must not change afterwards"""
+        self.stats["submitted"] += 1
+        if not self.enabled:
+            self._call(function, args)
+            return
+        self._put(("call", function, args))
+
+    async def submit_async(self, function, *args) -> None:
+        """`submit` for coroutines, a full queue doesn't block the event loop"""
+        self.stats["submitted"] += 1
+        if not self.enabled:
+            await asyncio.to_thread(self._call, function, args)
+            return
+        await self._put_async(("call", function, args))
+
+    def write_bytes(self, path: str, data: bytes) -> None:
+        self.submit(_write_bytes, path, data)
+
+    def write_json(self, path: str, data, **dump_kwargs) -> None:
+        self.submit(_write_json, path, data, dump_kwargs)
+
+    async def write_bytes_async(self, path: str, data: bytes) -> None:
+        await self.submit_async(_write_bytes, path, data)
+
+    async def write_json_async(self, path: str, data, **dump_kwargs) -> None:
+        await self.submit_async(_write_json, path, data, dump_kwargs)
+
+    def append_json(self, path: str, item) -> None:
+        """Append `item` to the JSON list stored in `path`"""
+        self.stats["submitted"] += 1
+        if not self.enabled:
+            self._call(_append_json, (path, [item]))
+            return
+        self._put(("append", path, item))
+
+    async def append_json_async(self, path: str, item) -> None:
+        self.stats["submitted"] += 1
+        if not self.enabled:
+            await asyncio.to_thread(self._call, _append_json, (path, [item]))
+            return
+        await self._put_async(("append", path, item))
+
+    async def flush(self) -> None:
+        """Wait until every write submitted so far is on disk"""
+        if not self.enabled or self.thread is None:
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._put_async(("barrier", loop, future))
+        await future
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Write what is queued and stop the worker, called when the process exits"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(("stop",))
+            self.thread.join(timeout)
+
+    def metrics(self) -> dict:
+        return {**self.stats, "queued": self.queue.qsize(), "max_queue": self.max_queue}
+
+    def _call(self, function, args) -> None:
+        started = time.monotonic()
+        try:
+            function(*args)
+            self.stats["written"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"Failed to write artifact with {function.__name__}: {e}")
+        self.stats["write_seconds"] += time.monotonic() - started
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not self._process(batch):
+                return
+
+    def _process(self, batch: list) -> bool:
+        appends = {}
+
+        def write_appends():
+            for path, items in appends.items():
+                self._call(_append_json, (path, items))
+                self.stats["written"] += len(items) - 1
+                self.stats["merged_appends"] += len(items) - 1
+            appends.clear()
+
+        for job in batch:
+            if job[0] == "append":
+                appends.setdefault(job[1], []).append(job[2])
+                continue
+            # Anything else may read or write those files, so the appends go first
+            write_appends()
+            if job[0] == "call":
+                self._call(job[1], job[2])
+            elif job[0] == "barrier":
+                loop, future = job[1], job[2]
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(_resolve, future)
+            elif job[0] == "stop":
+                return False
+        write_appends()
+        return True
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _make_parent(path: str) -> None:
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+
+def _write_bytes(path: str, data: bytes) -> None:
+    _make_parent(path)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def _write_json(path: str, data, dump_kwargs: dict) -> None:
+    _make_parent(path)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, **dump_kwargs)
+
+
+def write_json_atomic(path: str, data) -> None:
+    """Write `data` as JSON to `path` through a temporary file, readers in other processes never see it half written"""
+    _make_parent(path)
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False)
+    os.replace(temporary, path)
+
+
+def _append_json(path: str, items: list) -> None:
+    _make_parent(path)
+    existing = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            existing = json.load(file)
+    existing.extend(items)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(existing, file, indent=4, ensure_ascii=False)
+
+
+artifact_writer = ArtifactWriter()
+atexit.register(artifact_writer.close)
+
+
+__all__ = [
+    "ArtifactWriter",
+    "artifact_writer",
+    "write_json_atomic"
+]
@@ -187,7 +187,7 @@ async def format_converter(input_text: str, target_type: str, output_parameters:
             return input_text 
 
 async def planning_response_converter(input_text: str) -> dict:
-    """Convert unstructured planning response text into the required JSON format"""
+    """Convert unstructured planning response text into the required JSON format, None if that fails"""
     
     prompt = """Convert the following planning response into a valid JSON object with this exact structure:
     {
@@ -216,7 +216,7 @@ async def planning_response_converter(input_text: str) -> dict:
     
     try:
         llm = create_llm_instance("gpt-4o")
-        response, _ = await llm.request(messages=[{"role": "user", "content": prompt.format(text=input_text)}])
+        response, _ = await llm.request(messages=[{"role": "user", "content": prompt.replace("{text}", str(input_text))}])
         response = response.strip()
         
         # Extract JSON object if embedded in other text
@@ -226,27 +226,75 @@ async def planning_response_converter(input_text: str) -> dict:
             response = response[start:end]
             
         try:
-            return json.loads(response)
+            result = json.loads(response)
+            return result if isinstance(result, dict) else None
         except json.JSONDecodeError:
-            # Fallback default response
-            return {
-                "thought": "Extracting product information",
-                "action": "get_final_answer",
-                "action_input": {"related_links": []},
-                "element_id": 0,
-                "description": "Converting product information to structured format"
-            }
+            # A made-up action would silently end or derail the task, let the planner retry instead
+            return None
             
     except Exception as e:
         logger.error(f"Planning response conversion error: {str(e)}")
-        # Return default structure on error
-        return {
-            "thought": "Extracting product information",
-            "action": "get_final_answer",
-            "action_input": {"related_links": []},
-            "element_id": 0,
-            "description": "Converting product information to structured format"
-        } 
+        return None
+
+
+URL_PATTERN = re.compile(r'(?:https?://|www\.)[^\s"\'<>]+', re.IGNORECASE)
+
+
+def normalize_url(url: str) -> str:
+    url = url.strip().split("#")[0]
+    if url.lower().startswith("www."):
+        url = "https://" + url
+    return url.rstrip("/")
+
+
+def resolve_links_locally(content: Any, link_index: dict, is_allowed_link) -> tuple:
+    """
+    Rewrite link references in an answer against the link index of the current page.
+
+    Values under keys containing 'link' or 'url' become element ids when they name a link of the
+    page, by id or by href, since process_final_answer turns ids into hrefs. Allowed URLs are kept
+    as they are. Returns the rewritten content and the references that couldn't be resolved.
+    """
+    href_to_id = {normalize_url(link["href"]): link_id for link_id, link in link_index.items()}
+    unresolved = []
+
+    def resolve_reference(value):
+        if isinstance(value, int) or (isinstance(value, str) and value.strip().isdigit()):
+            if int(value) in link_index:
+                return int(value)
+            unresolved.append(value)
+            return value
+        if isinstance(value, str) and URL_PATTERN.fullmatch(value.strip()):
+            if normalize_url(value) in href_to_id:
+                return href_to_id[normalize_url(value)]
+            if not is_allowed_link(value.strip()):
+                unresolved.append(value)
+            return value
+        return resolve(value)
+
+    def check_text(text: str) -> str:
+        for url in URL_PATTERN.findall(text):
+            if normalize_url(url) not in href_to_id and not is_allowed_link(url):
+                unresolved.append(url)
+        return text
+
+    def resolve(value):
+        if isinstance(value, dict):
+            resolved = {}
+            for key, item in value.items():
+                if 'link' in key.lower() or 'url' in key.lower():
+                    resolved[key] = [resolve_reference(i) for i in item] if isinstance(item, list) else resolve_reference(item)
+                else:
+                    resolved[key] = resolve(item)
+            return resolved
+        if isinstance(value, list):
+            return [resolve(item) for item in value]
+        if isinstance(value, str):
+            return check_text(value)
+        return value
+
+    return resolve(content), unresolved
+
 
 async def validate_and_replan_links(
     text_content: Union[str, List, Dict], 
@@ -254,7 +302,8 @@ async def validate_and_replan_links(
     task_name: str, 
     output_parameters: dict = None,
     response_type: str = None,
-    final_url: str = None
+    final_url: str = None,
+    link_index: dict = None
 ) -> Union[str, List, Dict]:
     """
     Validates and replans links in the content, maintaining the original output format.
@@ -266,30 +315,8 @@ async def validate_and_replan_links(
         output_parameters: Parameters defining expected output format
         response_type: Type of response expected
         final_url: Final URL of the page
+        link_index: Links of the current page by element id, from HTMLTree.link_index
     """
-    def contains_link_pattern(content: str) -> bool:
-        link_patterns = [
-            r'https?://',
-            r'www\.',
-            r'\.com',
-            r'\.org',
-            r'\.net',
-            r'/[a-zA-Z0-9\-_/]+',
-            r'href=',
-            r'<a',
-            r'link to'
-        ]
-        return any(re.search(pattern, content, re.IGNORECASE) for pattern in link_patterns)
-
-    def check_content(content) -> bool:
-        if isinstance(content, str):
-            return contains_link_pattern(content)
-        elif isinstance(content, list):
-            return any(check_content(item) for item in content)
-        elif isinstance(content, dict):
-            return any(check_content(value) for value in content.values())
-        return False
-
     def is_allowed_link(link: str) -> bool:
         """Check if the link is from output_parameters or matches final_url domain"""
         if not link:
@@ -303,16 +330,30 @@ async def validate_and_replan_links(
         # Check if link matches final_url domain
         if final_url:
             try:
-                link_domain = urlparse(link).netloc
-                final_domain = urlparse(final_url).netloc
+                link_domain = urlparse(normalize_url(link)).netloc.removeprefix("www.")
+                final_domain = urlparse(final_url).netloc.removeprefix("www.")
                 return link_domain == final_domain
             except:
                 pass
         return False
 
-    # If no links found, return original content
-    if not check_content(text_content):
-        return text_content
+    # A JSON answer is resolved structurally and handed back in the same form
+    content, as_json = text_content, False
+    if isinstance(text_content, str):
+        stripped = text_content.strip()
+        if stripped.startswith('```'):
+            stripped = '\n'.join(stripped.split('\n')[1:-1])
+        try:
+            parsed = json.loads(stripped)
+            if isinstance(parsed, (dict, list)):
+                content, as_json = parsed, True
+        except (json.JSONDecodeError, ValueError):
+            pass
+
+    resolved, unresolved = resolve_links_locally(content, link_index or {}, is_allowed_link)
+    if not unresolved:
+        return json.dumps(resolved, ensure_ascii=False) if as_json else resolved
+    logger.info(f"Unresolved link references {unresolved[:5]}, asking the LLM to replan them")
 
     system_prompt = """You are a web automation assistant. When processing links:
     1. For links that you obtain from the task name or final page URL domain:
@@ -343,13 +384,16 @@ async def validate_and_replan_links(
 
     try:
         llm = create_llm_instance("gpt-4o")
-        response, _ = await llm.request(
+        response, error_message = await llm.request(
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
             temperature=0.3
         )
+        if error_message:
+            logger.error(f"Error in validate_and_replan_links: {error_message}")
+            return json.dumps(resolved, ensure_ascii=False) if as_json else resolved
         
         # Parse and validate response based on type
         if response_type == "list":
@@ -1,9 +1,5 @@
 import json5
 import base64
-# used for save_screenshot
-import os
-from PIL import Image
-from io import BytesIO
 from datetime import datetime
 # used for download_data and upload_result
 import requests
@@ -54,9 +50,8 @@ def read_json_file(file_path):
         return f"File not found: {file_path}"
 
 
-def save_screenshot(mode: str, record_time: str, task_name: str, step_number: int, description: str,
-                    screenshot_base64: str, task_name_id: str = None):
-
+def screenshot_path(mode: str, record_time: str, task_name: str, step_number: int, description: str,
+                    task_name_id: str = None) -> str:
     timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
     invalid_chars = '<>:"/\\|?*'
     for char in invalid_chars:
@@ -66,15 +61,7 @@ def save_screenshot(mode: str, record_time: str, task_name: str, step_number: in
         task_folder = f'results/screenshots/screenshots_{mode}_{record_time}/{task_name}'
     else:
         task_folder = f'results/screenshots/screenshots_{mode}_{record_time}/{task_name_id}_{task_name}'
-    if not os.path.exists(task_folder):
-        os.makedirs(task_folder)
-
-    image_data = base64.b64decode(screenshot_base64)
-    image = Image.open(BytesIO(image_data))
-
-    screenshot_filename = f'{task_folder}/Step{step_number}_{timestamp}_{description}.png'
-
-    image.save(screenshot_filename)
+    return f'{task_folder}/Step{step_number}_{timestamp}_{description}.png'
 
 
 def print_limited_json(obj, limit=500, indent=0):
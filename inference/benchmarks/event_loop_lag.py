@@ -0,0 +1,93 @@
+"""
+Measure event-loop lag while several tasks build DOM observations at the same time.
+
+A ticker coroutine asks to wake up every few milliseconds and records how late it actually
+runs, which is what Playwright callbacks and LLM responses of other tasks experience while
+`get_obs` is parsing. The run with `--workers 0` parses in the event loop like before, the other
+run uses the process pool of `parse_observation`.
+
+Usage, from the inference directory:
+    python benchmarks/event_loop_lag.py --tasks 4 --items 80 --workers 2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.Environment.html_env.build_tree import HTMLTree
+from agent.Environment.html_env.observation_pool import parse_observation, shutdown_observation_pool
+from load_test import synthetic_page
+
+
+async def ticker(lags: list, stop: asyncio.Event, interval: float = 0.005) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(tasks: int, html: str, steps: int, workers: int) -> dict:
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+
+    async def agent_task():
+        tree = HTMLTree()
+        for _ in range(steps):
+            await parse_observation(tree, html, workers=workers, inline_max_chars=0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(agent_task() for _ in range(tasks)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    lags.sort()
+    return {
+        "elapsed": elapsed,
+        "p50": statistics.median(lags) * 1000,
+        "p99": lags[int(len(lags) * 0.99) - 1] * 1000 if len(lags) > 1 else lags[0] * 1000,
+        "max": lags[-1] * 1000
+    }
+
+
+async def check_equivalence(html: str, workers: int) -> None:
+    inline, pooled = HTMLTree(), HTMLTree()
+    inline_dom = await parse_observation(inline, html, workers=0)
+    pooled_dom = await parse_observation(pooled, html, workers=workers, inline_max_chars=0)
+    assert inline_dom == pooled_dom, "pooled observation differs from the inline one"
+    for num, tag_idx in inline.nodeDict.items():
+        assert pooled.nodeDict[num] == tag_idx
+        assert pooled.get_selector_and_xpath(tag_idx) == inline.get_selector_and_xpath(tag_idx)
+        assert pooled.get_tag_name(pooled.elementNodes[tag_idx]) == inline.get_tag_name(inline.elementNodes[tag_idx])
+        assert pooled.get_element_value(tag_idx) == inline.get_element_value(tag_idx)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=4, help="Concurrent agent tasks")
+    parser.add_argument("--items", type=int, default=80, help="List items on the synthetic page")
+    parser.add_argument("--steps", type=int, default=2, help="Observations built per task")
+    parser.add_argument("--workers", type=int, default=2, help="Processes of the DOM parsing pool")
+    args = parser.parse_args()
+
+    html = synthetic_page(args.items)
+
+    async def bench():
+        await check_equivalence(html, args.workers)
+        print(f"page of {len(html)} characters, {args.tasks} tasks x {args.steps} observations")
+        print(f"{'mode':>8} {'seconds':>8} {'lag p50':>9} {'lag p99':>9} {'lag max':>9}")
+        for label, workers in (("inline", 0), ("pool", args.workers)):
+            stats = await run(args.tasks, html, args.steps, workers)
+            print(f"{label:>8} {stats['elapsed']:>8.2f} {stats['p50']:>7.1f}ms {stats['p99']:>7.1f}ms {stats['max']:>7.1f}ms")
+
+    try:
+        asyncio.run(bench())
+    finally:
+        shutdown_observation_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Measure how /jobs throughput scales with the number of server processes.
+
+Every process runs a SharedJobManager on the same SQLite store, like the uvicorn/gunicorn
+workers of run.py do, with a handler that spends its time on the CPU-bound part of an agent
+step: parsing the page into an HTMLTree and building the DOM observation. No browser or LLM is
+involved, so the numbers only show how much the event loop is the bottleneck.
+
+Usage, from the inference directory:
+    python benchmarks/load_test.py --jobs 32 --max-workers 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.Environment.html_env.build_tree import HTMLTree
+from execute.jobs import SharedJobManager, FINISHED_STATUSES
+
+
+def synthetic_page(items: int) -> str:
+    rows = "".join(
+        f'<li><a href="/item/{i}">Item {i}</a><input type="text" placeholder="qty {i}">'
+        f'<button onclick="buy({i})">Buy</button><p>Description of item {i}</p></li>'
+        for i in range(items)
+    )
+    return f"<html><body><nav><a href='/'>Home</a></nav><ul>{rows}</ul></body></html>"
+
+
+async def parse_handler(payload, step_callback):
+    html = synthetic_page(payload["items"])
+    for step in range(payload["steps"]):
+        tree = HTMLTree()
+        tree.fetch_html_content(html)
+        tree.build_dom_tree()
+        await step_callback({"step": step})
+        await asyncio.sleep(0)
+    return {"items": payload["items"]}
+
+
+def serve(db_path: str, concurrency: int, stop_event) -> None:
+    async def main():
+        manager = SharedJobManager(parse_handler, db_path=db_path, concurrency=concurrency, poll_interval=0.05)
+        await manager.start()
+        while not stop_event.is_set():
+            await asyncio.sleep(0.1)
+        await manager.stop()
+
+    asyncio.run(main())
+
+
+def run_round(processes: int, jobs: int, items: int, steps: int, concurrency: int) -> float:
+    db_path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+    submitter = SharedJobManager(parse_handler, db_path=db_path)
+    job_ids = [uuid.uuid4().hex for _ in range(jobs)]
+    for job_id in job_ids:
+        submitter.submit(job_id, {"items": items, "steps": steps})
+
+    stop_event = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=serve, args=(db_path, concurrency, stop_event))
+               for _ in range(processes)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    while True:
+        rows = submitter._execute("SELECT status FROM jobs")
+        if all(row["status"] in FINISHED_STATUSES for row in rows):
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+    for worker in workers:
+        worker.join()
+    failed = [row for row in submitter._execute("SELECT job_id FROM jobs WHERE status != 'succeeded'")]
+    if failed:
+        print(f"  {len(failed)} jobs did not succeed")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--items", type=int, default=80, help="List items on the synthetic page")
+    parser.add_argument("--steps", type=int, default=3, help="Observations built per job")
+    parser.add_argument("--concurrency", type=int, default=2, help="job_workers of each process")
+    parser.add_argument("--max-workers", type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{'processes':>9} {'seconds':>8} {'jobs/s':>8} {'speedup':>8}")
+    for processes in range(1, args.max_workers + 1):
+        elapsed = run_round(processes, args.jobs, args.items, args.steps, args.concurrency)
+        baseline = baseline or elapsed
+        print(f"{processes:>9} {elapsed:>8.2f} {args.jobs / elapsed:>8.2f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
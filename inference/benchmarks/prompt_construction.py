@@ -0,0 +1,89 @@
+"""
+Measure how long building the planning prompt of one step takes.
+
+The "compile" run renders the prompt like before, compiling the Jinja templates on every step,
+the "registry" run uses PlanningPromptConstructor with the precompiled templates and the cached
+task prefix. Both build the same messages for a task whose trace grows by one step each time.
+
+Usage, from the inference directory:
+    python benchmarks/prompt_construction.py --steps 20 --rounds 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import Template
+
+from agent.Environment.html_env.build_tree import HTMLTree
+from agent.Memory.short_memory.history import HistoryMemory
+from agent.LLM.prompt_cache import flatten_cache_hints
+from agent.Prompt import BasePrompts, PlanningPromptConstructor
+from load_test import synthetic_page
+
+
+def compile_construct(user_request, previous_trace, observation, feedback, status_description,
+                      input_parameters, output_parameters, response_type, max_batch_actions):
+    prompt_system = BasePrompts.planning_prompt_system
+    prompt_user = Template(BasePrompts.planning_prompt_user).render(
+        user_request=user_request, input_parameters=input_parameters,
+        output_parameters=output_parameters, response_type=response_type)
+    if max_batch_actions > 1:
+        prompt_system += Template(BasePrompts.planning_prompt_batch_actions).render(max_batch_actions=max_batch_actions)
+    if len(previous_trace) > 0:
+        prompt_user += HistoryMemory(
+            previous_trace=previous_trace, reflection=status_description).construct_previous_trace_prompt()
+        if status_description != "":
+            prompt_user += f"Task status is judged as:\n{status_description}\n"
+        if feedback != "":
+            prompt_user += f"Below is the error message from the last action execution:\n {feedback}\n"
+        prompt_user += f"\nHere is the accessibility tree on current page:\n{observation}"
+    return [{"role": "system", "content": prompt_system}, {"role": "user", "content": prompt_user}]
+
+
+def registry_construct(*args):
+    return PlanningPromptConstructor().construct(*args)
+
+
+def run(construct, steps: int, rounds: int, observation: str) -> list:
+    timings = []
+    for round_index in range(rounds):
+        previous_trace = []
+        for step in range(steps):
+            args = (f"Find the cheapest item number {round_index % 8}", previous_trace, observation, "",
+                    "doing", {"budget": 50}, {"item": "str", "link": "str"}, "dict", 5)
+            start = time.perf_counter()
+            construct(*args)
+            timings.append(time.perf_counter() - start)
+            previous_trace = previous_trace + [
+                {"thought": f"thought {step}", "action": f"click [{step}]", "reflection": "ok"}]
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--steps", type=int, default=20, help="Steps per task")
+    parser.add_argument("--rounds", type=int, default=200, help="Tasks to build prompts for")
+    parser.add_argument("--items", type=int, default=40, help="List items on the synthetic page")
+    args = parser.parse_args()
+
+    tree = HTMLTree()
+    tree.fetch_html_content(synthetic_page(args.items))
+    observation = tree.build_dom_tree()
+    sample = ("task", [{"thought": "t", "action": "a", "reflection": "r"}], observation, "error", "doing",
+              {"p": 1}, {"o": "str"}, "dict", 5)
+    assert compile_construct(*sample) == flatten_cache_hints(registry_construct(*sample)), "registry prompt differs from the compiled one"
+
+    print(f"{args.rounds} tasks x {args.steps} steps, observation of {len(observation)} characters")
+    print(f"{'mode':>9} {'mean':>9} {'p99':>9}")
+    for label, construct in (("compile", compile_construct), ("registry", registry_construct)):
+        timings = sorted(run(construct, args.steps, args.rounds, observation))
+        mean = sum(timings) / len(timings) * 1e6
+        p99 = timings[int(len(timings) * 0.99) - 1] * 1e6
+        print(f"{label:>9} {mean:>7.1f}us {p99:>7.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Replay recorded runs under different global reward schedules.
+
+run_task saves the reward decisions and step outcomes of every task under
+step_tokens["reward_schedule"] in token_results/. Runs recorded with `mode = "every_step"` have
+a reward for every step, so any other schedule can be replayed on them. The replay reports the
+reward tokens and latency each schedule spends, and as the success-rate side of the trade-off,
+how many judgements that mattered it would have skipped: a low score (the trace is not helping
+or loops) or a "finished"/"loop" status. The tasks with such a missed judgement are the ones
+whose outcome could change, a live rerun is needed to know whether it does.
+
+Without --results, synthetic tasks are generated to exercise the schedules.
+
+Usage, from the inference directory:
+    python benchmarks/reward_schedule_replay.py --results token_results/token_counts_*.json
+    python benchmarks/reward_schedule_replay.py --synthetic 200
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.Reward.scheduler import RewardScheduler
+
+
+def load_recorded_tasks(paths: list) -> list:
+    tasks = {}
+    for path in paths:
+        with open(path) as file:
+            data = json.load(file)
+        for call in data.get("calls", []):
+            schedule = call.get("step_tokens", {}).get("reward_schedule")
+            if schedule and schedule.get("mode") == "every_step":
+                # Each save holds the whole task so far, the last one is complete
+                tasks[(path, call["task_name"])] = schedule
+    return list(tasks.values())
+
+
+def synthetic_tasks(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    tasks = []
+    for _ in range(count):
+        steps, outcomes, page = [], [], 0
+        length = rng.randint(3, 20)
+        for step in range(1, length + 1):
+            if step > 1:
+                score = rng.choice([1, 3, 7, 7, 9, 9, 10] if rng.random() < 0.3 else [7, 9])
+                steps.append({"step": step, "evaluated": True, "score": str(score),
+                              "status": "finished" if step == length else "doing",
+                              "reward_tokens": [rng.randint(2500, 4000), rng.randint(80, 200)],
+                              "latency": rng.uniform(1.0, 4.0)})
+            if step == length:
+                break
+            if rng.random() < 0.35:
+                page += 1
+            action = ["click", str(rng.randint(1, 40 if rng.random() < 0.8 else 3)), ""]
+            outcomes.append({"url": f"https://shop.example/page/{page}", "actions": [action],
+                             "error": rng.random() < 0.1})
+        tasks.append({"steps": steps, "outcomes": outcomes})
+    return tasks
+
+
+def matters(step: dict, min_score: int = 3) -> bool:
+    try:
+        low_score = int(step.get("score")) <= min_score
+    except (TypeError, ValueError):
+        low_score = False
+    return low_score or str(step.get("status", "")).lower() in ["finished", "loop"]
+
+
+def replay(task: dict, mode: str, every_k_steps: int) -> dict:
+    scheduler = RewardScheduler(mode=mode, every_k_steps=every_k_steps)
+    recorded = {step["step"]: step for step in task["steps"]}
+    result = {"evaluations": 0, "tokens": 0, "latency": 0.0, "missed": 0}
+    for step_number in range(1, len(task["outcomes"]) + 2):
+        step = recorded.get(step_number)
+        url = task["outcomes"][step_number - 2]["url"] if step_number > 1 else ""
+        if step is not None:
+            evaluated, reason = scheduler.should_evaluate()
+            # The last recorded step planned the final answer, which a skipped reward re-judges
+            if not evaluated and step_number == len(task["outcomes"]) + 1:
+                evaluated, reason = scheduler.should_verify_final_answer(False), "final_answer"
+            scheduler.record(step_number, url, evaluated, reason)
+            if evaluated:
+                result["evaluations"] += 1
+                result["tokens"] += sum(step["reward_tokens"])
+                result["latency"] += step["latency"]
+            elif matters(step):
+                result["missed"] += 1
+        if step_number <= len(task["outcomes"]):
+            outcome = task["outcomes"][step_number - 1]
+            scheduler.observe(outcome["url"], [{"action_type": action[0], "id": action[1], "value": action[2]}
+                                               for action in outcome["actions"]], "error" if outcome["error"] else "")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--results", nargs="*", default=[], help="token_results files recorded with mode every_step")
+    parser.add_argument("--synthetic", type=int, default=200, help="Synthetic tasks when no results are given")
+    parser.add_argument("--every-k-steps", type=int, default=3)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    tasks = load_recorded_tasks(args.results) if args.results else synthetic_tasks(args.synthetic)
+    if not tasks:
+        sys.exit("No task recorded with reward_schedule mode every_step in the given files")
+    print(f"{len(tasks)} tasks, {sum(len(task['steps']) for task in tasks)} judged steps")
+    print(f"{'mode':>11} {'evals':>7} {'tokens':>10} {'saved':>7} {'latency':>9} {'saved':>7} {'missed':>7} {'tasks hit':>10}")
+    baseline = None
+    for mode in ["every_step", "every_k", "triggers", "adaptive"]:
+        results = [replay(task, mode, args.every_k_steps) for task in tasks]
+        totals = {key: sum(result[key] for result in results) for key in ["evaluations", "tokens", "latency", "missed"]}
+        affected = sum(1 for result in results if result["missed"])
+        baseline = baseline or totals
+        token_saving = 1 - totals["tokens"] / baseline["tokens"] if baseline["tokens"] else 0.0
+        latency_saving = 1 - totals["latency"] / baseline["latency"] if baseline["latency"] else 0.0
+        print(f"{mode:>11} {totals['evaluations']:>7} {totals['tokens']:>10} {token_saving:>6.0%} "
+              f"{totals['latency']:>8.0f}s {latency_saving:>6.0%} {totals['missed']:>7} {affected:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Measure the latency and payload of the screenshot sent to the models.
+
+The "legacy" run is the previous capture: a full PNG screenshot, decoded with PIL, resized to
+the model width, encoded as PNG again and decoded once more by is_valid_base64. The other runs
+go through AsyncHTMLEnvironment.screenshot with the given capture and format, "cdp" letting
+Chromium scale and compress the viewport itself. Payload is the base64 string the models get.
+
+Needs the Playwright Chromium browser (`playwright install chromium`).
+
+Usage, from the inference directory:
+    python benchmarks/screenshot_capture.py --rounds 30 --items 200
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from playwright.async_api import async_playwright
+
+import execute.execution  # Imported first, agent.Environment and agent.Prompt import each other
+from agent.Environment.html_env.async_env import AsyncHTMLEnvironment
+from agent.Utils.utils import is_valid_base64
+from load_test import synthetic_page
+
+
+async def legacy_capture(page) -> str:
+    screenshot = Image.open(BytesIO(await page.screenshot())).convert("RGB")
+    encoded = AsyncHTMLEnvironment.encode_and_resize(screenshot)
+    is_valid_base64(encoded)
+    return encoded
+
+
+async def env_capture(env: AsyncHTMLEnvironment) -> str:
+    frame = await env.screenshot()
+    return await frame.encoded(env.screenshot_width)
+
+
+async def measure(capture, rounds: int) -> tuple:
+    timings, payload = [], 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        encoded = await capture()
+        timings.append(time.perf_counter() - start)
+        payload = len(encoded)
+    timings.sort()
+    return sum(timings) / len(timings), timings[int(len(timings) * 0.95) - 1], payload
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=30, help="Screenshots per run")
+    parser.add_argument("--items", type=int, default=200, help="List items on the synthetic page")
+    parser.add_argument("--qualities", type=int, nargs="*", default=[60, 80])
+    args = parser.parse_args()
+
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(headless=True)
+        context = await browser.new_context(viewport={"width": 1280, "height": 720})
+        page = await context.new_page()
+        await page.set_content(synthetic_page(args.items))
+
+        runs = [("legacy", None, lambda: legacy_capture(page))]
+        for capture in ["playwright", "cdp"]:
+            settings = [("png", 80)] + [("jpeg", quality) for quality in args.qualities]
+            for image_format, quality in settings:
+                env = AsyncHTMLEnvironment(screenshot_capture=capture, screenshot_format=image_format,
+                                           screenshot_quality=quality)
+                env.page = page
+                label = f"{capture} {image_format}" + (f" q{quality}" if image_format == "jpeg" else "")
+                runs.append((label, env, lambda env=env: env_capture(env)))
+
+        print(f"{args.rounds} screenshots of a 1280x720 viewport sent at 1080 wide")
+        print(f"{'capture':>22} {'mean':>9} {'p95':>9} {'payload':>10}")
+        for label, env, capture in runs:
+            await capture()  # Warm up, the CDP session is opened on the first capture
+            mean, p95, payload = await measure(capture, args.rounds)
+            print(f"{label:>22} {mean * 1000:>7.1f}ms {p95 * 1000:>7.1f}ms {payload / 1024:>8.1f}KB")
+        # The CDP image has the size of the resized legacy one
+        image = Image.open(BytesIO(base64.b64decode(await env_capture(runs[-1][1]))))
+        print(f"cdp image size: {image.size}")
+        await browser.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Compare the steps and tokens tasks take with and without reused storage states.
+
+run_task saves what the StorageStateStore did for every task under step_tokens["storage_state"]
+in token_results/: the sites it visited, which of them it was seeded with a state for, and
+whether it finished. Run the same tasks once with `[storage_state] enabled = false` and once
+with it enabled (a first pass with it enabled saves the states the next one reuses), then pass
+the token files of both runs. Tasks are grouped by whether they reused a saved state, overall
+and per visited site.
+
+Usage, from the inference directory:
+    python benchmarks/storage_state_reuse.py --results token_results/token_counts_*.json
+"""
+import argparse
+import json
+import sys
+
+
+def load_tasks(paths: list) -> list:
+    tasks = []
+    for path in paths:
+        with open(path) as file:
+            data = json.load(file)
+        for call in data.get("calls", []):
+            step_tokens = call.get("step_tokens", {})
+            store = step_tokens.get("storage_state")
+            # Cancelled tasks never record how they ended
+            if not store or store.get("finished") is None:
+                continue
+            tasks.append({
+                "task_name": call["task_name"],
+                "sites": store.get("visited_sites", []),
+                "reused": bool(store.get("reused_sites")),
+                "finished": store["finished"],
+                "steps": len(step_tokens.get("steps_tokens_record", [])),
+                "tokens": step_tokens.get("steps_token_counts", 0)
+            })
+    return tasks
+
+
+def aggregate(tasks: list) -> dict:
+    if not tasks:
+        return None
+    return {
+        "tasks": len(tasks),
+        "steps": sum(task["steps"] for task in tasks) / len(tasks),
+        "tokens": sum(task["tokens"] for task in tasks) / len(tasks),
+        "finished": sum(task["finished"] for task in tasks) / len(tasks)
+    }
+
+
+def print_row(label: str, reused: dict, fresh: dict):
+    def cells(stats):
+        if stats is None:
+            return f"{'-':>6} {'-':>7} {'-':>9} {'-':>9}"
+        return f"{stats['tasks']:>6} {stats['steps']:>7.1f} {stats['tokens']:>9.0f} {stats['finished']:>8.0%}"
+    saving = ""
+    if reused and fresh and fresh["steps"]:
+        saving = f"{1 - reused['steps'] / fresh['steps']:>8.0%}"
+    print(f"{label:>24} {cells(fresh)}   {cells(reused)} {saving}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--results", nargs="+", required=True, help="token_results files of runs with and without reuse")
+    parser.add_argument("--min-tasks", type=int, default=2, help="Only list sites with this many tasks in each group")
+    args = parser.parse_args()
+
+    tasks = load_tasks(args.results)
+    if not tasks:
+        sys.exit("No task with a storage_state record in the given files")
+    header = f"{'tasks':>6} {'steps':>7} {'tokens':>9} {'finished':>9}"
+    print(f"{'':>24} {'without reuse':^34}   {'with reuse':^34}")
+    print(f"{'site':>24} {header}   {header} {'saved':>8}")
+    print_row("all", aggregate([task for task in tasks if task["reused"]]),
+              aggregate([task for task in tasks if not task["reused"]]))
+    for site in sorted({site for task in tasks for site in task["sites"]}):
+        on_site = [task for task in tasks if site in task["sites"]]
+        reused = [task for task in on_site if task["reused"]]
+        fresh = [task for task in on_site if not task["reused"]]
+        if len(reused) >= args.min_tasks and len(fresh) >= args.min_tasks:
+            print_row(site, aggregate(reused), aggregate(fresh))
+
+
+if __name__ == "__main__":
+    main()
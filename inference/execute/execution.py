@@ -4,15 +4,27 @@ from agent.Environment.html_env.build_tree import HTMLTree
 import re
 import toml
 import json
+import asyncio
+import time
 import traceback
 import os
 from agent.Environment import ActionExecutionError, create_action
+from agent.Environment.browser_env import StorageStateStore
+from agent.Environment.html_env.actions import ActionTypes
 from agent.Plan import Planning
-from agent.Utils.utils import save_screenshot, is_valid_base64 
+from agent.Plan.cascade import CascadePolicy
+from agent.Memory.short_memory.history import TraceMemory
+from agent.Memory.long_memory.workflow_cache import WorkflowCache
+from agent.Utils.utils import screenshot_path
+from agent.Utils.artifact_writer import artifact_writer
 from agent.Reward.global_reward import GlobalReward
+from agent.Reward.scheduler import RewardScheduler
 from agent.LLM import save_token_count_to_file, create_llm_instance
+from agent.LLM.governor import llm_governor, current_task_id, backoff_delay
+from agent.LLM.prompt_cache import current_usage
 from logs import logger
 from agent.Utils.format_converter import validate_and_replan_links
+from execute.intervention import console_decision
 
 
 async def adjust_max_action_step(conditions, current_info, encountered_errors, increase_step):
@@ -110,6 +122,86 @@ def parse_current_trace(response: dict, env: AsyncHTMLEnvironment, step_reward:
     return execute_action, current_trace, selector, element_value, text_content
 
 
+def init_step_tokens() -> dict:
+    return {
+        "steps_tokens_record": [],
+        "steps_planning_input_token_counts": 0,
+        "steps_planning_output_token_counts": 0,
+        "steps_reward_input_token_counts": 0,
+        "steps_reward_output_token_counts": 0,
+        "steps_small_model_input_token_counts": 0,
+        "steps_small_model_output_token_counts": 0,
+        "steps_input_token_counts": 0,
+        "steps_output_token_counts": 0,
+        "steps_token_counts": 0,
+        "prompt_cache": {}
+    }
+
+
+def record_step_tokens(step_tokens: dict, planning_input_token_count: int, planning_output_token_count: int,
+                       reward_token_count: list, small_model_token_count: list = None) -> dict:
+    """Append the token usage of one step to step_tokens and update the running totals"""
+    # Planning tokens of the cascade's small model, priced at its own rate
+    small_model_token_count = small_model_token_count or [0, 0]
+    planning_token_count_number = planning_input_token_count + planning_output_token_count
+    reward_token_count_number = reward_token_count[0] + reward_token_count[1]
+    small_model_token_count_number = small_model_token_count[0] + small_model_token_count[1]
+    step_input_token_count = planning_input_token_count + reward_token_count[0] + small_model_token_count[0]
+    step_output_token_count = planning_output_token_count + reward_token_count[1] + small_model_token_count[1]
+    step_token_count = planning_token_count_number + reward_token_count_number + small_model_token_count_number
+    single_step_tokens = {
+        "planning_input_token_count": planning_input_token_count,
+        "planning_output_token_count": planning_output_token_count,
+        "planning_token_count": planning_token_count_number,
+        "reward_input_token_count": reward_token_count[0],
+        "reward_output_token_count": reward_token_count[1],
+        "reward_token_count": reward_token_count_number,
+        "small_model_input_token_count": small_model_token_count[0],
+        "small_model_output_token_count": small_model_token_count[1],
+        "small_model_token_count": small_model_token_count_number,
+        "input_token_count": step_input_token_count,
+        "output_token_count": step_output_token_count,
+        "token_count": step_token_count
+    }
+
+    step_tokens["steps_tokens_record"].append(single_step_tokens)
+    step_tokens["steps_planning_input_token_counts"] += planning_input_token_count
+    step_tokens["steps_planning_output_token_counts"] += planning_output_token_count
+    step_tokens["steps_reward_input_token_counts"] += reward_token_count[0]
+    step_tokens["steps_reward_output_token_counts"] += reward_token_count[1]
+    step_tokens["steps_small_model_input_token_counts"] += small_model_token_count[0]
+    step_tokens["steps_small_model_output_token_counts"] += small_model_token_count[1]
+    step_tokens["steps_input_token_counts"] += step_input_token_count
+    step_tokens["steps_output_token_counts"] += step_output_token_count
+    step_tokens["steps_token_counts"] += step_token_count
+    return single_step_tokens
+
+
+def collect_task_stats(step_tokens: dict, cascade, reward_scheduler, storage_store, workflow_cache, env,
+                       config: dict) -> None:
+    """Store what each per-task component did next to the token counts, however the task ended"""
+    if cascade is not None:
+        step_tokens["cascade"] = cascade.summary(config["token_pricing"])
+    step_tokens["reward_schedule"] = reward_scheduler.summary()
+    step_tokens["storage_state"] = storage_store.summary()
+    step_tokens["http_cache"] = env.http_cache_stats
+    step_tokens["search_urls"] = env.search_stats
+    step_tokens["grounding"] = env.grounding_stats
+    step_tokens["workflow_cache"] = workflow_cache.summary()
+
+
+def build_step_event(step: int, out_put: dict, url: str, error_message: str, step_token_counts: dict) -> dict:
+    """Summarize one agent step (action, URL and token usage) for progress streaming"""
+    return {
+        "step": step,
+        "action_type": out_put.get("action_type") if out_put else None,
+        "action": out_put["description"].get("action") if out_put else None,
+        "url": url,
+        "error_message": error_message,
+        "token_usage": step_token_counts
+    }
+
+
 def read_config(toml_path=None):
     """
     Reads a TOML configuration file from the given path or the default path
@@ -149,8 +241,17 @@ async def run_task(
         interaction_mode,
         record_time=None,
         output_parameters=None,
-        response_type=None
+        response_type=None,
+        intervention_channel=None,
+        step_callback=None
 ):
+    llm_governor.configure(config.get("llm_governor"))
+    artifact_writer.configure(config.get("artifacts"))
+    current_task_id.set(task_uuid)
+    storage_store = StorageStateStore.from_config(config)
+    env.storage_state = await storage_store.load()
+    workflow_cache = WorkflowCache.from_config(config)
+    await workflow_cache.load(task_name, config.get("input_parameters"))
     await env.reset("about:blank")
 
     response_error_count = 0
@@ -162,6 +263,8 @@ async def run_task(
     observation_VforD = ""
     error_description = ""
     previous_trace = []
+    visited_urls = []
+    trace_memory = TraceMemory.from_config(config)
 
     # Related to response
     out_put = None
@@ -196,43 +299,41 @@ async def run_task(
     evaluate_steps = []  
 
     # Store the token counts of each step
-    steps_token_counts = 0
-    step_tokens = {"steps_tokens_record": [], "steps_token_counts": steps_token_counts}
-    steps_planning_input_token_counts = 0
-    steps_reward_input_token_counts = 0
-    steps_planning_output_token_counts = 0
-    steps_reward_output_token_counts = 0
-    steps_input_token_counts = 0
-    steps_output_token_counts = 0
+    step_tokens = init_step_tokens()
+    # Prompt and cached prompt tokens reported by the providers, per model
+    current_usage.set(step_tokens["prompt_cache"])
     token_counts_filename = f"token_results/token_counts_{record_time}_{planning_text_model}_{global_reward_text_model}.json"
     final_answer = None
-    while num_steps < max_steps + additional_steps:
-        error_message = ""
-        total_step_score = 0
-        step_reward = {}
-        status_description = ""
-        planning_input_token_count = 0
-        planning_output_token_count = 0
-        reward_token_count = [0, 0]
-
-        logger.info(
-            "**🤖 The agent is in the process of starting planning 🤖**")
-
-        if global_reward_mode != 'no_global_reward' and len(previous_trace) > 0:
-            step_reward, status_description, reward_token_count = await GlobalReward.evaluate(
-                config=config,
-                model_name=global_reward_text_model,
-                user_request=task_name,
-                previous_trace=previous_trace,
-                observation=observation,
-                current_info=current_info,
-                task_name_id=task_uuid,
-                global_reward_mode=global_reward_mode,
-                ground_truth_mode=ground_truth_mode,
-                ground_truth_data=ground_truth_data,
-            )
-
-        for _ in range(3):
+    planning_input_token_count, planning_output_token_count, reward_token_count = 0, 0, [0, 0]
+    small_model_token_count = [0, 0]
+    step_tokens_recorded = True
+    cascade = CascadePolicy.from_config(config, planning_text_model)
+    reward_scheduler = RewardScheduler.from_config(config)
+
+    async def evaluate_reward(reason: str):
+        started = time.monotonic()
+        reward = await GlobalReward.evaluate(
+            config=config,
+            model_name=global_reward_text_model,
+            user_request=task_name,
+            previous_trace=previous_trace,
+            observation=observation,
+            current_info=current_info,
+            task_name_id=task_uuid,
+            global_reward_mode=global_reward_mode,
+            ground_truth_mode=ground_truth_mode,
+            ground_truth_data=ground_truth_data,
+        )
+        reward_scheduler.record(num_steps + 1, env.page.url if env.page else "", True, reason, reward[0], reward[2],
+                                time.monotonic() - started)
+        return reward
+
+    async def plan_with_retries():
+        nonlocal response_total_count, response_error_count
+        out_put = None
+        for attempt in range(3):
+            if attempt > 0:
+                await asyncio.sleep(backoff_delay(attempt - 1))
             response_total_count += 1
             try:
                 out_put = await Planning.plan(
@@ -244,7 +345,12 @@ async def run_task(
                     feedback=error_description,
                     mode=mode,
                     observation_VforD=observation_VforD,
-                    status_description=status_description
+                    status_description=status_description,
+                    cascade=cascade,
+                    step_reward=step_reward,
+                    html_tree=env.tree,
+                    page_url=env.page.url if env.page else "",
+                    trace_memory=trace_memory
                 )
 
                 if out_put is not None:
@@ -254,194 +360,244 @@ async def run_task(
                 response_error_count += 1
                 traceback.print_exc()
                 continue
+        return out_put
 
-        if out_put:
-            planning_input_token_count += out_put.get("planning_token_count", [0, 0])[0]
-            planning_output_token_count += out_put.get("planning_token_count", [0, 0])[1]
-            each_step_dict = {}
-            each_step_dict["step_index"] = step_index
-            each_step_dict["dict_result"] = out_put
-            execute_action, current_trace, path, element_value, text_content = parse_current_trace(
-                out_put, env, step_reward)
-
-            selector, xpath = (
-                path[0], path[1]) if path is not None else (None, None)
-
-            each_step_dict["current_trace"] = current_trace
-            each_step_dict["selector"] = selector
-            each_step_dict["execute_action"] = execute_action
-            each_step_dict["element_value"] = element_value
-            each_step_dict["text_content"] = text_content
-
-            logger.info(f"-- Planning output: {out_put}")
-            logger.info(f"-- Current trace: {current_trace}")
-            logger.info(f"-- Action: {execute_action}")
-            logger.info(f"-- Selector: {selector}")
-            logger.info(f"-- Element value: {element_value}")
-            
+    try:
+        while num_steps < max_steps + additional_steps:
+            if asyncio.current_task().cancelling():
+                # A fallback path may have swallowed the cancellation, stop at the step boundary
+                raise asyncio.CancelledError()
+            error_message = ""
+            total_step_score = 0
+            step_reward = {}
+            status_description = ""
+            planning_input_token_count = 0
+            planning_output_token_count = 0
+            reward_token_count = [0, 0]
+            small_model_token_count = [0, 0]
+            step_tokens_recorded = False
 
             logger.info(
-                "**🤖 The agent is in the process of executing the action 🤖**")
-
-            if out_put.get("action_type") not in ["get_final_answer"]:
-                try:
-                    await env.execute_action(execute_action)
-                    previous_trace.append(current_trace)
-                    error_description = ""
-                    logger.info("-- Successfully execute the action ")
-                except ActionExecutionError as ee:
-                    error_message = ee.message
-                    logger.info("-- Failed to execute the action")
-                    logger.error(
-                        f"ActionExecutionError occurred: {error_message}")
-                error_description = error_message
-
-                if mode in ["d_v", "dom_v_desc", "vision_to_dom"]:
-                    observation, observation_VforD = await env.get_obs()
-                    save_screenshot(mode=mode, record_time=record_time, task_name=task_name,
-                                    step_number=num_steps, description="obs", screenshot_base64=observation_VforD)
+                "**🤖 The agent is in the process of starting planning 🤖**")
+
+            reward_evaluated = False
+            # A cached workflow stands in for planning while its pages and elements match
+            out_put = workflow_cache.next_step(env.tree, env.page.url if env.page else "")
+            replayed = out_put is not None
+            if replayed:
+                reward_scheduler.record(num_steps + 1, env.page.url if env.page else "", False)
+            elif global_reward_mode != 'no_global_reward' and len(previous_trace) > 0:
+                reward_evaluated, reward_reason = reward_scheduler.should_evaluate()
+                if reward_evaluated:
+                    step_reward, status_description, reward_token_count = await evaluate_reward(reward_reason)
                 else:
-                    observation = await env.get_obs()
-
-                # URL after executing the action
-                each_step_dict["step_url"] = env.page.url
-                each_step_dict["step_url"] = env.page.url
-                each_step_dict["error_message"] = error_message
-                each_step_dict["previous_trace"] = str(previous_trace)
+                    reward_scheduler.record(num_steps + 1, env.page.url if env.page else "", False)
+
+            if not replayed:
+                out_put = await plan_with_retries()
+
+            if out_put and out_put.get("action_type") == "get_final_answer" and \
+                    global_reward_mode != 'no_global_reward' and len(previous_trace) > 0 and \
+                    reward_scheduler.should_verify_final_answer(reward_evaluated):
+                # The answer was planned without a fresh judgement of the trace, plan it again with one
+                planning_input_token_count += out_put.get("planning_token_count", [0, 0])[0]
+                planning_output_token_count += out_put.get("planning_token_count", [0, 0])[1]
+                small_model_token_count[0] += out_put.get("small_model_token_count", [0, 0])[0]
+                small_model_token_count[1] += out_put.get("small_model_token_count", [0, 0])[1]
+                step_reward, status_description, reward_token_count = await evaluate_reward("final_answer")
+                reward_evaluated = True
+                out_put = await plan_with_retries()
+
+            if out_put:
+                planning_input_token_count += out_put.get("planning_token_count", [0, 0])[0]
+                planning_output_token_count += out_put.get("planning_token_count", [0, 0])[1]
+                small_model_token_count[0] += out_put.get("small_model_token_count", [0, 0])[0]
+                small_model_token_count[1] += out_put.get("small_model_token_count", [0, 0])[1]
+                each_step_dict = {}
+                each_step_dict["step_index"] = step_index
+                each_step_dict["dict_result"] = out_put
+                execute_action, current_trace, path, element_value, text_content = parse_current_trace(
+                    out_put, env, step_reward)
+
+                selector, xpath = (
+                    path[0], path[1]) if path is not None else (None, None)
+
+                each_step_dict["current_trace"] = current_trace
+                each_step_dict["selector"] = selector
+                each_step_dict["execute_action"] = execute_action
+                each_step_dict["element_value"] = element_value
+                each_step_dict["text_content"] = text_content
+
+                logger.info(f"-- Planning output: {out_put}")
+                logger.info(f"-- Current trace: {current_trace}")
+                logger.info(f"-- Action: {execute_action}")
+                logger.info(f"-- Selector: {selector}")
+                logger.info(f"-- Element value: {element_value}")
+            
 
                 logger.info(
-                    f"-- The URL is: {env.page.url}")
-
-                if "vision" in global_reward_mode:
-                    vision_reward = await env.capture()
-                    save_screenshot(mode=mode, record_time=record_time, task_name=task_name,
-                                    step_number=num_steps, description="reward",
-                                    screenshot_base64=vision_reward, task_uuid=task_uuid)
-                    is_valid, message = is_valid_base64(vision_reward)
-                    if not is_valid:
-                        invalid_vision_reward_num += 1
-
-                current_info = {
-                    "URL": env.page.url
-                }
-                if vision_reward:
-                    current_info.update({"vision_reward": vision_reward})
-                logger.info(
-                    f"**🤖 Time Step: {num_steps + 1}, Total steps: {max_steps + additional_steps} 🤖**")
-                step_increase, encountered_errors = await adjust_max_action_step(
-                    conditions, current_info, encountered_errors, increase_step)
-                additional_steps += step_increase
-                steps_list.append(each_step_dict)
-                step_index += 1
-                if num_steps >= 25 or task_global_status == "finished" or task_finished:
-                    break
+                    "**🤖 The agent is in the process of executing the action 🤖**")
+
+                if out_put.get("action_type") not in ["get_final_answer"]:
+                    # Follow-up actions of a batch were planned on the same observation as the first one
+                    batch_actions, batch_traces = [execute_action], [current_trace]
+                    for follow_up in out_put.get("batch", []):
+                        follow_up_action, follow_up_trace, *_ = parse_current_trace(follow_up, env, step_reward)
+                        if follow_up_action["action_type"] == ActionTypes.NONE:
+                            break
+                        batch_actions.append(follow_up_action)
+                        batch_traces.append(follow_up_trace)
+                    workflow_cache.prepare(([out_put] + out_put.get("batch", []))[:len(batch_actions)], env.tree,
+                                           env.page.url if env.page else "")
+                    try:
+                        executed = await env.execute_actions(batch_actions)
+                        previous_trace.extend(batch_traces[:executed])
+                        error_description = ""
+                        logger.info(f"-- Successfully execute {executed} of {len(batch_actions)} actions")
+                    except ActionExecutionError as ee:
+                        executed = ee.executed
+                        previous_trace.extend(batch_traces[:executed])
+                        error_message = ee.message
+                        logger.info("-- Failed to execute the action")
+                        logger.error(
+                            f"ActionExecutionError occurred: {error_message}")
+                    error_description = error_message
+                    each_step_dict["executed_actions"] = executed
+                    each_step_dict["workflow_replay"] = replayed
+                    workflow_cache.record(executed, error_message, replayed)
+                    if cascade is not None and not replayed:
+                        # The action that failed, not necessarily the first one of the batch
+                        cascade.record_outcome(([out_put] + out_put.get("batch", []))[min(executed, len(batch_actions) - 1)],
+                                               error_message)
+
+                    if mode in ["d_v", "dom_v_desc", "vision_to_dom"]:
+                        observation, observation_VforD = await env.get_obs()
+                        if env.frame is not None:
+                            await env.frame.save_in_background(screenshot_path(
+                                mode=mode, record_time=record_time, task_name=task_name,
+                                step_number=num_steps, description="obs"))
+                    else:
+                        observation = await env.get_obs()
+
+                    # URL after executing the action
+                    each_step_dict["step_url"] = env.page.url
+                    each_step_dict["step_url"] = env.page.url
+                    visited_urls.append(env.page.url)
+                    each_step_dict["error_message"] = error_message
+                    each_step_dict["previous_trace"] = str(previous_trace)
+                    each_step_dict["reward_evaluated"] = reward_evaluated
+                    each_step_dict["observation_timings"] = env.observation_timings
+                    reward_scheduler.observe(
+                        env.page.url, ([out_put] + out_put.get("batch", []))[:max(executed, 1)], error_message)
+
+                    logger.info(
+                        f"-- The URL is: {env.page.url}")
+
+                    if "vision" in global_reward_mode:
+                        # The frame of the observation when there is one, the page has not changed since
+                        frame = await env.capture_frame()
+                        vision_reward = await frame.encoded(env.screenshot_width)
+                        await frame.save_in_background(screenshot_path(
+                            mode=mode, record_time=record_time, task_name=task_name,
+                            step_number=num_steps, description="reward", task_name_id=task_uuid))
+                        # The browser encoded the frame, only a failed capture leaves it empty
+                        if not vision_reward:
+                            invalid_vision_reward_num += 1
+
+                    current_info = {
+                        "URL": env.page.url
+                    }
+                    if vision_reward:
+                        current_info.update({"vision_reward": vision_reward})
+                    logger.info(
+                        f"**🤖 Time Step: {num_steps + 1}, Total steps: {max_steps + additional_steps} 🤖**")
+                    step_increase, encountered_errors = await adjust_max_action_step(
+                        conditions, current_info, encountered_errors, increase_step)
+                    additional_steps += step_increase
+                    steps_list.append(each_step_dict)
+                    step_index += 1
+                    if num_steps >= 25 or task_global_status == "finished" or task_finished:
+                        break
             
-            if out_put.get("action_type") in ["get_final_answer"]:
-                logger.info("**Task completed with final answer.**")
-                logger.info(f"raw final answer is {text_content}")
-                validated_content = await validate_and_replan_links(
-                    text_content,
-                    observation,
-                    task_name,
-                    output_parameters,
-                    response_type,
-                    env.page.url if env.page else None
-                )
-                logger.info(f"validated final answer is {validated_content}")
-                processed_answer = process_final_answer(validated_content, env.tree)
-                final_answer = processed_answer
-                logger.info(f"Final answer type: {type(final_answer)}")
+                if out_put.get("action_type") in ["get_final_answer"]:
+                    logger.info("**Task completed with final answer.**")
+                    logger.info(f"raw final answer is {text_content}")
+                    validated_content = await validate_and_replan_links(
+                        text_content,
+                        observation,
+                        task_name,
+                        output_parameters,
+                        response_type,
+                        env.page.url if env.page else None,
+                        link_index=env.tree.link_index
+                    )
+                    logger.info(f"validated final answer is {validated_content}")
+                    processed_answer = process_final_answer(validated_content, env.tree)
+                    final_answer = processed_answer
+                    logger.info(f"Final answer type: {type(final_answer)}")
                 
-                planning_token_count_number = planning_input_token_count + planning_output_token_count
-                reward_token_count_number = reward_token_count[0] + reward_token_count[1]
-                step_input_token_count = planning_input_token_count + reward_token_count[0]
-                step_output_token_count = planning_output_token_count + reward_token_count[1]
-                step_token_count = planning_token_count_number + reward_token_count_number
-                single_step_tokens = {
-                    "planning_input_token_count": planning_input_token_count,
-                    "planning_output_token_count": planning_output_token_count,
-                    "planning_token_count": planning_token_count_number,
-                    "reward_input_token_count": reward_token_count[0],
-                    "reward_output_token_count": reward_token_count[1],
-                    "reward_token_count": reward_token_count_number,
-                    "input_token_count": step_input_token_count,
-                    "output_token_count": step_output_token_count,
-                    "token_count": step_token_count
-                }
-
-                step_tokens["steps_tokens_record"].append(single_step_tokens)
-
-                steps_planning_input_token_counts += planning_input_token_count
-                steps_planning_output_token_counts += planning_output_token_count
-                steps_reward_input_token_counts += reward_token_count[0]
-                steps_reward_output_token_counts += reward_token_count[1]
-                steps_input_token_counts += step_input_token_count
-                steps_output_token_counts += step_output_token_count
-                steps_token_counts += step_token_count
-
-                step_tokens["steps_planning_input_token_counts"] = steps_planning_input_token_counts
-                step_tokens["steps_planning_output_token_counts"] = steps_planning_output_token_counts
-                step_tokens["steps_reward_input_token_counts"] = steps_reward_input_token_counts
-                step_tokens["steps_reward_output_token_counts"] = steps_reward_output_token_counts
-                step_tokens["steps_input_token_counts"] = steps_input_token_counts
-                step_tokens["steps_output_token_counts"] = steps_output_token_counts
-                step_tokens["steps_token_counts"] = steps_token_counts
-
-                save_token_count_to_file(token_counts_filename, step_tokens, task_name, global_reward_text_model,
-                                        planning_text_model, config["token_pricing"])
+                    single_step_tokens = record_step_tokens(
+                        step_tokens, planning_input_token_count, planning_output_token_count, reward_token_count,
+                        small_model_token_count)
+                    step_tokens_recorded = True
+                    if step_callback is not None:
+                        await step_callback(build_step_event(
+                            num_steps + 1, out_put, env.page.url if env.page else None, error_message, single_step_tokens))
+
+                    await storage_store.save(env.context, visited_urls)
+                    workflow_cache.save()
+                    collect_task_stats(step_tokens, cascade, reward_scheduler, storage_store, workflow_cache, env, config)
+                    await save_token_count_to_file(token_counts_filename, step_tokens, task_name, global_reward_text_model,
+                                                  planning_text_model, config["token_pricing"])
+                    # The caller reads the token counts back
+                    await artifact_writer.flush()
                 
-                logger.info(f"**final answer is {str(final_answer)}**")
-                return final_answer
+                    logger.info(f"**final answer is {str(final_answer)}**")
+                    return final_answer
             
             
         
-        num_steps += 1
-        if interaction_mode:
-            logger.info(
-                "Press Enter to proceed to the next action, or type 'q' to quit the task. If you encounter any unexpected issues such as network connection errors or captcha challenges, please resolve them manually now.")
-            a = input()
-            if a.lower() == "q":
-                logger.info("User requested to quit the program.")
-                human_interaction_stop_status = True
-                break
-
-        planning_token_count_number = planning_input_token_count + planning_output_token_count
-        reward_token_count_number = reward_token_count[0] + reward_token_count[1]
-        step_input_token_count = planning_input_token_count + reward_token_count[0]
-        step_output_token_count = planning_output_token_count + reward_token_count[1]
-        step_token_count = planning_token_count_number + reward_token_count_number
-        single_step_tokens = {
-            "planning_input_token_count": planning_input_token_count,
-            "planning_output_token_count": planning_output_token_count,
-            "planning_token_count": planning_token_count_number,
-            "reward_input_token_count": reward_token_count[0],
-            "reward_output_token_count": reward_token_count[1],
-            "reward_token_count": reward_token_count_number,
-            "input_token_count": step_input_token_count,
-            "output_token_count": step_output_token_count,
-            "token_count": step_token_count
-        }
-
-        step_tokens["steps_tokens_record"].append(single_step_tokens)
-
-        steps_planning_input_token_counts += planning_input_token_count
-        steps_planning_output_token_counts += planning_output_token_count
-        steps_reward_input_token_counts += reward_token_count[0]
-        steps_reward_output_token_counts += reward_token_count[1]
-        steps_input_token_counts += step_input_token_count
-        steps_output_token_counts += step_output_token_count
-        steps_token_counts += step_token_count
-
-    step_tokens["steps_planning_input_token_counts"] = steps_planning_input_token_counts
-    step_tokens["steps_planning_output_token_counts"] = steps_planning_output_token_counts
-    step_tokens["steps_reward_input_token_counts"] = steps_reward_input_token_counts
-    step_tokens["steps_reward_output_token_counts"] = steps_reward_output_token_counts
-    step_tokens["steps_input_token_counts"] = steps_input_token_counts
-    step_tokens["steps_output_token_counts"] = steps_output_token_counts
-    step_tokens["steps_token_counts"] = steps_token_counts
-
-    save_token_count_to_file(token_counts_filename, step_tokens, task_name, global_reward_text_model,
-                             planning_text_model, config["token_pricing"])
+            num_steps += 1
+            if interaction_mode:
+                if intervention_channel is not None:
+                    logger.info(
+                        "Waiting for the operator to resume or quit the task. If you encounter any unexpected issues such as network connection errors or captcha challenges, please resolve them manually now.")
+                    decision = await intervention_channel.wait_for_decision(
+                        task_id=task_uuid, task_name=task_name, step=num_steps,
+                        url=env.page.url if env.page else "")
+                else:
+                    logger.info(
+                        "Press Enter to proceed to the next action, or type 'q' to quit the task. If you encounter any unexpected issues such as network connection errors or captcha challenges, please resolve them manually now.")
+                    decision = await console_decision()
+                if decision == "quit":
+                    logger.info("User requested to quit the program.")
+                    human_interaction_stop_status = True
+                    break
+
+            single_step_tokens = record_step_tokens(
+                step_tokens, planning_input_token_count, planning_output_token_count, reward_token_count,
+                small_model_token_count)
+            step_tokens_recorded = True
+            if step_callback is not None:
+                await step_callback(build_step_event(
+                    num_steps, out_put, env.page.url if env.page else None, error_message, single_step_tokens))
+    except asyncio.CancelledError:
+        # The client went away or the job was cancelled, still account for the tokens already spent
+        logger.info("Task cancelled, recording partial token usage.")
+        if not step_tokens_recorded:
+            record_step_tokens(
+                step_tokens, planning_input_token_count, planning_output_token_count, reward_token_count,
+                small_model_token_count)
+        collect_task_stats(step_tokens, cascade, reward_scheduler, storage_store, workflow_cache, env, config)
+        await save_token_count_to_file(token_counts_filename, step_tokens, task_name, global_reward_text_model,
+                                       planning_text_model, config["token_pricing"])
+        raise
+
+    await storage_store.record_failure(visited_urls)
+    await workflow_cache.record_failure()
+    collect_task_stats(step_tokens, cascade, reward_scheduler, storage_store, workflow_cache, env, config)
+    await save_token_count_to_file(token_counts_filename, step_tokens, task_name, global_reward_text_model,
+                                   planning_text_model, config["token_pricing"])
     
     
     # 如果到这里还没有 return，说明任务未完成
@@ -470,8 +626,8 @@ async def run_task(
         json_result_folder, f"{task_uuid}_incomplete.json")
     
     logger.info(f"Writing incomplete task results to: {json_out_file_path}")
-    with open(json_out_file_path, 'w') as json_file:
-        json.dump(result, json_file)
+    await artifact_writer.write_json_async(json_out_file_path, result)
+    await artifact_writer.flush()
     
     return result
 
@@ -547,6 +703,15 @@ def process_final_answer(final_answer: str | list | dict, html_tree: HTMLTree) -
                 return int(numbers[0]) if numbers else None
             return None
         
+        def resolve_link(value):
+            """Resolve a link ID to its href, URLs that were kept by validate_and_replan_links stay as they are"""
+            if isinstance(value, str) and re.match(r'(https?://|www\.)', value.strip(), re.IGNORECASE):
+                return value.strip()
+            link_id = extract_number(value)
+            if link_id is not None and link_id in html_tree.link_index:
+                return html_tree.link_index[link_id]['href']
+            return None
+
         # Recursively process dictionary to find and resolve link IDs
         def resolve_links(obj):
             """Recursively process dictionary to find and resolve link IDs with href values"""
@@ -556,20 +721,11 @@ def process_final_answer(final_answer: str | list | dict, html_tree: HTMLTree) -
                     if 'link' in key.lower() or 'url' in key.lower():
                         # Handle single link ID
                         if isinstance(value, (int, str)):
-                            link_id = extract_number(value)
-                            if link_id and link_id in html_tree.link_index:
-                                # 只替换href值，保持其他键值不变
-                                result[key] = html_tree.link_index[link_id]['href']
-                            else:
-                                result[key] = None
+                            # 只替换href值，保持其他键值不变
+                            result[key] = resolve_link(value)
                         # Handle array of link IDs
                         elif isinstance(value, list):
-                            result[key] = [
-                                html_tree.link_index[extract_number(id)]['href']
-                                if extract_number(id) and extract_number(id) in html_tree.link_index
-                                else None
-                                for id in value
-                            ]
+                            result[key] = [resolve_link(id) for id in value]
                         else:
                             result[key] = value
                     else:
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from typing import Optional
+
+from logs import logger
+
+
+class InterventionChannel:
+    """
+    Asynchronous human-in-the-loop channel.
+
+    A task that needs operator confirmation parks itself on a future keyed by its task id.
+    Only that task is paused; the event loop keeps serving other tasks and the HTTP server
+    while an operator resumes or quits it remotely through `resolve`.
+    """
+
+    decisions = ["resume", "quit"]
+
+    def __init__(self):
+        self.pending = {}
+
+    async def wait_for_decision(self, task_id: str, task_name: str = "", step: int = 0, url: str = "",
+                                timeout: Optional[float] = None) -> str:
+        """Pause the calling task until an operator decides, returns "resume" or "quit"."""
+        if task_id in self.pending:
+            raise ValueError(f"Task {task_id} is already waiting for an intervention")
+        future = asyncio.get_running_loop().create_future()
+        self.pending[task_id] = {
+            "future": future,
+            "task_name": task_name,
+            "step": step,
+            "url": url,
+            "paused_at": time.time()
+        }
+        logger.info(
+            f"Task {task_id} paused at step {step}, waiting for operator decision via /interventions/{task_id}")
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            logger.info(f"No operator decision for task {task_id} within {timeout}s, resuming.")
+            return "resume"
+        finally:
+            self.pending.pop(task_id, None)
+
+    def resolve(self, task_id: str, decision: str) -> bool:
+        """Deliver an operator decision to a paused task, returns False if the task is not paused."""
+        if decision not in self.decisions:
+            raise ValueError(f"decision must be one of: {', '.join(self.decisions)}")
+        waiting = self.pending.get(task_id)
+        if waiting is None or waiting["future"].done():
+            return False
+        waiting["future"].set_result(decision)
+        return True
+
+    def list_pending(self) -> list:
+        return [
+            {
+                "task_id": task_id,
+                "task_name": waiting["task_name"],
+                "step": waiting["step"],
+                "url": waiting["url"],
+                "paused_for": round(time.time() - waiting["paused_at"], 1)
+            }
+            for task_id, waiting in self.pending.items()
+        ]
+
+
+async def console_decision() -> str:
+    """Read the operator decision from stdin in a worker thread so the event loop is never blocked."""
+    answer = await asyncio.to_thread(input)
+    return "quit" if answer.strip().lower() == "q" else "resume"
+
+
+intervention_channel = InterventionChannel()
@@ -0,0 +1,415 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from logs import logger
+
+
+JOB_STATUSES = ["queued", "running", "succeeded", "failed", "cancelled"]
+FINISHED_STATUSES = ["succeeded", "failed", "cancelled"]
+
+
+def result_error(result) -> Optional[str]:
+    """The error of a handler result that reports a failed run instead of raising, like TaskResponse"""
+    if isinstance(result, dict):
+        status, error = result.get("status"), result.get("error")
+    else:
+        status, error = getattr(result, "status", None), getattr(result, "error", None)
+    if status == "error":
+        return error or "Task failed"
+    return None
+
+
+def pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, owned by another user
+        return True
+    return True
+
+
+@dataclass
+class Job:
+    job_id: str
+    payload: Any
+    status: str = "queued"
+    result: Any = None
+    error: Optional[str] = None
+    events: list = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    runner: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "steps": len(self.events),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobManager:
+    """
+    In-process job queue for agent runs.
+
+    `handler(payload, step_callback)` is awaited for every submitted job by a fixed number of
+    worker coroutines, so at most `concurrency` agent runs drive a browser at the same time.
+    Step events published through `step_callback` are kept on the job and can be streamed.
+    """
+
+    def __init__(self, handler, concurrency: int = 2, max_finished_jobs: int = 1000):
+        self.handler = handler
+        self.concurrency = max(1, int(concurrency))
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = {}
+        self.queue = None
+        self.workers = []
+        self.changed = None
+
+    async def start(self) -> None:
+        self.queue = asyncio.Queue()
+        self.changed = asyncio.Condition()
+        self.workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+        logger.info(f"Job manager started with {self.concurrency} workers")
+
+    async def stop(self) -> None:
+        for job in self.jobs.values():
+            if job.runner is not None and not job.runner.done():
+                job.runner.cancel()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def submit(self, job_id: str, payload: Any) -> Job:
+        if job_id in self.jobs:
+            raise ValueError(f"Job {job_id} already exists")
+        job = Job(job_id=job_id, payload=payload)
+        self.jobs[job_id] = job
+        self.queue.put_nowait(job)
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job, a running job tears down its browser while unwinding."""
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        if job.runner is not None and not job.runner.done():
+            job.runner.cancel()
+        else:
+            await self._finish(job, "cancelled")
+        return True
+
+    async def publish(self, job: Job, event: dict) -> None:
+        job.events.append(event)
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def stream(self, job_id: str):
+        """Yield every step event of a job as it is published, ending once the job finishes."""
+        job = self.jobs[job_id]
+        sent = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: len(job.events) > sent or job.finished)
+            while sent < len(job.events):
+                yield job.events[sent]
+                sent += 1
+            if job.finished and sent >= len(job.events):
+                return
+
+    async def _worker(self, worker_index: int) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+                job.started_at = time.time()
+                job.runner = asyncio.create_task(self._run(job))
+                try:
+                    await job.runner
+                except asyncio.CancelledError:
+                    if not job.runner.cancelled():
+                        raise
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        async def step_callback(event: dict):
+            await self.publish(job, event)
+
+        try:
+            job.result = await self.handler(job.payload, step_callback)
+            job.error = result_error(job.result)
+            await self._finish(job, "failed" if job.error else "succeeded")
+        except asyncio.CancelledError:
+            logger.info(f"Job {job.job_id} cancelled")
+            await self._finish(job, "cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.job_id} failed: {e}")
+            job.error = str(e)
+            await self._finish(job, "failed")
+
+    async def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        async with self.changed:
+            self.changed.notify_all()
+
+    def _prune(self) -> None:
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(finished) - self.max_finished_jobs)]:
+            self.jobs.pop(job.job_id, None)
+
+
+class SharedJobManager(JobManager):
+    """
+    Job queue shared by every server process through a SQLite database.
+
+    With several uvicorn/gunicorn workers a job can be submitted to one process and polled or
+    cancelled through another, so jobs, step events and cancel requests live in the database.
+    Each process claims queued jobs atomically and runs at most `concurrency` of them. Jobs left
+    running by a process that exited are marked failed when a process starts.
+    """
+
+    def __init__(self, handler, db_path: str, concurrency: int = 2, max_finished_jobs: int = 1000,
+                 payload_loader=None, encode=None, poll_interval: float = 0.5):
+        super().__init__(handler, concurrency=concurrency, max_finished_jobs=max_finished_jobs)
+        self.db_path = db_path
+        self.payload_loader = payload_loader or (lambda data: data)
+        self.encode = encode or (lambda value: value)
+        self.poll_interval = poll_interval
+        self.running = {}
+        self.watcher = None
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self) -> None:
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, payload TEXT, status TEXT, result TEXT, error TEXT, "
+                "created_at REAL, started_at REAL, finished_at REAL, worker_pid INTEGER, "
+                "cancel_requested INTEGER DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                "job_id TEXT, seq INTEGER, event TEXT, PRIMARY KEY (job_id, seq))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with closing(self._connect()) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self._fail_orphaned)
+        self.workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+        self.watcher = asyncio.create_task(self._watch_cancellations())
+        logger.info(f"Shared job manager started with {self.concurrency} workers in process {os.getpid()}")
+
+    def _fail_orphaned(self) -> None:
+        """Fail the running jobs of server processes that are gone, nothing would ever finish them"""
+        rows = self._execute("SELECT job_id, worker_pid FROM jobs WHERE status = 'running'")
+        # This process hasn't claimed anything yet, a row with its pid was left by an earlier one
+        orphaned = [row for row in rows if row["worker_pid"] == os.getpid() or not pid_alive(row["worker_pid"])]
+        for row in orphaned:
+            self._execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ? AND status = 'running'",
+                (f"Server process {row['worker_pid']} exited while running the job", time.time(), row["job_id"])
+            )
+        if orphaned:
+            logger.warning(f"Marked {len(orphaned)} jobs of exited server processes as failed")
+
+    async def stop(self) -> None:
+        tasks = list(self.running.values()) + self.workers
+        if self.watcher is not None:
+            tasks.append(self.watcher)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers, self.watcher = [], None
+
+    def submit(self, job_id: str, payload: Any) -> Job:
+        job = Job(job_id=job_id, payload=payload)
+        try:
+            self._execute(
+                "INSERT INTO jobs (job_id, payload, status, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, json.dumps(self.encode(payload)), job.status, job.created_at)
+            )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Job {job_id} already exists")
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        rows = self._execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        if not rows:
+            return None
+        row = rows[0]
+        events = [json.loads(r["event"]) for r in self._execute(
+            "SELECT event FROM job_events WHERE job_id = ? ORDER BY seq", (job_id,))]
+        return Job(
+            job_id=row["job_id"],
+            payload=json.loads(row["payload"]),
+            status=row["status"],
+            result=json.loads(row["result"]) if row["result"] is not None else None,
+            error=row["error"],
+            events=events,
+            created_at=row["created_at"],
+            started_at=row["started_at"],
+            finished_at=row["finished_at"]
+        )
+
+    async def cancel(self, job_id: str) -> bool:
+        """Finish a queued job directly, a running job is cancelled by the process that owns it."""
+        def request_cancel():
+            with closing(self._connect()) as conn:
+                updated = conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ? AND status = 'queued'",
+                    (time.time(), job_id)
+                ).rowcount
+                if updated:
+                    return True
+                return conn.execute(
+                    "UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = 'running'",
+                    (job_id,)
+                ).rowcount > 0
+
+        return await asyncio.to_thread(request_cancel)
+
+    async def publish(self, job: Job, event: dict) -> None:
+        job.events.append(event)
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+            (job.job_id, len(job.events) - 1, json.dumps(self.encode(event)))
+        )
+
+    async def stream(self, job_id: str):
+        """Yield every step event of a job as it lands in the database, ending once the job finishes."""
+        sent = 0
+        while True:
+            rows = await asyncio.to_thread(
+                self._execute, "SELECT status FROM jobs WHERE job_id = ?", (job_id,))
+            finished = not rows or rows[0]["status"] in FINISHED_STATUSES
+            events = await asyncio.to_thread(
+                self._execute,
+                "SELECT event FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq",
+                (job_id, sent)
+            )
+            for row in events:
+                yield json.loads(row["event"])
+                sent += 1
+            if finished:
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    def _claim(self) -> Optional[Job]:
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT job_id, payload, created_at FROM jobs WHERE status = 'queued' "
+                    "ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                started_at = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, worker_pid = ? WHERE job_id = ?",
+                    (started_at, os.getpid(), row["job_id"])
+                )
+            finally:
+                conn.execute("COMMIT")
+        return Job(
+            job_id=row["job_id"],
+            payload=self.payload_loader(json.loads(row["payload"])),
+            status="running",
+            created_at=row["created_at"],
+            started_at=started_at
+        )
+
+    async def _worker(self, worker_index: int) -> None:
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            job.runner = asyncio.create_task(self._run(job))
+            self.running[job.job_id] = job.runner
+            try:
+                await job.runner
+            except asyncio.CancelledError:
+                if not job.runner.cancelled():
+                    raise
+            finally:
+                self.running.pop(job.job_id, None)
+
+    async def _watch_cancellations(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if not self.running:
+                continue
+            rows = await asyncio.to_thread(
+                self._execute,
+                "SELECT job_id FROM jobs WHERE cancel_requested = 1 AND status = 'running' AND worker_pid = ?",
+                (os.getpid(),)
+            )
+            for row in rows:
+                runner = self.running.get(row["job_id"])
+                if runner is not None and not runner.done():
+                    runner.cancel()
+
+    async def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        result = json.dumps(self.encode(job.result)) if job.result is not None else None
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+            (status, result, job.error, job.finished_at, job.job_id)
+        )
+
+    def _prune(self) -> None:
+        with closing(self._connect()) as conn:
+            stale = [row["job_id"] for row in conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?", (self.max_finished_jobs,)
+            ).fetchall()]
+            for job_id in stale:
+                conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
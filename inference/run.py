@@ -1,22 +1,36 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any, Union, List
 import uvicorn
+import asyncio
 import time
 import logging
 import os
 import json
+import uuid
 from dataclasses import dataclass
 import pandas as pd
 import numpy as np
 
 from agent.Utils.utils import *
 from agent.Environment.html_env.async_env import AsyncHTMLEnvironment
+from agent.Environment.html_env.grounding import GroundingCache
+from agent.Environment.html_env.search_urls import SearchUrlEngine
+from agent.Environment.browser_env import BrowserPool, HttpDiskCache, StorageStateStore, site_of
+from agent.Environment.html_env.observation_pool import shutdown_observation_pool
 from execute.execution import run_task, read_config
+from execute.intervention import intervention_channel
+from execute.jobs import JobManager, SharedJobManager
 from agent.Utils.format_converter import format_converter
+from agent.LLM.governor import llm_governor
+from agent.Utils.artifact_writer import artifact_writer
+from agent.Plan.action import parse_metrics
 
 logger = logging.getLogger(__name__)
-app = FastAPI()
+DEFAULT_TOML_PATH = "./inference/configs/setting.toml"
 
 class TaskRequest(BaseModel):
     global_reward_mode: str = "no_global_reward"
@@ -24,7 +38,7 @@ class TaskRequest(BaseModel):
     global_reward_text_model: str = "gpt-4o"
     task_name: str = "find blog posts on imean.ai"
     observation_mode: str = "dom"
-    toml_path: str = "./inference/configs/setting.toml"
+    toml_path: str = DEFAULT_TOML_PATH
     input_parameters: Union[Dict[str, Any], List[Any], str] = Field(
         default={},
         description="Input parameters can be a dictionary, list, or string"
@@ -32,6 +46,10 @@ class TaskRequest(BaseModel):
     output_parameters: dict = {}
     response_type: str = "text"  # Can be "text", "list", "json", "number", "boolean", "table"
     browser_env: str = "local"  # Can be "local" or "browserbase"
+    task_id: Optional[str] = None  # Used to address the task via /interventions, generated if omitted
+
+class InterventionRequest(BaseModel):
+    action: str = "resume"  # Can be "resume" or "quit"
 
 @dataclass
 class ExperimentConfig:
@@ -44,6 +62,7 @@ class ExperimentConfig:
     write_result_file_path: str
     record_time: str
     browser_env: str
+    task_id: str
 
 def validate_config(config, observation_mode, global_reward_mode, observation_model, global_reward_model):
     json_model_response = config['model']['json_model_response']
@@ -70,6 +89,14 @@ def validate_config(config, observation_mode, global_reward_mode, observation_mo
             detail="interaction_mode must be defined as boolean"
         )
 
+    if interaction_mode and server_config.get("workers", 1) > 1:
+        # Paused tasks wait in the intervention channel of their own process, /interventions
+        # requests land on any worker
+        raise HTTPException(
+            status_code=400,
+            detail="interaction_mode is not supported with more than one server worker"
+        )
+
     if json_model_response and (observation_model not in all_json_models or (
             global_reward_mode != 'no_global_reward' and global_reward_model not in all_json_models)):
         raise HTTPException(
@@ -123,7 +150,9 @@ def check_format(answer: Any, expected_type: str) -> bool:
         return isinstance(answer, str)
     return False
 
-def create_html_environment(mode, browser_env):
+def create_html_environment(mode, browser_env, browser_pool=None, screenshot_config=None, http_cache=None,
+                            search_engine=None, grounding=None):
+    screenshot_config = screenshot_config or {}
     return AsyncHTMLEnvironment(
         mode=mode,
         max_page_length=8192,
@@ -135,7 +164,17 @@ def create_html_environment(mode, browser_env):
         sleep_after_execution=0.0,
         locale="en-US",
         use_vimium_effect=True,
-        browser_env=browser_env
+        browser_env=browser_env,
+        browser_pool=browser_pool if browser_env == "local" else None,
+        dom_parse_workers=server_config.get("dom_parse_workers", 2),
+        inline_parse_max_chars=server_config.get("inline_parse_max_chars", 30000),
+        screenshot_capture=screenshot_config.get("capture", "cdp"),
+        screenshot_format=screenshot_config.get("format", "jpeg"),
+        screenshot_quality=screenshot_config.get("quality", 80),
+        screenshot_width=screenshot_config.get("width", 1080),
+        http_cache=http_cache,
+        search_engine=search_engine,
+        grounding=grounding
     )
 
 class TaskResponse(BaseModel):
@@ -155,9 +194,12 @@ class TaskResponse(BaseModel):
     error: Optional[str] = None
     token_cost: Optional[float] = None
     result_file_path: Optional[str] = None
+    task_id: Optional[str] = None
 
-async def run_experiment(experiment_config: ExperimentConfig) -> TaskResponse:
-    env = create_html_environment(experiment_config.mode, experiment_config.browser_env)
+async def run_experiment(experiment_config: ExperimentConfig, step_callback=None) -> TaskResponse:
+    env = create_html_environment(experiment_config.mode, experiment_config.browser_env, browser_pool,
+                                  experiment_config.config.get("screenshot"), http_cache, search_engine,
+                                  grounding)
     try:
         # Set up token tracking
         if not os.path.exists("token_results"):
@@ -168,7 +210,7 @@ async def run_experiment(experiment_config: ExperimentConfig) -> TaskResponse:
             mode=experiment_config.mode,
             task_mode="single_task",
             task_name=experiment_config.task_name,
-            task_uuid=None,
+            task_uuid=experiment_config.task_id,
             config=experiment_config.config,
             write_result_file_path=experiment_config.write_result_file_path,
             reference_task_length=experiment_config.config['steps']['single_task_action_step'],
@@ -181,7 +223,9 @@ async def run_experiment(experiment_config: ExperimentConfig) -> TaskResponse:
             interaction_mode=experiment_config.config['steps']['interaction_mode'],
             record_time=experiment_config.record_time,
             output_parameters=experiment_config.config["output_parameters"],
-            response_type=experiment_config.config["response_type"]
+            response_type=experiment_config.config["response_type"],
+            intervention_channel=intervention_channel,
+            step_callback=step_callback
         )
         
         # Add debug logging for initial result
@@ -192,7 +236,8 @@ async def run_experiment(experiment_config: ExperimentConfig) -> TaskResponse:
             return TaskResponse(
                 status="incomplete",
                 result=result,
-                token_cost=0
+                token_cost=0,
+                task_id=experiment_config.task_id
             )
 
         # 如果结果是字典类型，先转换为JSON字符串
@@ -226,7 +271,8 @@ async def run_experiment(experiment_config: ExperimentConfig) -> TaskResponse:
         return TaskResponse(
             status="success",
             result=formatted_result,
-            token_cost=total_token_cost
+            token_cost=total_token_cost,
+            task_id=experiment_config.task_id
         )
 
     except Exception as e:
@@ -234,13 +280,14 @@ async def run_experiment(experiment_config: ExperimentConfig) -> TaskResponse:
         logger.error(error_msg)
         return TaskResponse(
             status="error",
-            error=error_msg
+            error=error_msg,
+            task_id=experiment_config.task_id
         )
     finally:
         await env.close()
         del env
 
-async def execute_task(task_request: TaskRequest) -> TaskResponse:
+async def execute_task(task_request: TaskRequest, step_callback=None) -> TaskResponse:
     try:
         config = read_config(task_request.toml_path)
         config["response_type"] = task_request.response_type
@@ -267,10 +314,11 @@ async def execute_task(task_request: TaskRequest) -> TaskResponse:
             config=config,
             write_result_file_path=write_result_file_path,
             record_time=record_time,
-            browser_env=task_request.browser_env
+            browser_env=task_request.browser_env,
+            task_id=task_request.task_id or uuid.uuid4().hex
         )
 
-        return await run_experiment(experiment_config)
+        return await run_experiment(experiment_config, step_callback)
 
     except Exception as e:
         error_msg = f"Task execution failed: {str(e)}"
@@ -280,9 +328,191 @@ async def execute_task(task_request: TaskRequest) -> TaskResponse:
             error=error_msg
         )
 
+def read_server_config(toml_path: str = DEFAULT_TOML_PATH) -> dict:
+    try:
+        return read_config(toml_path).get("server", {})
+    except Exception as e:
+        logger.warning(f"Failed to read server config, using defaults: {str(e)}")
+        return {}
+
+def create_http_cache(toml_path: str = DEFAULT_TOML_PATH) -> HttpDiskCache:
+    """One cache per server process, shared by all the contexts of its browser pool"""
+    try:
+        return HttpDiskCache.from_config(read_config(toml_path).get("http_cache", {}))
+    except Exception as e:
+        logger.warning(f"Failed to read HTTP cache config, caching disabled: {str(e)}")
+        return HttpDiskCache()
+
+def create_search_engine(toml_path: str = DEFAULT_TOML_PATH) -> SearchUrlEngine:
+    """One engine per server process, so the search URLs learned by a task serve the next ones"""
+    try:
+        return SearchUrlEngine.from_config(read_config(toml_path).get("search_urls", {}))
+    except Exception as e:
+        logger.warning(f"Failed to read search URL config, using the known engines only: {str(e)}")
+        return SearchUrlEngine()
+
+def create_grounding_cache(toml_path: str = DEFAULT_TOML_PATH) -> GroundingCache:
+    """One cache per server process, so a selector that worked for one task serves the next ones"""
+    try:
+        return GroundingCache.from_config(read_config(toml_path).get("grounding", {}))
+    except Exception as e:
+        logger.warning(f"Failed to read grounding config, keeping selectors in memory only: {str(e)}")
+        return GroundingCache()
+
+def create_job_manager(server_config: dict):
+    """Worker processes don't share memory, so more than one worker needs the SQLite job store"""
+    concurrency = server_config.get("job_workers", 2)
+    if server_config.get("workers", 1) > 1 or server_config.get("job_store", "memory") == "sqlite":
+        return SharedJobManager(
+            handler=execute_task,
+            db_path=server_config.get("job_db_path", "./output/jobs.sqlite3"),
+            concurrency=concurrency,
+            payload_loader=lambda data: TaskRequest(**data),
+            encode=jsonable_encoder
+        )
+    return JobManager(handler=execute_task, concurrency=concurrency)
+
+server_config = read_server_config()
+job_manager = create_job_manager(server_config)
+browser_pool = BrowserPool(
+    max_contexts=server_config.get("max_browser_contexts", 4),
+    headless=False,
+    slow_mo=1000
+)
+http_cache = create_http_cache()
+search_engine = create_search_engine()
+grounding = create_grounding_cache()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    await browser_pool.close()
+    await grounding.save()
+    shutdown_observation_pool()
+
+app = FastAPI(lifespan=lifespan)
+
+async def run_until_disconnected(request: Request, task_request: TaskRequest, poll_interval: float = 1.0) -> TaskResponse:
+    """Run the task and cancel it as soon as the HTTP client disconnects, so no browser or LLM time is wasted"""
+    runner = asyncio.create_task(execute_task(task_request))
+    try:
+        while True:
+            done, _ = await asyncio.wait({runner}, timeout=poll_interval)
+            if done:
+                return runner.result()
+            if await request.is_disconnected():
+                logger.info(f"Client disconnected, cancelling task {task_request.task_id}")
+                runner.cancel()
+                await asyncio.gather(runner, return_exceptions=True)
+                return TaskResponse(
+                    status="cancelled",
+                    error="Client disconnected",
+                    task_id=task_request.task_id
+                )
+    except asyncio.CancelledError:
+        runner.cancel()
+        raise
+
 @app.post("/execute", response_model=TaskResponse)
-async def handle_execute(task_request: TaskRequest):
-    return await execute_task(task_request)
+async def handle_execute(task_request: TaskRequest, request: Request):
+    task_request.task_id = task_request.task_id or uuid.uuid4().hex
+    return await run_until_disconnected(request, task_request)
+
+@app.get("/metrics/llm")
+async def llm_metrics():
+    """Queue wait and throttling of the LLM requests of this worker process"""
+    return llm_governor.metrics()
+
+@app.get("/metrics/artifacts")
+async def artifact_metrics():
+    """Writes queued, done and blocked on a full queue by the artifact writer of this worker process"""
+    return artifact_writer.metrics()
+
+@app.get("/metrics/http-cache")
+async def http_cache_metrics():
+    """Static asset requests of this worker process served from the HTTP disk cache, and the bytes saved"""
+    return http_cache.metrics()
+
+@app.get("/metrics/parsing")
+async def parsing_metrics():
+    """How the planning responses of this worker process were parsed, and how often that failed"""
+    return parse_metrics
+
+@app.delete("/storage-states/{site}")
+async def invalidate_storage_state(site: str):
+    """Forget the cookies and localStorage saved for a site, e.g. after logging out of it"""
+    store = StorageStateStore.from_config(read_config(DEFAULT_TOML_PATH))
+    return {"site": site_of(site), "removed": store.invalidate(site)}
+
+@app.get("/interventions")
+async def list_interventions():
+    """List the tasks currently paused in interaction mode"""
+    return intervention_channel.list_pending()
+
+@app.post("/interventions/{task_id}")
+async def resolve_intervention(task_id: str, intervention_request: InterventionRequest):
+    """Resume or quit a paused task without affecting any other running task"""
+    try:
+        resolved = intervention_channel.resolve(task_id, intervention_request.action)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not resolved:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Task {task_id} is not waiting for an intervention"
+        )
+    return {"task_id": task_id, "action": intervention_request.action}
+
+@app.post("/jobs", status_code=202)
+async def submit_job(task_request: TaskRequest):
+    """Queue an agent run and return its id immediately"""
+    task_request.task_id = task_request.task_id or uuid.uuid4().hex
+    try:
+        job = job_manager.submit(task_request.task_id, task_request)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"job_id": job.job_id, "status": job.status}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return jsonable_encoder(job.summary())
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Stream each step's action, URL and token usage as server-sent events"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    async def event_source():
+        async for event in job_manager.stream(job_id):
+            yield f"event: step\ndata: {json.dumps(jsonable_encoder(event))}\n\n"
+        # The job may have been pruned since, by this or another process
+        finished_job = job_manager.get(job_id)
+        status = finished_job.status if finished_job is not None else None
+        yield f"event: end\ndata: {json.dumps({'job_id': job_id, 'status': status})}\n\n"
+
+    return StreamingResponse(event_source(), media_type="text/event-stream")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a job, a running job closes its browser context immediately"""
+    if job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if not await job_manager.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} has already finished")
+    return {"job_id": job_id, "status": "cancelling"}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    workers = server_config.get("workers", 1)
+    if workers > 1:
+        # Each worker process imports this module and gets its own event loop and browser pool
+        uvicorn.run("run:app", host="0.0.0.0", port=8000, workers=workers,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)